@@ -0,0 +1,17 @@
+# Benchmarks for the import plugin. They run headless: only the plugin
+# modules that do not depend on pcbnew or wx are imported.
+#
+# Example: python -m benchmark.sexp_parse
+#          python -m benchmark.import_throughput --parts 10 1000 10000
+#          python -m benchmark.legacy_scan
+#          python -m benchmark.sexp_memory --symbols 10000
+#          python -m benchmark.sexp_write
+#          python -m benchmark.library_verify --parts 10000
+#          python -m benchmark.zip_detect
+import sys
+from pathlib import Path
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent / "plugins"
+
+if str(PLUGIN_DIR) not in sys.path:
+    sys.path.insert(0, str(PLUGIN_DIR))
@@ -0,0 +1,269 @@
+"""
+Generators for synthetic library data used by the benchmarks.
+"""
+
+import random
+import zipfile
+from pathlib import Path
+
+
+def kicad_sym_symbol(name: str, footprint: str = "", pins: int = 8) -> str:
+    """Returns a single "(symbol ...)" block in the layout written by KiCad 8"""
+    lines = [
+        f'\t(symbol "{name}"',
+        "\t\t(pin_names\n\t\t\t(offset 1.016)\n\t\t)",
+        "\t\t(exclude_from_sim no)",
+        "\t\t(in_bom yes)",
+        "\t\t(on_board yes)",
+    ]
+    properties = [
+        ("Reference", "U", 0, 7.62),
+        ("Value", name, 0, 5.08),
+        ("Footprint", footprint or name, 0, -7.62),
+        ("Datasheet", f"https://example.com/{name}.pdf", 0, -10.16),
+        ("Description", f"Synthetic part {name}", 0, -12.7),
+    ]
+    for key, value, x, y in properties:
+        lines.append(
+            f'\t\t(property "{key}" "{value}"\n'
+            f"\t\t\t(at {x} {y} 0)\n"
+            "\t\t\t(effects\n\t\t\t\t(font\n\t\t\t\t\t(size 1.27 1.27)\n"
+            "\t\t\t\t)\n\t\t\t)\n\t\t)"
+        )
+    lines.append(f'\t\t(symbol "{name}_0_1"')
+    lines.append(
+        "\t\t\t(rectangle\n\t\t\t\t(start -5.08 5.08)\n"
+        f"\t\t\t\t(end 5.08 {-2.54 * pins / 2:.2f})\n"
+        "\t\t\t\t(stroke\n\t\t\t\t\t(width 0.254)\n\t\t\t\t\t(type default)\n\t\t\t\t)\n"
+        "\t\t\t\t(fill\n\t\t\t\t\t(type background)\n\t\t\t\t)\n\t\t\t)"
+    )
+    lines.append("\t\t)")
+    lines.append(f'\t\t(symbol "{name}_1_1"')
+    for pin in range(pins):
+        x = -7.62 if pin % 2 == 0 else 7.62
+        angle = 0 if pin % 2 == 0 else 180
+        y = 2.54 - 2.54 * (pin // 2)
+        lines.append(
+            f"\t\t\t(pin passive line\n\t\t\t\t(at {x} {y:.2f} {angle})\n"
+            "\t\t\t\t(length 2.54)\n"
+            f'\t\t\t\t(name "P{pin + 1}"\n\t\t\t\t\t(effects\n\t\t\t\t\t\t(font\n'
+            "\t\t\t\t\t\t\t(size 1.27 1.27)\n\t\t\t\t\t\t)\n\t\t\t\t\t)\n\t\t\t\t)\n"
+            f'\t\t\t\t(number "{pin + 1}"\n\t\t\t\t\t(effects\n\t\t\t\t\t\t(font\n'
+            "\t\t\t\t\t\t\t(size 1.27 1.27)\n\t\t\t\t\t\t)\n\t\t\t\t\t)\n\t\t\t\t)\n\t\t\t)"
+        )
+    lines.append("\t\t)")
+    lines.append("\t)")
+    return "\n".join(lines)
+
+
+def kicad_sym_library(symbols: int = 10000, pins: int = 8, prefix="PART") -> str:
+    """Returns a .kicad_sym library with the given number of symbols"""
+    return kicad_sym_symbols(
+        [(f"{prefix}_{i}", f"FP_{prefix}_{i}") for i in range(symbols)], pins
+    )
+
+
+def kicad_sym_symbols(symbols, pins: int = 8) -> str:
+    """Returns a .kicad_sym library with the (name, footprint) pairs of symbols"""
+    out = [
+        "(kicad_symbol_lib",
+        "\t(version 20231120)",
+        '\t(generator "kicad_symbol_editor")',
+        '\t(generator_version "8.0")',
+    ]
+    for name, footprint in symbols:
+        out.append(kicad_sym_symbol(name, footprint, pins))
+    out.append(")")
+    return "\n".join(out) + "\n"
+
+
+def legacy_lib_symbol(name: str, footprint: str = "", pins: int = 8) -> str:
+    """Returns a single "DEF ... ENDDEF" block of a legacy .lib file"""
+    half = (pins + 1) // 2
+    lines = [
+        "#",
+        f"# {name}",
+        "#",
+        f"DEF {name} U 0 40 Y Y 1 F N",
+        'F0 "U" -200 300 50 H V L CNN',
+        f'F1 "{name}" -200 -300 50 H V L CNN',
+        f'F2 "{footprint or name}" 0 0 50 H I C CNN',
+        f'F3 "https://example.com/{name}.pdf" 0 0 50 H I C CNN',
+        "DRAW",
+        f"S -200 200 200 {200 - 100 * half} 0 1 10 f",
+    ]
+    for pin in range(pins):
+        x, direction = (-400, "R") if pin % 2 == 0 else (400, "L")
+        y = 100 - 100 * (pin // 2)
+        lines.append(f"X P{pin + 1} {pin + 1} {x} {y} 200 {direction} 50 50 1 1 P")
+    lines += ["ENDDRAW", "ENDDEF"]
+    return "\n".join(lines)
+
+
+def legacy_lib(symbols, pins: int = 8) -> str:
+    """Returns a legacy .lib file with the (name, footprint) pairs of symbols"""
+    out = ["EESchema-LIBRARY Version 2.3", "#encoding utf-8"]
+    for name, footprint in symbols:
+        out.append(legacy_lib_symbol(name, footprint, pins))
+    out += ["#", "#End Library"]
+    return "\n".join(out) + "\n"
+
+
+def dcm_entry(name: str) -> str:
+    return "\n".join(
+        [
+            "#",
+            f"$CMP {name}",
+            f"D Synthetic part {name}",
+            "K synthetic benchmark",
+            f"F https://example.com/{name}.pdf",
+            "$ENDCMP",
+        ]
+    )
+
+
+def dcm(names) -> str:
+    """Returns a .dcm file with an entry for every name"""
+    out = ["EESchema-DOCLIB  Version 2.0"]
+    out += [dcm_entry(name) for name in names]
+    out += ["#", "#End Doc Library"]
+    return "\n".join(out) + "\n"
+
+
+def kicad_sym_file(name: str, footprint: str = "", pins: int = 8) -> str:
+    """Returns a .kicad_sym file with a single symbol as it comes from the vendors"""
+    return (
+        "(kicad_symbol_lib\n\t(version 20211014)\n\t(generator kicad_symbol_editor)\n"
+        + kicad_sym_symbol(name, footprint, pins)
+        + "\n)\n"
+    )
+
+
+def kicad_mod(name: str, pads: int = 8) -> str:
+    """Returns a .kicad_mod footprint with two rows of SMD pads"""
+    half = (pads + 1) // 2
+    lines = [
+        f'(footprint "{name}" (version 20211014) (generator pcbnew)',
+        '  (layer "F.Cu")',
+        f'  (fp_text reference "REF**" (at 0 {-half - 1}) (layer "F.SilkS")',
+        "    (effects (font (size 1 1) (thickness 0.15)))",
+        "  )",
+        f'  (fp_text value "{name}" (at 0 {half + 1}) (layer "F.Fab")',
+        "    (effects (font (size 1 1) (thickness 0.15)))",
+        "  )",
+    ]
+    for pad in range(pads):
+        x = -2.5 if pad % 2 == 0 else 2.5
+        y = -half / 2 + pad // 2
+        lines.append(
+            f'  (pad "{pad + 1}" smd rect (at {x} {y:.2f}) (size 1.5 0.6) '
+            '(layers "F.Cu" "F.Paste" "F.Mask"))'
+        )
+    lines.append(")")
+    return "\n".join(lines) + "\n"
+
+
+def step_model(name: str, size: int = 64 * 1024, seed: int = 0) -> bytes:
+    """Returns size bytes that start like a STEP file, the rest is random"""
+    header = f"ISO-10303-21;\nHEADER;\nFILE_NAME('{name}.step');\nENDSEC;\n".encode()
+    body = random.Random(f"{seed}:{name}").randbytes(max(0, size - len(header)))
+    return header + body
+
+
+def samacsys_zip(folder, name, pins=8, pads=8, model_size=64 * 1024):
+    """LIB_<name>.zip: <name>/KiCad/... and <name>/3D/<footprint>.stp"""
+    footprint = f"{name}_FP"
+    path = Path(folder) / f"LIB_{name}.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"{name}/KiCad/{name}.kicad_sym", kicad_sym_file(name, footprint, pins))
+        zf.writestr(f"{name}/KiCad/{name}.lib", legacy_lib([(name, footprint)], pins))
+        zf.writestr(f"{name}/KiCad/{name}.dcm", dcm([name]))
+        zf.writestr(f"{name}/KiCad/{footprint}.kicad_mod", kicad_mod(footprint, pads))
+        if model_size:
+            zf.writestr(f"{name}/3D/{footprint}.stp", step_model(footprint, model_size))
+    return path
+
+
+def ultralibrarian_zip(folder, name, pins=8, pads=8, model_size=64 * 1024):
+    """ul_<name>.zip: KiCAD/..., KiCAD/footprints.pretty/... and STEP/<footprint>.step"""
+    footprint = f"{name}_FP"
+    path = Path(folder) / f"ul_{name}.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"KiCAD/{name}.kicad_sym", kicad_sym_file(name, footprint, pins))
+        zf.writestr(f"KiCAD/{name}.dcm", dcm([name]))
+        zf.writestr(
+            f"KiCAD/footprints.pretty/{footprint}.kicad_mod", kicad_mod(footprint, pads)
+        )
+        if model_size:
+            zf.writestr(f"STEP/{footprint}.step", step_model(footprint, model_size))
+    return path
+
+
+def snapeda_zip(folder, name, pins=8, pads=8, model_size=64 * 1024):
+    """<name>.zip: all files in the root of the zipfile"""
+    footprint = f"{name}_FP"
+    path = Path(folder) / f"{name}.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"{name}.kicad_sym", kicad_sym_file(name, footprint, pins))
+        zf.writestr(f"{name}.lib", legacy_lib([(name, footprint)], pins))
+        zf.writestr(f"{name}.dcm", dcm([name]))
+        zf.writestr(f"{footprint}.kicad_mod", kicad_mod(footprint, pads))
+        if model_size:
+            zf.writestr(f"{name}.step", step_model(footprint, model_size))
+    return path
+
+
+def octopart_zip(folder, name, pins=8, pads=8, model_size=0):
+    """oct_<name>.zip: device.lib, device.dcm and device.pretty, without model"""
+    footprint = f"{name}_FP"
+    path = Path(folder) / f"oct_{name}.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("device.lib", legacy_lib([(name, footprint)], pins))
+        zf.writestr("device.dcm", dcm([name]))
+        zf.writestr(f"device.pretty/{footprint}.kicad_mod", kicad_mod(footprint, pads))
+    return path
+
+
+# remote type name: zip generator, as detected by import_lib.get_remote_info()
+VENDOR_ZIPS = {
+    "Samacsys": samacsys_zip,
+    "UltraLibrarian": ultralibrarian_zip,
+    "Snapeda": snapeda_zip,
+    "Octopart": octopart_zip,
+}
+
+
+def vendor_zips(folder, count=10, vendors=None, prefix="NEW", **sizes):
+    """
+    Writes count zipfiles per vendor into folder.
+    :param sizes: pins, pads and model_size of the parts
+    :return: list of the zipfiles
+    """
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    paths = []
+    for vendor in vendors or VENDOR_ZIPS:
+        make_zip = VENDOR_ZIPS[vendor]
+        for i in range(count):
+            paths.append(make_zip(folder, f"{vendor[:3].upper()}_{prefix}{i}", **sizes))
+    return paths
+
+
+def destination_library(folder, name, parts, pins=8, pads=8, prefix="OLD"):
+    """
+    Writes an existing destination library of the import with parts symbols:
+    <name>.kicad_sym, <name>.lib, <name>.dcm and <name>.pretty
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    names = [f"{name[:3].upper()}_{prefix}{i}" for i in range(parts)]
+    symbols = [(n, f"{name}:{n}_FP") for n in names]
+
+    (folder / f"{name}.kicad_sym").write_text(
+        kicad_sym_symbols(symbols, pins), encoding="utf-8"
+    )
+    (folder / f"{name}.lib").write_text(legacy_lib(symbols, pins), encoding="utf-8")
+    (folder / f"{name}.dcm").write_text(dcm(names), encoding="utf-8")
+    pretty = folder / f"{name}.pretty"
+    pretty.mkdir(exist_ok=True)
+    for n in names:
+        (pretty / f"{n}_FP.kicad_mod").write_text(kicad_mod(f"{n}_FP", pads))
@@ -0,0 +1,164 @@
+"""
+Import throughput of import_lib with synthetic Samacsys, UltraLibrarian,
+Snapeda and Octopart zipfiles into destination libraries of different sizes.
+
+python -m benchmark.import_throughput [--parts 10 1000 10000] [--zips 10] [--mode many]
+
+Every scenario runs in a fresh process, so the peak RSS (resource) and the
+bytes written (wchar of /proc/self/io) belong to the import alone.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from . import generators
+
+
+def io_written():
+    """:return: bytes written by this process (wchar) or None if not available"""
+    try:
+        with open("/proc/self/io") as file:
+            for line in file:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss():
+    """:return: peak resident set size of this process in bytes"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_import(dest, zip_files, mode, jobs, lib_converter, verbose):
+    """Imports zip_files into dest, runs in the worker process of a scenario"""
+    from KiCadImport import import_lib
+
+    impart = import_lib()
+    impart.set_DEST_PATH(Path(dest))
+    impart.lib_converter = lib_converter
+    if not verbose:
+        impart.print = lambda *args, **kwargs: None
+
+    written = io_written()
+    start = time.perf_counter()
+    if mode == "many":
+        results = impart.import_many(zip_files, overwrite_if_exists=True, jobs=jobs)
+        failed = sum(res != "OK" for res in results.values())
+    else:
+        failed = 0
+        for zip_file in zip_files:
+            try:
+                impart.import_all(zip_file, overwrite_if_exists=True)
+            except Exception:
+                failed += 1
+    duration = time.perf_counter() - start
+    if written is not None:
+        written = io_written() - written
+    return {
+        "time": duration,
+        "failed": failed,
+        "rss": peak_rss(),
+        "written": written,
+    }
+
+
+def scenario(parts, args):
+    """Prepares a destination with parts symbols per library and imports the zipfiles"""
+    with tempfile.TemporaryDirectory(prefix="impart_bench_") as temp_dir:
+        temp_dir = Path(temp_dir)
+        dest = temp_dir / "libs"
+        for vendor in args.vendors:
+            generators.destination_library(
+                dest, vendor, parts, pins=args.pins, pads=args.pads
+            )
+        zip_files = generators.vendor_zips(
+            temp_dir / "zips",
+            args.zips,
+            args.vendors,
+            pins=args.pins,
+            pads=args.pads,
+            model_size=args.model_size,
+        )
+        zip_files = [str(path) for path in zip_files]
+
+        # spawn: the worker does not inherit the memory of the generators
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(
+                run_import,
+                dest,
+                zip_files,
+                args.mode,
+                args.jobs,
+                args.lib_converter,
+                args.verbose,
+            ).result()
+    result["zips"] = len(zip_files)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--parts",
+        type=int,
+        nargs="+",
+        default=[10, 1000, 10000],
+        help="Symbols in every destination library, one scenario per value",
+    )
+    parser.add_argument("--zips", type=int, default=10, help="Zipfiles per vendor")
+    parser.add_argument(
+        "--vendors",
+        nargs="+",
+        choices=list(generators.VENDOR_ZIPS),
+        default=list(generators.VENDOR_ZIPS),
+    )
+    parser.add_argument("--pins", type=int, default=8, help="Pins per symbol")
+    parser.add_argument("--pads", type=int, default=8, help="Pads per footprint")
+    parser.add_argument(
+        "--model-size", type=int, default=64 * 1024, help="Bytes per 3D model"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["many", "single"],
+        default="many",
+        help="import_many() once or import_all() per zipfile",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="Processes of import_many")
+    parser.add_argument(
+        "--lib-converter", choices=["auto", "kicad-cli", "native"], default="native"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    print(
+        f"{'dest parts':>10}{'zips':>6}{'time [s]':>10}{'parts/s':>10}"
+        f"{'peak RSS [MB]':>15}{'written [MB]':>14}{'per part [kB]':>15}{'failed':>8}"
+    )
+    for parts in args.parts:
+        result = scenario(parts, args)
+        written = result["written"]
+        if written is None:
+            written_mb = per_part = "n/a"
+        else:
+            written_mb = f"{written / 1e6:.1f}"
+            per_part = f"{written / 1e3 / max(1, result['zips']):.1f}"
+        print(
+            f"{parts:>10}{result['zips']:>6}{result['time']:>10.3f}"
+            f"{result['zips'] / result['time']:>10.1f}"
+            f"{result['rss'] / 1e6:>15.1f}{written_mb:>14}{per_part:>15}"
+            f"{result['failed']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
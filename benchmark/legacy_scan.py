@@ -0,0 +1,121 @@
+"""
+Adds one part to destination .lib and .dcm libraries of growing size, with
+the memory-mapped LegacyLibrary and with the line by line rewrite it replaced.
+
+python -m benchmark.legacy_scan [--parts 100 1000 10000 50000] [--repeat 3]
+"""
+
+import argparse
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from . import generators
+from legacy_library import LegacyLibrary
+
+legacy_end_pattern = re.compile("# *end ", re.IGNORECASE)
+
+
+def legacy_add(path: Path, start: str, name: str, lines) -> int:
+    """
+    Adds a component as before the memory-mapped scanner: every line is
+    checked and the whole library is written through <name>~.
+    :return: bytes written
+    """
+    blocks = []
+    components = {}
+    footer = []
+    block = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if legacy_end_pattern.match(line):
+            footer = [line]
+            break
+        if line.startswith(start):
+            if block:
+                blocks.append(block)
+            block = [line]
+            components[line.split()[1]] = len(blocks)
+        else:
+            block.append(line)
+    if block:
+        blocks.append(block)
+    if name not in components:
+        blocks.append(list(lines))
+
+    text = "\n".join([line for block in blocks for line in block] + footer) + "\n"
+    tmp_path = path.with_name(path.name + "~")
+    written = tmp_path.write_bytes(text.encode("utf-8"))
+    tmp_path.replace(path)
+    return written
+
+
+def mmap_add(path: Path, start: str, name: str, lines) -> int:
+    library = LegacyLibrary(path)
+    if name not in library:
+        library.add(name, lines)
+    library.save()
+    return library.last_commit[1] if library.last_commit else 0
+
+
+def measure(func, path: Path, data: bytes, repeat: int, *args):
+    best = None
+    for _ in range(repeat):
+        path.write_bytes(data)
+        start = time.perf_counter()
+        written = func(path, *args)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--parts",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000, 50000],
+        help="Components in the destination library, one row per value",
+    )
+    parser.add_argument("--pins", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    new_lib = generators.legacy_lib_symbol("NEW_PART", "NEW_FP", args.pins)
+    new_dcm = generators.dcm_entry("NEW_PART")
+    print(
+        f"{'file':<6}{'parts':>8}{'size [MB]':>11}{'legacy [ms]':>13}"
+        f"{'mmap [ms]':>11}{'speedup':>9}{'legacy [kB]':>13}{'mmap [kB]':>11}"
+    )
+    with tempfile.TemporaryDirectory(prefix="impart_bench_") as temp_dir:
+        for parts in args.parts:
+            names = [f"OLD{i}" for i in range(parts)]
+            libraries = (
+                (
+                    ".lib",
+                    "DEF ",
+                    generators.legacy_lib([(name, "FP") for name in names], args.pins),
+                    new_lib.splitlines(),
+                ),
+                (".dcm", "$CMP ", generators.dcm(names), new_dcm.splitlines()[1:]),
+            )
+            for suffix, start, text, lines in libraries:
+                path = Path(temp_dir) / ("Samacsys" + suffix)
+                data = text.encode("utf-8")
+                legacy_time, legacy_written = measure(
+                    legacy_add, path, data, args.repeat, start, "NEW_PART", lines
+                )
+                mmap_time, mmap_written = measure(
+                    mmap_add, path, data, args.repeat, start, "NEW_PART", lines
+                )
+                print(
+                    f"{suffix:<6}{parts:>8}{len(data) / 1e6:>11.2f}"
+                    f"{legacy_time * 1e3:>13.2f}{mmap_time * 1e3:>11.2f}"
+                    f"{legacy_time / mmap_time:>8.1f}x"
+                    f"{legacy_written / 1e3:>13.1f}{mmap_written / 1e3:>11.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Runs the --verify health scan over destination libraries of growing size,
+with one process, with a process pool and again with the cache of the
+previous run.
+
+python -m benchmark.library_verify [--parts 1000 10000] [--jobs 4]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from . import generators
+from library_check import CACHE_NAME, LibraryCheck
+
+LIBRARIES = ("Samacsys", "UltraLibrarian", "Snapeda")
+
+
+def run(folder: Path, jobs: int, cache: bool):
+    if not cache:
+        (folder / CACHE_NAME).unlink(missing_ok=True)
+    check = LibraryCheck(folder, jobs=jobs)
+    start = time.perf_counter()
+    problems = check.run()
+    return time.perf_counter() - start, problems, check
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--parts",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+        help="Parts of every library, one row per value",
+    )
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    pool_header = f"{args.jobs} job{'s' if args.jobs != 1 else ''} [s]"
+    print(
+        f"{'parts':>8}{'files':>8}{'1 job [s]':>11}{pool_header:>13}"
+        f"{'cached [s]':>12}{'problems':>10}"
+    )
+    for parts in args.parts:
+        with tempfile.TemporaryDirectory(prefix="impart_bench_") as temp_dir:
+            folder = Path(temp_dir)
+            for name in LIBRARIES:
+                generators.destination_library(folder, name, parts // len(LIBRARIES))
+            # one dangling footprint to be found
+            next(folder.glob("Samacsys.pretty/*.kicad_mod")).unlink()
+
+            single_time, problems, check = run(folder, 1, cache=False)
+            pool_time, pool_problems, _ = run(folder, args.jobs, cache=False)
+            cached_time, cached_problems, cached = run(folder, args.jobs, cache=True)
+            assert problems == pool_problems == cached_problems
+            assert cached.scanned == 0, "unchanged files were parsed again"
+            print(
+                f"{parts:>8}{check.scanned:>8}{single_time:>11.2f}{pool_time:>13.2f}"
+                f"{cached_time:>12.2f}{len(problems):>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Memory of a parsed library as nested lists (parse_sexp) and as CompactSexp,
+measured with tracemalloc, and the time to parse it and to print it again
+with print_sexp.
+
+python -m benchmark.sexp_memory [--symbols 10000] [--footprints 2000]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from . import generators
+from s_expression_parse import parse_sexp, print_sexp
+
+
+def measure(func, *args):
+    """
+    Runs func(*args) once for the duration and once with tracemalloc, which
+    slows down the allocations a lot.
+    :return: result, retained bytes, peak bytes and duration
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = func(*args)
+    duration = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained, peak, duration
+
+
+def parse_all(texts, compact):
+    return [parse_sexp(text, compact=compact) for text in texts]
+
+
+def print_all(trees):
+    return [print_sexp(tree) for tree in trees]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=10000)
+    parser.add_argument("--footprints", type=int, default=2000)
+    parser.add_argument("--pins", type=int, default=8)
+    parser.add_argument("--pads", type=int, default=16)
+    args = parser.parse_args()
+
+    cases = (
+        (
+            f"kicad_sym, {args.symbols} symbols",
+            [generators.kicad_sym_library(args.symbols, args.pins)],
+        ),
+        (
+            f"{args.footprints} kicad_mod",
+            [
+                generators.kicad_mod(f"FP_{index}", args.pads)
+                for index in range(args.footprints)
+            ],
+        ),
+    )
+
+    print(
+        f"{'input':<26}{'format':<9}{'retained [MB]':>15}{'peak [MB]':>11}"
+        f"{'parse [s]':>11}{'print [s]':>11}"
+    )
+    for name, texts in cases:
+        size = sum(len(text) for text in texts)
+        reference = None
+        for compact in (False, True):
+            trees, retained, peak, parse_time = measure(parse_all, texts, compact)
+            printed, _, _, print_time = measure(print_all, trees)
+            lists = [tree.to_list() for tree in trees] if compact else trees
+            if reference is None:
+                reference = lists
+            assert lists == reference, "CompactSexp differs from parse_sexp"
+            if compact:  # nested lists do not know which strings were quoted
+                assert parse_all(printed, False) == reference, "round trip failed"
+            print(
+                f"{name:<26}{'compact' if compact else 'lists':<9}"
+                f"{retained / 1e6:>15.1f}{peak / 1e6:>11.1f}"
+                f"{parse_time:>11.3f}{print_time:>11.3f}"
+            )
+            del trees, printed, lists
+        print(f"{'':<26}{'text':<9}{size / 1e6:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
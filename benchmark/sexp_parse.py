@@ -0,0 +1,104 @@
+"""
+Compares the s-expression parser of the plugin with the original
+regex/groupdict implementation on synthetic .kicad_sym libraries.
+
+python -m benchmark.sexp_parse [--symbols 10000] [--repeat 3]
+"""
+
+import argparse
+import re
+import time
+
+from . import generators
+from s_expression_parse import parse_sexp, iter_sexp, tokenize_sexp, LazyNode
+
+legacy_term_regex = r"""(?mx)
+    \s*(?:
+        (?P<brackl>\()|
+        (?P<brackr>\))|
+        (?P<num>\-?\d+\.\d+|\-?\d+)|
+        (?P<sq>"[^"]*")|
+        (?P<s>[^(^)\s]+)
+       )"""
+
+
+def legacy_parse_sexp(sexp):
+    """parse_sexp as it was implemented before the single-pass scanner"""
+    stack = []
+    out = []
+    for termtypes in re.finditer(legacy_term_regex, sexp):
+        term, value = [(t, v) for t, v in termtypes.groupdict().items() if v][0]
+        if term == "brackl":
+            stack.append(out)
+            out = []
+        elif term == "brackr":
+            assert stack, "Trouble with nesting of brackets"
+            tmpout, out = out, stack.pop(-1)
+            out.append(tmpout)
+        elif term == "num":
+            v = float(value)
+            if v.is_integer():
+                v = int(v)
+            out.append(v)
+        elif term == "sq":
+            out.append(value[1:-1])
+        elif term == "s":
+            out.append(value)
+    assert not stack, "Trouble with nesting of brackets"
+    return out[0]
+
+
+def iter_symbols(sexp):
+    return sum(1 for _ in iter_sexp(sexp, depth=1))
+
+
+def lazy_symbols(sexp):
+    return sum(1 for node in LazyNode.parse(sexp) if node.name == "symbol")
+
+
+def measure(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=10000)
+    parser.add_argument("--pins", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = generators.kicad_sym_library(args.symbols, args.pins)
+    tokens = sum(1 for _ in tokenize_sexp(text))
+    print(
+        f"library: {args.symbols} symbols, {len(text) / 1e6:.1f} MB, {tokens} tokens"
+    )
+
+    legacy_time, legacy_result = measure(legacy_parse_sexp, text, args.repeat)
+    new_time, new_result = measure(parse_sexp, text, args.repeat)
+    iter_time, count = measure(iter_symbols, text, args.repeat)
+    lazy_time, lazy_count = measure(lazy_symbols, text, args.repeat)
+
+    assert new_result == legacy_result, "parse_sexp differs from the legacy parser"
+    assert lazy_count == args.symbols, "LazyNode did not find every symbol"
+
+    print(f"{'parser':<22}{'time [s]':>10}{'tokens/s':>14}{'speedup':>9}")
+    for name, duration in (
+        ("legacy parse_sexp", legacy_time),
+        ("parse_sexp", new_time),
+        ("iter_sexp(depth=1)", iter_time),
+        ("LazyNode children", lazy_time),
+    ):
+        print(
+            f"{name:<22}{duration:>10.3f}{tokens / duration:>14,.0f}"
+            f"{legacy_time / duration:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
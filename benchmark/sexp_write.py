@@ -0,0 +1,112 @@
+"""
+Writes a synthetic .kicad_sym library with the original recursive
+print_sexp, the join-based print_sexp and the streaming SexpWriter, and
+changes every Footprint property with regex substitution and with SexpPatch.
+
+python -m benchmark.sexp_write [--symbols 2000] [--repeat 3]
+"""
+
+import argparse
+import io
+import re
+import time
+
+from . import generators
+from s_expression_parse import (
+    LazyNode,
+    SexpPatch,
+    format_sexp,
+    parse_sexp,
+    print_sexp,
+    select,
+    write_sexp,
+)
+
+
+def legacy_print_sexp(exp):
+    """print_sexp as it was implemented before the join-based writer"""
+    out = ""
+    if type(exp) == type([]):
+        out += "(" + " ".join(legacy_print_sexp(x) for x in exp) + ")"
+    elif type(exp) == type("") and re.search(r"[\s()]", exp):
+        out += '"%s"' % repr(exp)[1:-1].replace('"', '"')
+    else:
+        out += "%s" % exp
+    return out
+
+
+def regex_footprints(text):
+    """one re.sub per symbol, as the former replace_footprint_name()"""
+    for footprint in select(LazyNode.parse(text), "symbol/property[Footprint]")[0]:
+        name = footprint.atoms()[1]
+        pattern = rf'\(property\s+"Footprint"\s+"{re.escape(name)}"'
+        text = re.sub(pattern, f'(property "Footprint" "Samacsys:{name}"', text)
+    return text
+
+
+def patch_footprints(text):
+    patch = SexpPatch(text)
+    for footprint in select(LazyNode.parse(text), "symbol/property[Footprint]")[0]:
+        patch.replace_atom(footprint, 2, "Samacsys:" + footprint.atoms()[1])
+    return patch.text_of()
+
+
+def write_file(tree):
+    file = io.StringIO()
+    write_sexp(tree, file)
+    return file.getvalue()
+
+
+def measure(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=2000)
+    parser.add_argument("--pins", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = generators.kicad_sym_library(args.symbols, args.pins)
+    tree = parse_sexp(text)
+    compact = parse_sexp(text, compact=True)
+    lazy = LazyNode.parse(text)
+    print(f"library: {args.symbols} symbols, {len(text) / 1e6:.1f} MB")
+
+    rows = []
+    legacy_time, legacy_text = measure(legacy_print_sexp, tree, args.repeat)
+    for name, func, arg in (
+        ("legacy print_sexp", legacy_print_sexp, tree),
+        ("print_sexp", print_sexp, tree),
+        ("format_sexp lists", format_sexp, tree),
+        ("format_sexp compact", format_sexp, compact),
+        ("format_sexp LazyNode", format_sexp, lazy),
+        ("write_sexp lists", write_file, tree),
+    ):
+        duration, result = measure(func, arg, args.repeat)
+        # print_sexp does not quote strings like "1", only the writer reads back
+        if "print_sexp" not in name:
+            assert parse_sexp(result) == tree, f"{name} does not read back"
+        rows.append((name, duration, legacy_time))
+
+    # every substitution scans the whole library, run it only once
+    regex_time, regex_text = measure(regex_footprints, text, 1)
+    patch_time, patch_text = measure(patch_footprints, text, args.repeat)
+    assert patch_text == regex_text, "SexpPatch differs from the regex substitution"
+    rows.append(("Footprint re.sub", regex_time, regex_time))
+    rows.append(("Footprint SexpPatch", patch_time, regex_time))
+
+    print(f"{'writer':<24}{'time [s]':>10}{'speedup':>9}")
+    for name, duration, reference in rows:
+        print(f"{name:<24}{duration:>10.3f}{reference / duration:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Lookups of the vendor detection with ZipManifest and with the recursive
+zipfile.Path walk that was used before, on the synthetic vendor zipfiles
+and on layouts with and without directory entries.
+
+python -m benchmark.zip_detect [--zips 50] [--repeat 3]
+
+Every lookup and directory listing of the manifest has to return the same
+entry as the recursive walk, otherwise the benchmark fails.
+"""
+
+import argparse
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from . import generators
+from KiCadImport import ZipManifest
+
+SUFFIXES = [".step", ".stp", ".lib", ".dcm", ".kicad_sym", ".kicad_mod", ".pretty", "KiCad"]
+
+# (names in the zipfile, directory of the lookups), directories end with "/"
+LAYOUTS = [
+    (["a/x.step", "b.step"], ""),  # implied directory after the explicit names
+    (["a/", "a/x.step", "b.step"], ""),
+    (["b.step", "a/x.step"], ""),
+    (["a/b/", "a/b/x.step", "a/y.step", "c.lib"], "a/"),
+    (["N/KiCad/N.lib", "N/KiCad/N.dcm", "N/3D/N.stp", "KiCad/x.kicad_sym"], "N/KiCad/"),
+    (["KiCAD/", "KiCAD/x.pretty/", "KiCAD/x.pretty/x.kicad_mod", "KiCAD/x.lib"], "KiCAD/"),
+]
+
+
+def legacy_unzip(root, suffix):
+    """unzip() as it was implemented before ZipManifest"""
+
+    def zipper(parent):
+        if parent.name.endswith(suffix):
+            return parent
+        elif parent.is_dir():
+            for child in parent.iterdir():
+                match = zipper(child)
+                if match:
+                    return match
+
+    return zipper(root)
+
+
+def layout_zip(folder, index, names) -> zipfile.ZipFile:
+    path = Path(folder) / f"layout{index}.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        for name in names:
+            zf.writestr(name, "" if name.endswith("/") else name)
+    return zipfile.ZipFile(path)
+
+
+def legacy_lookups(zf, directories):
+    root = zipfile.Path(zf)
+    results = []
+    for directory in [""] + directories:
+        start = root.joinpath(directory) if directory else root
+        for suffix in SUFFIXES:
+            match = legacy_unzip(start, suffix)
+            results.append(match.at if match else None)
+    return results
+
+
+def manifest_lookups(zf, directories):
+    manifest = ZipManifest(zf)
+    results = []
+    for directory in [""] + directories:
+        start = manifest.path(directory) if directory else None
+        for suffix in SUFFIXES:
+            match = manifest.find(suffix, start)
+            results.append(match.at if match else None)
+    return results
+
+
+def check_listings(zf):
+    """every directory of the manifest lists its entries like zipfile.Path"""
+    manifest = ZipManifest(zf)
+    for directory in manifest.children:
+        path = manifest.path(directory)
+        expected = [child.at for child in path.iterdir()]
+        assert [child.at for child in manifest.iterdir(path)] == expected, directory
+
+
+def measure(func, cases, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [func(zf, directories) for zf, directories in cases]
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--zips", type=int, default=50, help="zipfiles per vendor")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        cases = []
+        for index, (names, directory) in enumerate(LAYOUTS):
+            zf = layout_zip(folder, index, names)
+            cases.append((zf, [directory] if directory else []))
+        for path in generators.vendor_zips(folder, args.zips, model_size=1024):
+            zf = zipfile.ZipFile(path)
+            directories = [name for name in ZipManifest(zf).children if name]
+            cases.append((zf, directories))
+
+        for zf, _ in cases:
+            check_listings(zf)
+        legacy_time, legacy_results = measure(legacy_lookups, cases, args.repeat)
+        manifest_time, manifest_results = measure(manifest_lookups, cases, args.repeat)
+        for (zf, _), expected, result in zip(cases, legacy_results, manifest_results):
+            assert result == expected, f"{zf.namelist()}: {result} != {expected}"
+
+        print(f"{len(cases)} zipfiles, {len(SUFFIXES)} suffixes per directory")
+        print(f"{'lookup':<20}{'time [s]':>10}{'speedup':>9}")
+        print(f"{'zipfile.Path walk':<20}{legacy_time:>10.3f}{1:>8.1f}x")
+        print(f"{'ZipManifest':<20}{manifest_time:>10.3f}{legacy_time / manifest_time:>8.1f}x")
+        for zf, _ in cases:
+            zf.close()
+
+
+if __name__ == "__main__":
+    main()
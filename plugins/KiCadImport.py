@@ -8,80 +8,376 @@ import pathlib
 from enum import Enum
 from zipfile import Path
 from typing import Tuple, Union, Any
-import re
 import zipfile
-from os import stat, remove
+import tempfile
+import os
+import shutil
+import zlib
 from os.path import isfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import logging
 
 
-if __name__ == "__main__":
-    from kicad_cli import kicad_cli
-    from s_expression_parse import parse_sexp, search_recursive, extract_properties
-else:
+try:
     from .kicad_cli import kicad_cli
-    from .s_expression_parse import parse_sexp, search_recursive, extract_properties
+    from .s_expression_parse import LazyNode, SexpPatch, quote_atom
+    from .s_expression_parse import select, select_one
+    from .symbol_store import SymbolStore
+    from .legacy_library import LegacyLibrary
+    from .model_store import ModelStore, STORE_DIR
+    from .legacy_convert import upgrade_sym_libs, uses_native, CONVERTERS
+    from .legacy_convert import convert as legacy_convert
+    from .impart_stats import ImportStats, text_size
+    from .import_journal import ImportJournal, recover
+    from .library_check import LibraryCheck
+except ImportError:  # started as script or in a worker process
+    from kicad_cli import kicad_cli
+    from s_expression_parse import LazyNode, SexpPatch, quote_atom
+    from s_expression_parse import select, select_one
+    from symbol_store import SymbolStore
+    from legacy_library import LegacyLibrary
+    from model_store import ModelStore, STORE_DIR
+    from legacy_convert import upgrade_sym_libs, uses_native, CONVERTERS
+    from legacy_convert import convert as legacy_convert
+    from impart_stats import ImportStats, text_size
+    from import_journal import ImportJournal, recover
+    from library_check import LibraryCheck
 
 cli = kicad_cli()
 
+# chunk size for copying 3D models out of the zip files
+COPY_BUFSIZE = 1024 * 1024
 
-class Modification(Enum):
-    MKDIR = 0
-    TOUCH_FILE = 1
-    MODIFIED_FILE = 2
-    EXTRACTED_FILE = 3
 
+def check_dir(path: pathlib.Path):
+    """
+    Check if directory exists, if not create it and its parents
+    :param path:
+    """
+    if not path.is_dir():
+        path.mkdir(parents=True)
 
-class ModifiedObject:
-    def __init__(self):
-        self.dict = {}
 
-    def append(self, obj: pathlib.Path, modification: Modification):
-        self.dict[obj] = modification
+def file_crc32(path: pathlib.Path) -> int:
+    """:return: CRC-32 of a file, same as stored in the zipfile directory"""
+    crc = 0
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(COPY_BUFSIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
 
 
-# keeps track of which files were modified in case an error occurs we can revert these changes before exiting
-modified_objects = ModifiedObject()
+def is_extracted(path: pathlib.Path, size: int, crc: int) -> bool:
+    """:return: True if path already has the content of a zip member"""
+    try:
+        if path.stat().st_size != size:
+            return False
+    except OSError:
+        return False
+    return file_crc32(path) == crc
 
 
-def check_file(path: pathlib.Path):
+def extract_member(
+    zf: zipfile.ZipFile, member: str, path: pathlib.Path, journal=None
+):
     """
-    Check if file exists, if not create parent directories and touch file
-    :param path:
+    Copies a zip member in chunks to <name>~ and renames it to path, the
+    member is never loaded into memory as a whole.
+    :param journal: ImportJournal, the rename is done by its commit()
     """
-    if not path.exists():
-        if not path.parent.is_dir():
-            path.parent.mkdir(parents=True)
-            modified_objects.append(path.parent, Modification.MKDIR)
-        path.touch(mode=0o666)
-        modified_objects.append(path, Modification.TOUCH_FILE)
+    if journal is not None:
+        with zf.open(member) as src, journal.open_tmp(path) as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+        journal.replace(path)
+        return
+
+    tmp_path = path.with_name(path.name + "~")
+    try:
+        with zf.open(member) as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+        tmp_path.replace(path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
 
 
-def unzip(root, suffix):
+class REMOTE_TYPES(Enum):
+    Octopart = 0
+    Samacsys = 1
+    UltraLibrarian = 2
+    Snapeda = 3
+
+
+class ZipManifest:
     """
-    return zipfile.Path starting with root ending with suffix else return None
+    Index of all entries of a zipfile, built once from ZipFile.infolist().
+    Entries can be looked up by suffix, basename and directory without
+    walking zipfile.Path.iterdir() again and again.
     """
-    match = None
 
-    def zipper(parent):
-        if parent.name.endswith(suffix):
-            return parent
-        elif parent.is_dir():
-            for child in parent.iterdir():
-                match = zipper(child)
-                if match:
-                    return match
+    def __init__(self, zf: zipfile.ZipFile):
+        self.root = zipfile.Path(zf)
+        self.infos = {}  # name: ZipInfo
+        self.entries = []  # all names incl. implied directories, depth-first order
+        self.children = {"": []}  # directory: [names]
+        self.by_basename = {}  # basename: [names]
+        self.by_extension = {}  # ".ext": [names]
+        self._files = set()
+
+        for info in zf.infolist():
+            self.infos[info.filename] = info
+        # like zipfile.CompleteDirs.namelist(): the names of the zipfile first,
+        # then the implied directories, so iterdir() lists in the same order
+        names = list(self.infos)
+        known = set(names)
+        for name in list(names):
+            parent = self.parent(name)
+            while parent:
+                if parent not in known:
+                    known.add(parent)
+                    names.append(parent)
+                parent = self.parent(parent)
+        for name in names:
+            if name.endswith("/"):
+                self.children.setdefault(name, [])
+            else:
+                self._files.add(name)
+            self.children.setdefault(self.parent(name), []).append(name)
+
+        def walk(directory):
+            for name in self.children.get(directory, ()):
+                self.entries.append(name)
+                walk(name)
+
+        walk("")
+        order = {name: idx for idx, name in enumerate(self.entries)}
+        for name in self.entries:
+            basename = name.rstrip("/").rsplit("/", 1)[-1]
+            self.by_basename.setdefault(basename, []).append(name)
+            dot = basename.rfind(".")
+            if dot >= 0:
+                self.by_extension.setdefault(basename[dot:], []).append(name)
+        self._order = order
+
+    @staticmethod
+    def parent(name: str) -> str:
+        idx = name.rstrip("/").rfind("/")
+        return name[: idx + 1] if idx >= 0 else ""
+
+    def path(self, name: str) -> Path:
+        return zipfile.Path(self.root.root, at=name)
+
+    def exists(self, name: str) -> bool:
+        return name in self._order or name + "/" in self._order
+
+    def iterdir(self, directory: Path):
+        """zipfile.Path.iterdir() without scanning the whole zipfile"""
+        return [self.path(name) for name in self.children.get(directory.at, ())]
+
+    def find(self, suffix: str, directory: Union[Path, None] = None) -> Union[Path, None]:
+        """
+        :return: first entry below directory (depth-first) whose name ends with suffix
+        """
+        prefix = directory.at if directory else ""
+        if suffix.startswith(".") and suffix.count(".") == 1:
+            candidates = self.by_extension.get(suffix, [])
+        else:
+            candidates = [
+                name
+                for basename, names in self.by_basename.items()
+                if basename.endswith(suffix)
+                for name in names
+            ]
+        candidates = [name for name in candidates if name.startswith(prefix)]
+        if not candidates:
+            return None
+        return self.path(min(candidates, key=self._order.__getitem__))
 
-    match = zipper(root)
 
-    return match
+def classify_octopart(manifest: ZipManifest):
+    if not (
+        manifest.exists("device.dcm")
+        and manifest.exists("device.lib")
+        and manifest.exists("device.pretty")
+    ):
+        return None
+    # todo fill in model path for OCTOPART
+    return (
+        manifest.path("device.dcm"),
+        manifest.path("device.lib"),
+        manifest.path("device.pretty/"),
+        manifest.path("device.step"),
+    )
 
 
-class REMOTE_TYPES(Enum):
-    Octopart = 0
-    Samacsys = 1
-    UltraLibrarian = 2
-    Snapeda = 3
+def classify_samacsys(manifest: ZipManifest):
+    directory = manifest.find("KiCad")
+    if not directory:
+        return None
+    dcm_path = manifest.find(".dcm", directory)
+    lib_path = manifest.find(".lib", directory)
+    model_path = manifest.find(".step") or manifest.find(".stp")
+
+    assert dcm_path and (lib_path or manifest.find(".kicad_sym")), "Not in samacsys format"
+    return dcm_path, lib_path, directory, model_path
+
+
+def classify_ultralibrarian(manifest: ZipManifest):
+    if not manifest.exists("KiCAD"):
+        return None
+    directory = manifest.path("KiCAD/")
+    dcm_path = manifest.find(".dcm", directory)
+    lib_path = manifest.find(".lib", directory)
+    footprint_path = manifest.find(".pretty", directory)
+    model_path = manifest.find(".step") or manifest.find(".stp")
+
+    assert (
+        lib_path or manifest.find(".kicad_sym")
+    ) and footprint_path, "Not in ultralibrarian format"
+    return dcm_path, lib_path, footprint_path, model_path
+
+
+def classify_snapeda(manifest: ZipManifest):
+    lib_path = manifest.find(".lib")
+    if not (lib_path or manifest.find(".kicad_sym")):
+        return None
+    footprint = manifest.find(".kicad_mod")
+    footprint_path = manifest.path(manifest.parent(footprint.at)) if footprint else None
+    dcm_path = manifest.find(".dcm")
+    model_path = manifest.find(".step")
+
+    assert footprint_path, "Not in Snapeda format"
+    return dcm_path, lib_path, footprint_path, model_path
+
+
+# checked in this order, the first classifier that does not return None wins
+REMOTE_CLASSIFIERS = [
+    (REMOTE_TYPES.Octopart, classify_octopart),
+    (REMOTE_TYPES.Samacsys, classify_samacsys),
+    (REMOTE_TYPES.UltraLibrarian, classify_ultralibrarian),
+    (REMOTE_TYPES.Snapeda, classify_snapeda),
+]
+
+
+class ImportPart:
+    """Content of a library zipfile, ready to be merged by import_lib.apply_part()"""
+
+    def __init__(self, zip_file, remote_type: REMOTE_TYPES):
+        self.zip_file = zip_file
+        self.remote_type = remote_type
+        self.symbol = None  # (device, symbol_section, header, footer) for .kicad_sym
+        self.lib = None  # (device, lib_entry, lib_entry_replace) for legacy .lib
+        self.dcm = {}  # device: (dcm_entry, dcm_entry_replace)
+        self.footprint = None  # (file name, content)
+        self.footprint_name = None
+        self.legacy_lib = None  # .lib that still has to be converted to .kicad_sym
+        self.model = None  # name of the 3D model in the zipfile
+        self.model_size = None
+        self.model_crc = None
+
+
+class ImportTransaction:
+    """
+    Collects the changes of one or many parts and writes every touched
+    library only once with commit(). All files are written through an
+    ImportJournal, an interrupted commit is finished by recover().
+    """
+
+    def __init__(self, importer: "import_lib"):
+        self.importer = importer
+        self.libraries = {}  # path: LegacyLibrary
+        self.symbol_stores = {}  # path: SymbolStore
+        self.footprints = {}  # path: content
+        self.models = {}  # path: ImportPart
+
+    def library(self, path: pathlib.Path) -> LegacyLibrary:
+        if path not in self.libraries:
+            with self.importer.stats.span("load_library", file=path.name):
+                self.libraries[path] = LegacyLibrary(path)
+        return self.libraries[path]
+
+    def symbol_store(self, path: pathlib.Path) -> SymbolStore:
+        if path not in self.symbol_stores:
+            with self.importer.stats.span("load_library", file=path.name):
+                self.symbol_stores[path] = self.importer.get_symbol_store(path)
+        return self.symbol_stores[path]
+
+    def file_exists(self, path: pathlib.Path) -> bool:
+        return path in self.footprints or path in self.models or path.exists()
+
+    def add_footprint(self, path: pathlib.Path, footprint: str):
+        self.footprints[path] = footprint
+
+    def add_model(self, path: pathlib.Path, part: ImportPart):
+        self.models[path] = part
+
+    def commit(self):
+        journal = ImportJournal(self.importer.DEST_PATH)
+        try:
+            self._stage(journal)
+        except BaseException:
+            journal.abort()
+            raise
+        with self.importer.stats.span("journal_commit"):
+            journal.commit()
+        if self.importer.model_store is not None:
+            self.importer.model_store.save()
+
+        self.libraries = {}
+        self.footprints = {}
+        self.models = {}
+
+    def _stage(self, journal: ImportJournal):
+        """Writes the new contents as temporary files of the journal"""
+        stats = self.importer.stats
+        for symbol_store in self.symbol_stores.values():
+            if not symbol_store.pending:
+                continue
+            check_dir(symbol_store.lib_path.parent)
+            with stats.span("write_kicad_sym", file=symbol_store.lib_path.name) as span:
+                symbol_store.commit(journal)
+                mode, span["bytes_written"] = symbol_store.last_commit
+            stats.count(mode + " .kicad_sym")
+
+        for library in self.libraries.values():
+            if not library.modified:
+                continue
+            check_dir(library.path.parent)
+            stage = "write_" + library.path.suffix.lstrip(".")
+            with stats.span(stage, file=library.path.name) as span:
+                library.save(journal)
+                mode, span["bytes_written"] = library.last_commit
+            stats.count(mode + " " + library.path.suffix)
+
+        for path, footprint in self.footprints.items():
+            check_dir(path.parent)
+            with stats.span("write_footprint", file=path.name) as span:
+                span["bytes_written"] = journal.write(path, footprint.encode("utf-8"))
+
+        models = {}
+        for path, part in self.models.items():
+            models.setdefault(part.zip_file, []).append((path, part.model))
+        model_store = self.importer.model_store
+        for zip_file, members in models.items():
+            with zipfile.ZipFile(zip_file) as zf:
+                for path, member in members:
+                    check_dir(path.parent)
+                    with stats.span("extract_model", file=path.name) as span:
+                        size = zf.getinfo(member).file_size
+                        span["bytes_read"] = size
+                        if model_store is None:
+                            extract_member(zf, member, path, journal)
+                            span["bytes_written"] = size
+                        elif model_store.extract(zf, member, path, journal):
+                            span["bytes_written"] = size
+                        else:
+                            stats.count("model linked")
+
+    def discard(self):
+        """Drops everything that was not committed"""
+        for symbol_store in self.symbol_stores.values():
+            symbol_store.discard()
 
 
 class import_lib:
@@ -90,9 +386,38 @@ class import_lib:
 
     def __init__(self):
         self.KICAD_3RD_PARTY_LINK = "${KICAD_3RD_PARTY}"
+        self.symbol_stores = {}
+        self.model_store = None
+        self.lib_converter = "auto"  # see legacy_convert.CONVERTERS
+        self.stats = ImportStats()
+
+    def get_symbol_store(self, lib_path: pathlib.Path) -> SymbolStore:
+        """indexed .kicad_sym library, kept open between the imports"""
+        store = self.symbol_stores.get(lib_path)
+        if store is None:
+            store = self.symbol_stores[lib_path] = SymbolStore(lib_path)
+        else:
+            store.refresh()
+        return store
 
     def set_DEST_PATH(self, DEST_PATH_=pathlib.Path.home() / "KiCad"):
         self.DEST_PATH = pathlib.Path(DEST_PATH_)
+        # finish or roll back an import that was interrupted by a crash
+        result = recover(self.DEST_PATH)
+        if result:
+            self.print(f"Interrupted import {result}")
+        if self.model_store is not None:
+            self.enable_model_store()
+
+    def enable_model_store(self, enable=True):
+        """
+        Stores every 3D model only once in DEST_PATH/.model_store, the
+        .3dshapes folders get hard links to the stored models.
+        """
+        if enable:
+            self.model_store = ModelStore(self.DEST_PATH / STORE_DIR)
+        else:
+            self.model_store = None
 
     def cleanName(self, name):
         invalid = '<>:"/\\|?* '
@@ -105,122 +430,41 @@ class import_lib:
         self, zf: zipfile.ZipFile
     ) -> Tuple[Path, Path, Path, Path, REMOTE_TYPES]:
         """
-        :param root_path:
-        :type root_path: Path
+        :param zf: zipfile of the library
         :return: dcm_path, lib_path, footprint_path, model_path, remote_type
         """
         self.footprint_name = None
 
-        root_path = zipfile.Path(zf)
-        self.dcm_path = root_path / "device.dcm"
-        self.lib_path = root_path / "device.lib"
-        self.footprint_path = root_path / "device.pretty"
-        self.model_path = root_path / "device.step"
-        # todo fill in model path for OCTOPART
-        if (
-            self.dcm_path.exists()
-            and self.lib_path.exists()
-            and self.footprint_path.exists()
-        ):
-            remote_type = REMOTE_TYPES.Octopart
-            return (
-                self.dcm_path,
-                self.lib_path,
-                self.footprint_path,
-                self.model_path,
-                remote_type,
-            )
-
-        self.lib_path_new = unzip(root_path, ".kicad_sym")
-
-        directory = unzip(root_path, "KiCad")
-        if directory:
-            self.dcm_path = unzip(directory, ".dcm")
-            self.lib_path = unzip(directory, ".lib")
-            self.footprint_path = directory
-            self.model_path = unzip(root_path, ".step")
-            if not self.model_path:
-                self.model_path = unzip(root_path, ".stp")
-
-            assert self.dcm_path and (
-                self.lib_path or self.lib_path_new
-            ), "Not in samacsys format"
-            remote_type = REMOTE_TYPES.Samacsys
-            return (
-                self.dcm_path,
-                self.lib_path,
-                self.footprint_path,
-                self.model_path,
-                remote_type,
-            )
-
-        directory = root_path / "KiCAD"
-        if directory.exists():
-            self.dcm_path = unzip(directory, ".dcm")
-            self.lib_path = unzip(directory, ".lib")
-            self.footprint_path = unzip(directory, ".pretty")
-            self.model_path = unzip(root_path, ".step")
-            if not self.model_path:
-                self.model_path = unzip(root_path, ".stp")
-
-            assert (
-                self.lib_path or self.lib_path_new
-            ) and self.footprint_path, "Not in ultralibrarian format"
-            remote_type = REMOTE_TYPES.UltraLibrarian
-            return (
-                self.dcm_path,
-                self.lib_path,
-                self.footprint_path,
-                self.model_path,
-                remote_type,
-            )
+        self.manifest = ZipManifest(zf)
+        self.lib_path_new = self.manifest.find(".kicad_sym")
 
-        footprint = unzip(root_path, ".kicad_mod")
-        self.lib_path = unzip(root_path, ".lib")
-        if self.lib_path or self.lib_path_new:
-            self.dcm_path = unzip(root_path, ".dcm")
-            # self.footprint_path = root_path
-            self.footprint_path = None
-            if footprint:
-                self.footprint_path = footprint.parent
-            self.model_path = unzip(root_path, ".step")
-            remote_type = REMOTE_TYPES.Snapeda
-
-            assert (
-                self.lib_path or self.lib_path_new
-            ) and self.footprint_path, "Not in Snapeda format"
-            return (
-                self.dcm_path,
-                self.lib_path,
-                self.footprint_path,
-                self.model_path,
-                remote_type,
-            )
+        for remote_type, classify in REMOTE_CLASSIFIERS:
+            paths = classify(self.manifest)
+            if paths:
+                self.dcm_path, self.lib_path, self.footprint_path, self.model_path = paths
+                if remote_type == REMOTE_TYPES.Octopart:
+                    self.lib_path_new = None
+                return (*paths, remote_type)
 
-        if footprint or self.lib_path_new:
+        if self.manifest.find(".kicad_mod") or self.lib_path_new:
             assert False, "Unknown library zipfile"
         else:
             assert False, "zipfile is probably not a library to import"
 
-    def import_dcm(
-        self,
-        device: str,
-        remote_type: REMOTE_TYPES,
-        dcm_path: pathlib.Path,
-        overwrite_if_exists=True,
-        file_ending="",
-    ) -> Tuple[Union[pathlib.Path, None], Union[pathlib.Path, None]]:
+    def read_dcm_timed(self, device: str, dcm_path, zip_file) -> Tuple[list, list]:
+        """read_dcm() as stage "read_dcm" of self.stats"""
+        with self.stats.span("read_dcm", zip=str(zip_file)) as span:
+            if dcm_path:
+                span["bytes_read"] = self.manifest.infos[dcm_path.at].file_size
+            return self.read_dcm(device, dcm_path)
+
+    def read_dcm(self, device: str, dcm_path: pathlib.Path) -> Tuple[list, list]:
         """
         # .dcm file parsing
-        # Note this reads in the existing dcm file for the particular remote repo, and tries to catch any duplicates
-        # before overwriting or creating duplicates. It reads the existing dcm file line by line and simply copy+paste
-        # each line if nothing will be overwritten or duplicated. If something could be overwritten or duplicated, the
-        # terminal will prompt whether to overwrite or to keep the existing content and ignore the new file contents.
-        :returns: dcm_file_read, dcm_file_write
+        # Extracts the description of device from the .dcm file of the zipfile.
+        :returns: lines for a new entry (with header comment), lines to replace an existing entry
         """
 
-        self.dcm_skipped = False
-
         # Array of values defining all attributes of .dcm file
         dcm_attributes = (
             dcm_path.read_text(encoding="utf-8").splitlines()
@@ -264,215 +508,24 @@ class import_lib:
         if index_end is None:
             raise Warning(device + "not found in " + dcm_path.name)
 
-        dcm_file_read = self.DEST_PATH / (remote_type.name + file_ending + ".dcm")
-
-        dcm_file_write = self.DEST_PATH / (remote_type.name + ".dcm~")
-        overwrite_existing = overwrote_existing = False
-
-        check_file(dcm_file_read)
-        check_file(dcm_file_write)
-
-        with dcm_file_read.open("rt", encoding="utf-8") as readfile:
-            with dcm_file_write.open("wt", encoding="utf-8") as writefile:
-                if stat(dcm_file_read).st_size == 0:
-                    # todo Handle appending to empty file
-                    with dcm_file_read.open("wt", encoding="utf-8") as template_file:
-                        template = ["EESchema-DOCLIB  Version 2.0", "#End Doc Library"]
-                        template_file.writelines(line + "\n" for line in template)
-                        template_file.close()
-
-                for line in readfile:
-                    if re.match("# *end ", line, re.IGNORECASE):
-                        if not overwrote_existing:
-                            writefile.write(
-                                "\n".join(
-                                    dcm_attributes[
-                                        (
-                                            index_start
-                                            if index_header_start is None
-                                            else index_header_start
-                                        ) : index_end
-                                    ]
-                                )
-                                + "\n"
-                            )
-                        writefile.write(line)
-                        break
-                    elif line.startswith("$CMP "):
-                        component_name = line[5:].strip()
-                        if component_name.startswith(device):
-                            if overwrite_if_exists:
-                                overwrite_existing = True
-                                self.print("Overwrite existing dcm")
-                            else:
-                                overwrite_existing = False
-                                # self.print("Import of dcm skipped")
-                                self.dcm_skipped = True
-                                return dcm_file_read, dcm_file_write
-                            writefile.write(
-                                "\n".join(dcm_attributes[index_start:index_end]) + "\n"
-                            )
-                            overwrote_existing = True
-                        else:
-                            writefile.write(line)
-                    elif overwrite_existing:
-                        if line.startswith("$ENDCMP"):
-                            overwrite_existing = False
-                    else:
-                        writefile.write(line)
-
-        return dcm_file_read, dcm_file_write
-
-    def import_model(
-        self, model_path: pathlib.Path, remote_type: REMOTE_TYPES, overwrite_if_exists
-    ) -> Union[pathlib.Path, None]:
-        # --------------------------------------------------------------------------------------------------------
-        # 3D Model file extraction
-        # --------------------------------------------------------------------------------------------------------
-
-        if not model_path:
-            return False
-
-        write_file = self.DEST_PATH / (remote_type.name + ".3dshapes") / model_path.name
-
-        self.model_skipped = False
-
-        if write_file.exists():
-            if overwrite_if_exists:
-                overwrite_existing = True
-            else:
-                self.print("Import of 3d model skipped")
-                self.model_skipped = True
-                return model_path
-
-        if model_path.is_file():
-            check_file(write_file)
-            write_file.write_bytes(model_path.read_bytes())
-            modified_objects.append(write_file, Modification.EXTRACTED_FILE)
-            if overwrite_if_exists:
-                self.print("Overwrite existing 3d model")
-            else:
-                self.print("Import 3d model")
-
-        return model_path
-
-    def import_footprint(
-        self,
-        remote_type: REMOTE_TYPES,
-        footprint_path: pathlib.Path,
-        found_model: pathlib.Path,
-        overwrite_if_exists=True,
-    ) -> Tuple[Union[pathlib.Path, None], Union[pathlib.Path, None]]:
-        """
-        # Footprint file parsing
-        :returns: footprint_file_read, footprint_file_write
-        """
-
-        footprint_file_read = None
-        footprint_file_write = None
-        self.footprint_skipped = False
-
-        footprint_path_item_tmp = None
-        for (
-            footprint_path_item
-        ) in footprint_path.iterdir():  # try to use only newer file
-            if footprint_path_item.name.endswith(".kicad_mod"):
-                footprint_path_item_tmp = footprint_path_item
-                break
-            elif footprint_path_item.name.endswith(".mod"):
-                footprint_path_item_tmp = footprint_path_item
-
-        footprint_path_item = footprint_path_item_tmp
-        if not footprint_path_item:
-            self.print("No footprint found")
-            return footprint_file_read, footprint_file_write
-
-        if footprint_path_item.name.endswith("mod"):
-            footprint = footprint_path_item.read_text(encoding="utf-8")
-
-            footprint_write_path = self.DEST_PATH / (remote_type.name + ".pretty")
-            footprint_file_read = footprint_write_path / footprint_path_item.name
-            footprint_file_write = footprint_write_path / (
-                footprint_path_item.name + "~"
-            )
-
-            if found_model:
-                footprint.splitlines()
-                model_path = f"{self.KICAD_3RD_PARTY_LINK}/{remote_type.name}.3dshapes/{found_model.name}"
-                model = [
-                    f'  (model "{model_path}"',
-                    "    (offset (xyz 0 0 0))",
-                    "    (scale (xyz 1 1 1))",
-                    "    (rotate (xyz 0 0 0))",
-                    "  )",
-                ]
-
-                overwrite_existing = overwrote_existing = False
-
-                if footprint_file_read.exists():
-                    if overwrite_if_exists:
-                        overwrite_existing = True
-                        self.print("Overwrite existing footprint")
-                    else:
-                        self.print("Import of footprint skipped")
-                        self.footprint_skipped = True
-                        return footprint_file_read, footprint_file_write
-
-                check_file(footprint_file_read)
-                with footprint_file_read.open("wt", encoding="utf-8") as wr:
-                    wr.write(footprint)
-                    overwrote_existing = True
-
-                check_file(footprint_file_write)
-
-                with footprint_file_read.open("rt", encoding="utf-8") as readfile:
-                    with footprint_file_write.open("wt", encoding="utf-8") as writefile:
-                        if stat(footprint_file_read).st_size == 0:
-                            # todo Handle appending to empty file?
-                            pass
-
-                        lines = readfile.readlines()
-
-                        write_3d_into_file = False
-                        for line_idx, line in enumerate(lines):
-                            if not write_3d_into_file and line_idx == len(lines) - 1:
-                                writefile.writelines(
-                                    model_line + "\n" for model_line in model
-                                )
-                                writefile.write(line)
-                                break
-                            elif line.strip().startswith(r"(model"):
-                                writefile.write(model[0] + "\n")
-                                write_3d_into_file = True
-                            else:
-                                writefile.write(line)
-                    self.print("Import footprint")
-            else:
-                check_file(footprint_file_write)
-                with footprint_file_write.open("wt", encoding="utf-8") as wr:
-                    wr.write(footprint)
-                    self.print("Import footprint")
-
-        return footprint_file_read, footprint_file_write
+        entry_start = index_start if index_header_start is None else index_header_start
+        return (
+            dcm_attributes[entry_start:index_end],
+            dcm_attributes[index_start:index_end],
+        )
 
-    def import_lib(
-        self,
-        remote_type: REMOTE_TYPES,
-        lib_path: pathlib.Path,
-        overwrite_if_exists=True,
-    ) -> Tuple[str, Union[pathlib.Path, None], Union[pathlib.Path, None]]:
+    def read_lib(
+        self, remote_type: REMOTE_TYPES, lib_path: pathlib.Path
+    ) -> Tuple[str, list, list, Union[str, None]]:
         """
         .lib file parsing
-        Note this reads in the existing lib file for the particular remote repo, and tries to catch any duplicates
-        before overwriting or creating duplicates. It reads the existing dcm file line by line and simply copy+paste
-        each line if nothing will be overwritten or duplicated. If something could be overwritten or duplicated, the
-        terminal will prompt whether to overwrite or to keep the existing content and ignore the new file contents.
-        :returns: device, lib_file_read, lib_file_write
+        Extracts the single device of the legacy .lib file of the zipfile and
+        points its footprint into the library of the remote.
+        :returns: device, lines for a new entry (with header comment), lines to replace an existing entry, footprint_name
         """
 
-        self.lib_skipped = False
-
         device = None
+        footprint_name = None
         lib_lines = lib_path.read_text(encoding="utf-8").splitlines()
 
         # Find which lines contain the component information in file to be imported
@@ -493,321 +546,495 @@ class import_lib:
                 if line.startswith("F2"):
                     footprint = line.split()[1]
                     footprint = footprint.strip('"')
-                    self.footprint_name = self.cleanName(footprint)
+                    footprint_name = self.cleanName(footprint)
                     lib_lines[line_idx] = line.replace(
-                        footprint, remote_type.name + ":" + self.footprint_name, 1
+                        footprint, remote_type.name + ":" + footprint_name, 1
                     )
                 elif line.startswith("ENDDEF"):
                     index_end = line_idx + 1
-                elif line.startswith("F1 "):
-                    lib_lines[line_idx] = line.replace(device, device, 1)
             elif line.startswith("DEF "):
                 raise Warning("Multiple devices in " + lib_path.name)
         if index_end is None:
-            raise Warning(device + " not found in " + lib_path.name)
-
-        lib_file_read = self.DEST_PATH / (remote_type.name + ".lib")
-        lib_file_write = self.DEST_PATH / (remote_type.name + ".lib~")
-        overwrite_existing = overwrote_existing = overwritten = False
-
-        check_file(lib_file_read)
-        check_file(lib_file_write)
-
-        with lib_file_read.open("rt", encoding="utf-8") as readfile:
-            with lib_file_write.open("wt", encoding="utf-8") as writefile:
-                if stat(lib_file_read).st_size == 0:
-                    # todo Handle appending to empty file
-                    with lib_file_read.open("wt", encoding="utf-8") as template_file:
-                        template = [
-                            "EESchema-LIBRARY Version 2.4",
-                            "#encoding utf-8",
-                            "# End Library",
-                        ]
-                        template_file.writelines(line + "\n" for line in template)
-                        template_file.close()
-
-                # For each line in the existing lib file (not the file being read from the zip. The lib file you will
-                # add it to.)
-                for line in readfile:
-                    # Is this trying to match ENDDRAW, ENDDEF, End Library or any of the above?
-                    if re.match("# *end ", line, re.IGNORECASE):
-                        # If you already overwrote the new info don't add it to the end
-                        if not overwrote_existing:
-                            writefile.write(
-                                "\n".join(
-                                    lib_lines[
-                                        (
-                                            index_start
-                                            if index_header_start is None
-                                            else index_header_start
-                                        ) : index_end
-                                    ]
-                                )
-                                + "\n"
-                            )
-                        writefile.write(line)
-                        break
-                    # Catch start of new component definition
-                    elif line.startswith("DEF "):
-                        component_name = line.split()[1]
-                        # Catch if the currently read component matches the name of the component you are planning to
-                        # write
-                        if component_name.startswith(device):
-                            # Ask if you want to overwrite existing component
-
-                            if overwrite_if_exists:
-                                overwrite_existing = True
-                                overwritten = True
-                                self.print("Overwrite existing lib")
-                            else:
-                                self.print("Import of lib skipped")
-                                self.lib_skipped = True
-                                return device, lib_file_read, lib_file_write
-                            writefile.write(
-                                "\n".join(lib_lines[index_start:index_end]) + "\n"
-                            )
-                            overwrote_existing = True
-                        else:
-                            writefile.write(line)
-                    elif overwrite_existing:
-                        if line.startswith("ENDDEF"):
-                            overwrite_existing = False
-                    else:
-                        writefile.write(line)
-        if not overwritten:
-            self.print("Import lib")
-        return device, lib_file_read, lib_file_write
-
-    def import_lib_new(
-        self,
-        remote_type: REMOTE_TYPES,
-        lib_path: pathlib.Path,
-        overwrite_if_exists=True,
-    ) -> Tuple[str, Union[pathlib.Path, None], Union[pathlib.Path, None]]:
-        symbol_name = None
-
-        def extract_symbol_names(input_text):
-            pattern = r'"(.*?)"'  # Searches for text in quotes
-            # Searches for "(symbol" followed by text in quotes
-            pattern = r'\(symbol\s+"(.*?)"'
-            matches = re.findall(pattern, input_text)
-            return matches
-
-        symbol_name = None
-
-        def replace_footprint_name(string, original_name, remote_type_name, new_name):
-            escaped_original_name = re.escape(original_name)
-            pattern = rf'\(property\s+"Footprint"\s+"{escaped_original_name}"'
-            replacement = f'(property "Footprint" "{remote_type_name}:{new_name}"'
-            modified_string = re.sub(pattern, replacement, string, flags=re.MULTILINE)
-            return modified_string
-
-        def extract_symbol_section_new(sexpression: str, symbol_name):
-            pattern = re.compile(
-                r'\(symbol "{}"(.*?)\)\n\)'.format(re.escape(symbol_name)), re.DOTALL
-            )
-            match = pattern.search(sexpression)
-            if match:
-                return f'(symbol "{symbol_name}"{match.group(1)})'
-            return None
-
-        RAW_text = lib_path.read_text(encoding="utf-8")  # new
-        sexp_list = parse_sexp(RAW_text)  # new
-
-        symbol_name = search_recursive(sexp_list, "symbol")  # new
-        symbol_properties = extract_properties(sexp_list)  # new
-
-        symbol_section = extract_symbol_section_new(RAW_text, symbol_name)
+            raise Warning(str(device) + " not found in " + lib_path.name)
+
+        entry_start = index_start if index_header_start is None else index_header_start
+        return (
+            device,
+            lib_lines[entry_start:index_end],
+            lib_lines[index_start:index_end],
+            footprint_name,
+        )
 
-        Footprint_name_raw = symbol_properties["Footprint"]  # new
-        self.footprint_name = self.cleanName(Footprint_name_raw)
+    def read_symbol(
+        self, remote_type: REMOTE_TYPES, RAW_text: str
+    ) -> Tuple[str, str, str, str, Union[str, None]]:
+        """
+        .kicad_sym file parsing
+        Extracts the first symbol of the .kicad_sym file of the zipfile and
+        points its footprint into the library of the remote.
+        :returns: symbol_name, symbol_section, header, footer, footprint_name
+        """
 
-        symbol_section = replace_footprint_name(
-            symbol_section, Footprint_name_raw, remote_type.name, self.footprint_name
-        )
+        # only the first symbol and its properties are parsed
+        library = LazyNode.parse(RAW_text)
+        symbol = select_one(library, "symbol")
+        if symbol is None or symbol.end is None:
+            raise Warning("No symbol found in the .kicad_sym file")
+        symbol_name = symbol.key
+
+        # text around the symbols if the library has to be created
+        header = RAW_text[: symbol.start]
+        footer = RAW_text[library.end - 1 :] if library.end is not None else ")\n"
+
+        # only the value of the property is written again, the rest of the
+        # symbol is copied unchanged
+        patch = SexpPatch(RAW_text)
+        footprint_name = None
+        for footprint in select(symbol, "property[Footprint]")[0]:
+            Footprint_name_raw = footprint.atoms()[1:2]
+            if Footprint_name_raw and Footprint_name_raw[0]:
+                footprint_name = self.cleanName(Footprint_name_raw[0])
+                patch.replace_atom(
+                    footprint, 2, remote_type.name + ":" + footprint_name
+                )
+        symbol_section = patch.text_of(symbol.start, symbol.end)
 
-        lib_file_read = self.DEST_PATH / (remote_type.name + ".kicad_sym")
-        lib_file_read_old = self.DEST_PATH / (remote_type.name + "_kicad_sym.kicad_sym")
-        lib_file_write = self.DEST_PATH / (remote_type.name + ".kicad_sym~")
-        if isfile(lib_file_read_old) and not isfile(lib_file_read):
-            lib_file_read = lib_file_read_old
+        return symbol_name, symbol_section, header, footer, footprint_name
 
-        if not lib_file_read.exists():  # library does not yet exist
-            with lib_file_write.open("wt", encoding="utf-8") as writefile:
-                text = RAW_text.strip().split("\n")
-                writefile.write(text[0] + "\n")
-                writefile.write(symbol_section + "\n")
-                writefile.write(text[-1])
+    def read_footprint(self, footprint_path) -> Union[Tuple[str, str], None]:
+        """:returns: file name and content of the footprint, .kicad_mod is preferred"""
+        if not footprint_path:
+            return None
 
-            check_file(lib_file_read)
-            self.print("Import kicad_sym")
-            return symbol_name, lib_file_read, lib_file_write
+        footprint_path_item = None
+        for item in self.manifest.iterdir(footprint_path):  # try to use only newer file
+            if item.name.endswith(".kicad_mod"):
+                footprint_path_item = item
+                break
+            elif item.name.endswith(".mod"):
+                footprint_path_item = item
 
-        check_file(lib_file_read)
+        if not footprint_path_item:
+            return None
+        return footprint_path_item.name, footprint_path_item.read_text(encoding="utf-8")
 
-        lib_file_txt = lib_file_read.read_text(encoding="utf-8")
-        existing_libs = extract_symbol_names(lib_file_txt)
+    def convert_lib(self, lib_path) -> Union[str, None]:
+        """
+        Converts a legacy .lib of the zipfile to .kicad_sym with kicad-cli or
+        natively, see self.lib_converter.
+        :returns: content of the .kicad_sym file or None
+        """
+        return self.convert_libs([lib_path.read_text(encoding="utf-8")])[0]
 
-        if symbol_name in existing_libs:
-            if overwrite_if_exists:
-                self.print("Overwrite existing kicad_sym is not implemented")  # TODO
+    def convert_libs(self, lib_texts) -> list:
+        """
+        Converts the content of several legacy .lib files to .kicad_sym, with
+        as few kicad-cli calls as possible.
+        :returns: content of the .kicad_sym files, None if a conversion failed
+        """
+        results = []
+        with self.stats.span("convert") as span:
+            span["bytes_read"] = sum(text_size(lib_text) for lib_text in lib_texts)
+            if uses_native(self.lib_converter, cli):  # no temporary files needed
+                for lib_text in lib_texts:
+                    try:
+                        results.append(legacy_convert(lib_text))
+                    except (ValueError, IndexError) as e:
+                        self.print(f"Error converting .lib: {e}")
+                        results.append(None)
             else:
-                self.print("Import of kicad_sym skipped")
-
-            return symbol_name, lib_file_read, lib_file_write
+                results = self.convert_libs_cli(lib_texts)
+            for result in results:
+                if result is not None:
+                    self.print("compatibility mode: convert from .lib to .kicad_sym")
+                    span["bytes_written"] += text_size(result)
+                else:
+                    self.print("error during conversion")
+        return results
+
+    def convert_libs_cli(self, lib_texts) -> list:
+        """Converts .lib contents with one kicad-cli call through temporary files"""
+        results = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            conversions = []
+            for index, lib_text in enumerate(lib_texts):
+                temp_path = pathlib.Path(temp_dir) / f"temp{index}.lib"
+                temp_path_new = temp_path.with_suffix(".kicad_sym")
+                temp_path.write_text(lib_text, encoding="utf-8")
+                conversions.append((temp_path, temp_path_new))
+
+            upgrade_sym_libs(conversions, "kicad-cli", cli)
+            for _, temp_path_new in conversions:
+                if temp_path_new.is_file():
+                    results.append(temp_path_new.read_text(encoding="utf-8"))
+                else:
+                    results.append(None)
+        return results
 
-        closing_bracket = lib_file_txt.rfind(")")
+    def prepare_part(
+        self,
+        zip_file: pathlib.Path,
+        import_old_format=True,
+        symbol_text=None,
+        defer_conversion=False,
+    ) -> ImportPart:
+        """
+        Reads everything that has to be imported from a library zipfile.
+        Nothing in DEST_PATH is touched, see apply_part().
+        :param symbol_text: .kicad_sym content if the .lib was already converted
+        :param defer_conversion: only keep the .lib in part.legacy_lib, so that
+            import_many() can convert all of them together
+        """
+        with zipfile.ZipFile(zip_file) as zf:
+            with self.stats.span("detect", zip=str(zip_file)):
+                (
+                    dcm_path,
+                    lib_path,
+                    footprint_path,
+                    model_path,
+                    remote_type,
+                ) = self.get_remote_info(zf)
 
-        with lib_file_write.open("wt", encoding="utf-8") as writefile:
-            writefile.write(lib_file_txt[:closing_bracket])
-            writefile.write(symbol_section + "\n")
-            writefile.write(lib_file_txt[closing_bracket:])
+            self.print("Identify " + remote_type.name)
 
-        self.print("Import kicad_sym")
+            part = ImportPart(zip_file, remote_type)
 
-        return symbol_name, lib_file_read, lib_file_write
+            if self.lib_path_new:
+                symbol_text = self.lib_path_new.read_text(encoding="utf-8")
+            elif lib_path and symbol_text is None:  # compatibility mode
+                if defer_conversion:
+                    part.legacy_lib = lib_path.read_text(encoding="utf-8")
+                else:
+                    symbol_text = self.convert_lib(lib_path)
+
+            if symbol_text:
+                with self.stats.span("parse_symbol", zip=str(zip_file)) as span:
+                    span["bytes_read"] = text_size(symbol_text)
+                    (
+                        device,
+                        symbol_section,
+                        header,
+                        footer,
+                        part.footprint_name,
+                    ) = self.read_symbol(remote_type, symbol_text)
+                part.symbol = (device, symbol_section, header, footer)
+                part.dcm[device] = self.read_dcm_timed(device, dcm_path, zip_file)
+                if not import_old_format:
+                    lib_path = None
 
-    def import_all(
-        self, zip_file: pathlib.Path, overwrite_if_exists=True, import_old_format=True
+            if lib_path:
+                with self.stats.span("read_lib", zip=str(zip_file)) as span:
+                    span["bytes_read"] = self.manifest.infos[lib_path.at].file_size
+                    device, lib_entry, lib_entry_replace, footprint_name = (
+                        self.read_lib(remote_type, lib_path)
+                    )
+                part.lib = (device, lib_entry, lib_entry_replace)
+                if device not in part.dcm:
+                    part.dcm[device] = self.read_dcm_timed(device, dcm_path, zip_file)
+                if not part.footprint_name:
+                    part.footprint_name = footprint_name
+
+            with self.stats.span("read_footprint", zip=str(zip_file)) as span:
+                part.footprint = self.read_footprint(footprint_path)
+                if part.footprint:
+                    span["bytes_read"] = text_size(part.footprint[1])
+
+            if model_path and model_path.is_file():
+                part.model = model_path.at
+                info = self.manifest.infos[part.model]
+                part.model_size = info.file_size
+                part.model_crc = info.CRC
+
+        return part
+
+    def apply_part(
+        self, part: ImportPart, transaction: "ImportTransaction", overwrite_if_exists=True
     ):
-        """zip is a pathlib.Path to import the symbol from"""
-        if not zipfile.is_zipfile(zip_file):
-            return None
-
-        self.print(f"Import: {zip_file}")
-
-        with zipfile.ZipFile(zip_file) as zf:
-            (
-                dcm_path,
-                lib_path,
-                footprint_path,
-                model_path,
-                remote_type,
-            ) = self.get_remote_info(zf)
-
-            self.print("Identify " + remote_type.name)
+        """
+        Merges a prepared part into the libraries of the transaction. Either all
+        changes of the part are applied or, if an error occurs, none of them.
+        """
+        remote = part.remote_type.name
+        changes = []
+        dcm_files = {}
+
+        if part.symbol:
+            device, symbol_section, header, footer = part.symbol
+
+            lib_file = self.DEST_PATH / (remote + ".kicad_sym")
+            lib_file_old = self.DEST_PATH / (remote + "_kicad_sym.kicad_sym")
+            if isfile(lib_file_old) and not isfile(lib_file):
+                lib_file = lib_file_old
+
+            symbol_store = transaction.symbol_store(lib_file)
+            if not symbol_store.exists() and device not in symbol_store:
+                symbol_store.set_header(header, footer)
+                changes.append((symbol_store.stage, device, symbol_section))
+                self.print("Import kicad_sym")
+            elif device in symbol_store:
+                if overwrite_if_exists:
+                    changes.append((symbol_store.stage, device, symbol_section))
+                    self.print("Overwrite existing kicad_sym")
+                else:
+                    self.print("Import of kicad_sym skipped")
+            else:
+                changes.append((symbol_store.stage, device, symbol_section))
+                self.print("Import kicad_sym")
 
-            CompatibilityMode = False
-            if lib_path and not self.lib_path_new:
-                CompatibilityMode = True
+            file_ending = "_kicad_sym" if "_kicad_sym" in lib_file.name else ""
+            dcm_files[self.DEST_PATH / (remote + file_ending + ".dcm")] = device
 
-                temp_path = self.DEST_PATH / "temp.lib"
-                temp_path_new = self.DEST_PATH / "temp.kicad_sym"
+        if part.lib:
+            device, lib_entry, lib_entry_replace = part.lib
 
-                if temp_path.exists():
-                    remove(temp_path)
-                if temp_path_new.exists():
-                    remove(temp_path_new)
+            library = transaction.library(self.DEST_PATH / (remote + ".lib"))
+            if device in library:
+                if overwrite_if_exists:
+                    changes.append((library.replace, device, lib_entry_replace))
+                    self.print("Overwrite existing lib")
+                else:
+                    self.print("Import of lib skipped")
+            else:
+                changes.append((library.add, device, lib_entry))
+                self.print("Import lib")
 
-                with temp_path.open("wt", encoding="utf-8") as writefile:
-                    text = lib_path.read_text(encoding="utf-8")
-                    writefile.write(text)
+            dcm_files.setdefault(self.DEST_PATH / (remote + ".dcm"), device)
 
-                if temp_path.exists() and cli.exists():
-                    cli.upgrade_sym_lib(temp_path, temp_path_new)
-                    self.print("compatibility mode: convert from .lib to .kicad_sym")
+        for dcm_file, device in dcm_files.items():
+            dcm_entry, dcm_entry_replace = part.dcm[device]
 
-                if temp_path_new.exists() and temp_path_new.is_file():
-                    self.lib_path_new = temp_path_new
+            library = transaction.library(dcm_file)
+            if device in library:
+                if overwrite_if_exists:
+                    changes.append((library.replace, device, dcm_entry_replace))
+                    self.print("Overwrite existing dcm")
+            else:
+                changes.append((library.add, device, dcm_entry))
+
+        model_name = None
+        if part.model:
+            model_name = pathlib.PurePosixPath(part.model).name
+            model_file = self.DEST_PATH / (remote + ".3dshapes") / model_name
+            if transaction.file_exists(model_file):
+                if model_file not in transaction.models and is_extracted(
+                    model_file, part.model_size, part.model_crc
+                ):
+                    self.print("3d model unchanged, skipped")
+                    self.stats.count("model unchanged")
+                elif overwrite_if_exists:
+                    changes.append((transaction.add_model, model_file, part))
+                    self.print("Overwrite existing 3d model")
                 else:
-                    self.print("error during conversion")
+                    self.print("Import of 3d model skipped")
+            else:
+                changes.append((transaction.add_model, model_file, part))
+                self.print("Import 3d model")
 
-            if self.lib_path_new:
-                device, lib_file_new_read, lib_file_new_write = self.import_lib_new(
-                    remote_type, self.lib_path_new, overwrite_if_exists
-                )
+        if part.footprint:
+            footprint_file_name, footprint = part.footprint
+            footprint_file_name = pathlib.PurePosixPath(footprint_file_name)
 
-                file_ending = ""
-                if "_kicad_sym" in lib_file_new_read.name:
-                    file_ending = "_kicad_sym"
+            if model_name:
+                model_path = f"{self.KICAD_3RD_PARTY_LINK}/{remote}.3dshapes/{model_name}"
+                with self.stats.span("inject_model", zip=str(part.zip_file)) as span:
+                    span["bytes_read"] = text_size(footprint)
+                    footprint = self.add_model_to_footprint(footprint, model_path)
 
-                dcm_file_new_read, dcm_file_new_write = self.import_dcm(
-                    device,
-                    remote_type,
-                    dcm_path,
-                    overwrite_if_exists,
-                    file_ending=file_ending,
+            footprint_file = (
+                self.DEST_PATH / (remote + ".pretty") / footprint_file_name.name
+            )
+            if part.footprint_name and part.footprint_name != footprint_file_name.stem:
+                self.print(
+                    'Warning renaming footprint file "'
+                    + footprint_file_name.stem
+                    + '" to "'
+                    + part.footprint_name
+                    + '"'
+                )
+                footprint_file = footprint_file.parent / (
+                    part.footprint_name + footprint_file_name.suffix
                 )
-                if not import_old_format:
-                    lib_path = None
 
-            if CompatibilityMode:
-                if temp_path.exists():
-                    remove(temp_path)
-                if temp_path_new.exists():
-                    remove(temp_path_new)
+            if transaction.file_exists(footprint_file):
+                if overwrite_if_exists:
+                    changes.append((transaction.add_footprint, footprint_file, footprint))
+                    self.print("Overwrite existing footprint")
+                else:
+                    self.print("Import of footprint skipped")
+            else:
+                changes.append((transaction.add_footprint, footprint_file, footprint))
+                self.print("Import footprint")
+        else:
+            self.print("No footprint found")
 
-            if lib_path:
-                device, lib_file_read, lib_file_write = self.import_lib(
-                    remote_type, lib_path, overwrite_if_exists
-                )
+        for change, *args in changes:
+            change(*args)
 
-                dcm_file_read, dcm_file_write = self.import_dcm(
-                    device, remote_type, dcm_path, overwrite_if_exists
-                )
+    def add_model_to_footprint(self, footprint: str, model_path: str) -> str:
+        """
+        Points the (model ...) of the footprint to model_path or adds one,
+        the rest of the footprint is copied unchanged.
+        """
+        root = LazyNode.parse(footprint)
+        if root is None or root.end is None:  # e.g. legacy .mod
+            return footprint
+
+        patch = SexpPatch(footprint)
+        for model in root.find_all("model"):
+            spans = model.atom_spans()
+            if len(spans) > 1:
+                patch.replace_atom(model, 1, model_path)
+            else:
+                patch.replace(spans[0][1], spans[0][1], " " + quote_atom(model_path))
+        if not patch:
+            model = ["model", model_path]
+            for name, xyz in (("offset", 0), ("scale", 1), ("rotate", 0)):
+                model.append([name, ["xyz", xyz, xyz, xyz]])
+            patch.append(root, model, quote_strings=True)
+        return patch.text_of()
 
-            found_model = self.import_model(
-                model_path, remote_type, overwrite_if_exists
-            )
+    def import_all(
+        self, zip_file: pathlib.Path, overwrite_if_exists=True, import_old_format=True
+    ):
+        """zip is a pathlib.Path to import the symbol from"""
+        if not zipfile.is_zipfile(zip_file):
+            return None
 
-            footprint_file_read, footprint_file_write = self.import_footprint(
-                remote_type, footprint_path, found_model, overwrite_if_exists
-            )
+        self.print(f"Import: {zip_file}")
 
-            # replace read files with write files only after all operations succeeded
-            if self.lib_path_new:
-                if lib_file_new_write.exists():
-                    lib_file_new_write.replace(lib_file_new_read)
+        part = self.prepare_part(zip_file, import_old_format)
 
-                if dcm_file_new_write.exists() and not self.dcm_skipped:
-                    dcm_file_new_write.replace(dcm_file_new_read)
-                elif dcm_file_new_write.exists():
-                    remove(dcm_file_new_write)
+        transaction = ImportTransaction(self)
+        try:
+            self.apply_part(part, transaction, overwrite_if_exists)
+            # write files only after all operations succeeded
+            transaction.commit()
+        finally:
+            transaction.discard()
 
-            if lib_path:
-                if dcm_file_write.exists() and not self.dcm_skipped:
-                    dcm_file_write.replace(dcm_file_read)
-                elif dcm_file_write.exists():
-                    remove(dcm_file_write)
-
-                if lib_file_write.exists() and not self.lib_skipped:
-                    lib_file_write.replace(lib_file_read)
-                elif lib_file_write.exists():
-                    remove(lib_file_write)
-
-            if (
-                footprint_file_read
-                and (self.footprint_name != footprint_file_read.stem)
-                and not self.footprint_skipped
-            ):
-                self.print(
-                    'Warning renaming footprint file "'
-                    + footprint_file_read.stem
-                    + '" to "'
-                    + self.footprint_name
-                    + '"'
-                )
+        return ("OK",)
 
-                if footprint_file_read.exists():
-                    remove(footprint_file_read)
-                footprint_file_read = footprint_file_read.parent / (
-                    self.footprint_name + footprint_file_read.suffix
+    def prepare_many(self, zip_files, import_old_format=True, jobs=1):
+        """
+        Runs prepare_part() for every zipfile, with jobs > 1 in a process pool.
+        Legacy .lib files are converted together at the end.
+        :yields: zip_file, ImportPart or the exception raised by prepare_part()
+        """
+        deferred = []
+        for zip_file, part in self._prepare_many(zip_files, import_old_format, jobs):
+            if isinstance(part, ImportPart) and part.legacy_lib is not None:
+                deferred.append(part)
+            else:
+                yield zip_file, part
+
+        if not deferred:
+            return
+        lib_texts = [part.legacy_lib for part in deferred]
+        for part, symbol_text in zip(deferred, self.convert_libs(lib_texts)):
+            zip_file = part.zip_file
+            part.legacy_lib = None
+            if symbol_text is not None:
+                try:
+                    part = self.prepare_part(
+                        zip_file, import_old_format, symbol_text=symbol_text
+                    )
+                except Exception as e:
+                    part = e
+            yield zip_file, part
+
+    def _prepare_many(self, zip_files, import_old_format, jobs):
+        if jobs > 1 and len(zip_files) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                prepared = executor.map(
+                    _prepare_part, zip_files, repeat(import_old_format)
                 )
+                for zip_file, (part, messages, events) in zip(zip_files, prepared):
+                    for msg in messages:
+                        self.print(msg)
+                    for event in events:
+                        self.stats.record(event)
+                    yield zip_file, part
+            return
+
+        for zip_file in zip_files:
+            self.print(f"Import: {zip_file}")
+            try:
+                part = self.prepare_part(
+                    zip_file, import_old_format, defer_conversion=True
+                )
+            except Exception as e:
+                part = e
+            yield zip_file, part
 
-            if (
-                footprint_file_write
-                and footprint_file_write.exists()
-                and not self.footprint_skipped
-            ):
-                footprint_file_write.replace(footprint_file_read)
-            elif footprint_file_write and footprint_file_write.exists():
-                remove(footprint_file_write)
-
-        return ("OK",)
+    def import_many(
+        self, zip_files, overwrite_if_exists=True, import_old_format=True, jobs=1
+    ):
+        """
+        Imports several library zipfiles at once. The parts are grouped by
+        remote type and every destination library is written only once at the
+        end. A zipfile that can not be imported is reported and skipped, the
+        rest of the batch is imported anyway.
+
+        With jobs > 1 the zipfiles are read in that many worker processes,
+        all libraries are still written by this process only.
+        :returns: {zip_file: "OK", None if it is not a zipfile or the error}
+        """
+        zip_files = list(zip_files)
+        results = {zip_file: None for zip_file in zip_files}
+        parts = []
+        candidates = [zip_file for zip_file in zip_files if zipfile.is_zipfile(zip_file)]
+        for zip_file, part in self.prepare_many(candidates, import_old_format, jobs):
+            if isinstance(part, Exception):
+                results[zip_file] = part
+                self.print(f"Error {pathlib.Path(zip_file).name}: {part}")
+            else:
+                parts.append(part)
+
+        transaction = ImportTransaction(self)
+        try:
+            for part in sorted(parts, key=lambda part: part.remote_type.value):
+                self.print(f"Import {part.remote_type.name}: {part.zip_file}")
+                try:
+                    self.apply_part(part, transaction, overwrite_if_exists)
+                    results[part.zip_file] = "OK"
+                    self.stats.count("parts imported")
+                except Exception as e:
+                    results[part.zip_file] = e
+                    self.print(f"Error {pathlib.Path(part.zip_file).name}: {e}")
+
+            transaction.commit()
+        except Exception as e:
+            for zip_file, res in results.items():
+                if res == "OK":
+                    results[zip_file] = e
+            raise
+        finally:
+            transaction.discard()
+
+        return {zip_file: results[zip_file] for zip_file in zip_files}
+
+
+def _prepare_part(zip_file, import_old_format=True):
+    """import_lib.prepare_part() for a worker process of import_lib.prepare_many()"""
+    impart = import_lib()
+    messages = [f"Import: {zip_file}"]
+    impart.print = messages.append
+    events = []  # replayed into the stats of the main process
+    impart.stats.add_observer(events.append)
+    try:
+        part = impart.prepare_part(zip_file, import_old_format, defer_conversion=True)
+        return part, messages, events
+    except Exception as e:
+        return e, messages, events
 
 
 def main(
-    lib_file, lib_folder, overwrite=False, KICAD_3RD_PARTY_LINK="${KICAD_3RD_PARTY}"
+    lib_file,
+    lib_folder,
+    overwrite=False,
+    KICAD_3RD_PARTY_LINK="${KICAD_3RD_PARTY}",
+    dedup_models=False,
+    lib_converter="auto",
 ):
     lib_folder = pathlib.Path(lib_folder)
     lib_file = pathlib.Path(lib_file)
@@ -825,6 +1052,8 @@ def main(
     impart = import_lib()
     impart.KICAD_3RD_PARTY_LINK = KICAD_3RD_PARTY_LINK
     impart.set_DEST_PATH(lib_folder)
+    impart.enable_model_store(dedup_models)
+    impart.lib_converter = lib_converter
     try:
         (res,) = impart.import_all(lib_file, overwrite_if_exists=overwrite)
         print(res)
@@ -834,8 +1063,79 @@ def main(
         print(e)
 
 
+def main_many(
+    lib_files,
+    lib_folder,
+    overwrite=False,
+    KICAD_3RD_PARTY_LINK="${KICAD_3RD_PARTY}",
+    jobs=1,
+    dedup_models=False,
+    lib_converter="auto",
+    show_stats=False,
+    trace_file=None,
+):
+    lib_folder = pathlib.Path(lib_folder)
+
+    print("overwrite", overwrite)
+
+    if not lib_folder.is_dir():
+        print(f"Error destination folder {lib_folder} does not exist!")
+        return 0
+
+    impart = import_lib()
+    impart.KICAD_3RD_PARTY_LINK = KICAD_3RD_PARTY_LINK
+    impart.set_DEST_PATH(lib_folder)
+    impart.enable_model_store(dedup_models)
+    impart.lib_converter = lib_converter
+    if trace_file:
+        impart.stats.open_trace(trace_file)
+    try:
+        results = impart.import_many(
+            lib_files, overwrite_if_exists=overwrite, jobs=jobs
+        )
+    except Exception as e:
+        print(e)
+        return 0
+    finally:
+        impart.stats.close()
+
+    for lib_file, res in results.items():
+        print(f"{pathlib.Path(lib_file).name}: {res}")
+    if show_stats:
+        print(impart.stats.summary())
+    return sum(res == "OK" for res in results.values())
+
+
+def main_verify(lib_folder, KICAD_3RD_PARTY_LINK="${KICAD_3RD_PARTY}", jobs=1):
+    """
+    Checks the libraries of lib_folder, see LibraryCheck.
+    :return: number of problems, -1 if lib_folder can not be read
+    """
+    lib_folder = pathlib.Path(lib_folder)
+    if not lib_folder.is_dir():
+        print(f"Error destination folder {lib_folder} does not exist!")
+        return -1
+
+    check = LibraryCheck(lib_folder, path_variable=KICAD_3RD_PARTY_LINK, jobs=jobs)
+    try:
+        problems = check.run()
+    except OSError as e:
+        print(f"Error destination folder {lib_folder} can not be read: {e}")
+        return -1
+    for problem in problems:
+        name = f" {problem.name}" if problem.name else ""
+        detail = f" ({problem.detail})" if problem.detail else ""
+        print(f"{problem.path}: {problem.kind}{name}{detail}")
+    print(
+        f"{len(problems)} problems, {check.scanned} files checked, "
+        f"{check.cached} unchanged files skipped"
+    )
+    return len(problems)
+
+
 if __name__ == "__main__":
     import argparse
+    import sys
     logging.basicConfig(level=logging.ERROR)
 
     # Example: python plugins/KiCadImport.py --download-folder Demo/libs --lib-folder import_test
@@ -852,7 +1152,15 @@ if __name__ == "__main__":
     )
     group.add_argument("--download-file", help="Path to the zip file to import.")
 
-    group.add_argument("--easyeda", help="Import easyeda part. example: C2040")
+    group.add_argument(
+        "--easyeda", help="Import easyeda parts. example: C2040 or C2040,C1525"
+    )
+
+    group.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the libraries of --lib-folder for dangling footprints, missing 3D models, duplicate symbols and orphaned .dcm entries",
+    )
 
     parser.add_argument(
         "--lib-folder",
@@ -866,6 +1174,48 @@ if __name__ == "__main__":
         help="Overwrite existing files if they already exist",
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes reading the zip files of --download-folder or the libraries of --verify (0: one per CPU core)",
+    )
+
+    parser.add_argument(
+        "--dedup-models",
+        action="store_true",
+        help="Store identical 3D models only once and hard link them into the .3dshapes folders",
+    )
+
+    parser.add_argument(
+        "--lib-converter",
+        choices=CONVERTERS,
+        default="auto",
+        help="Conversion of legacy .lib files (auto: kicad-cli if available, else native)",
+    )
+
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the time and bytes of every import stage after --download-folder",
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="Append every import stage of --download-folder as JSON line to this file",
+    )
+
+    parser.add_argument(
+        "--easyeda-cache",
+        help="Cache folder of the EasyEDA downloads (default: .easyeda_cache in --lib-folder)",
+    )
+
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Import the --easyeda parts only from the cache, without network access",
+    )
+
     parser.add_argument(
         "--path-variable",
         help="Example: if only project-specific '${KIPRJMOD}' standard is '${KICAD_3RD_PARTY}'",
@@ -886,6 +1236,8 @@ if __name__ == "__main__":
             lib_folder=args.lib_folder,
             overwrite=args.overwrite_if_exists,
             KICAD_3RD_PARTY_LINK=path_variable,
+            dedup_models=args.dedup_models,
+            lib_converter=args.lib_converter,
         )
     elif args.download_folder:
         download_folder = pathlib.Path(args.download_folder)
@@ -894,29 +1246,50 @@ if __name__ == "__main__":
         elif not lib_folder.is_dir():
             print(f"Error destination folder {lib_folder} does not exist!")
         else:
-            for zip_file in download_folder.glob("*.zip"):
-                if (
-                    zip_file.is_file() and zip_file.stat().st_size >= 1024
-                ):  # Check if it's a file and at least 1 KB
-                    main(
-                        lib_file=zip_file,
-                        lib_folder=args.lib_folder,
-                        overwrite=args.overwrite_if_exists,
-                        KICAD_3RD_PARTY_LINK=path_variable,
-                    )
+            zip_files = [
+                zip_file
+                for zip_file in download_folder.glob("*.zip")
+                if zip_file.is_file() and zip_file.stat().st_size >= 1024
+            ]  # Check if it's a file and at least 1 KB
+            main_many(
+                lib_files=zip_files,
+                lib_folder=args.lib_folder,
+                overwrite=args.overwrite_if_exists,
+                KICAD_3RD_PARTY_LINK=path_variable,
+                jobs=args.jobs if args.jobs > 0 else (os.cpu_count() or 1),
+                dedup_models=args.dedup_models,
+                lib_converter=args.lib_converter,
+                show_stats=args.stats,
+                trace_file=args.trace,
+            )
     elif args.easyeda:
         if not lib_folder.is_dir():
             print(f"Error destination folder {lib_folder} does not exist!")
         else:
-            component_id = str(args.easyeda).strip
-            print("Try to import EeasyEDA /  LCSC Part# : ", component_id)
+            component_ids = [
+                component_id.strip()
+                for component_id in str(args.easyeda).split(",")
+                if component_id.strip()
+            ]
+            print("Try to import EeasyEDA /  LCSC Part# : ", ", ".join(component_ids))
             from impart_easyeda import easyeda2kicad_wrapper
 
-            easyeda_import = easyeda2kicad_wrapper()
+            easyeda_import = easyeda2kicad_wrapper(
+                cache_dir=args.easyeda_cache, offline=args.offline
+            )
 
-            easyeda_import.full_import(
-                component_id="C2040",
+            results = easyeda_import.batch_import(
+                component_ids,
                 base_folder=lib_folder,
-                overwrite=False,
+                overwrite=args.overwrite_if_exists,
                 lib_var=path_variable,
             )
+            for component_id, res in results.items():
+                print(f"{component_id}: {'OK' if res == 0 else 'failed'}")
+    elif args.verify:
+        problems = main_verify(
+            lib_folder=lib_folder,
+            KICAD_3RD_PARTY_LINK=path_variable,
+            jobs=args.jobs if args.jobs > 0 else (os.cpu_count() or 1),
+        )
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,413 @@
+import gzip
+import http.client
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, Union
+
+# same endpoints as easyeda2kicad.easyeda.easyeda_api, can be replaced by a
+# local stand-in server, e.g. {"cad": "http://127.0.0.1:8000/cad/{lcsc_id}", ...}
+DEFAULT_ENDPOINTS = {
+    "cad": "https://easyeda.com/api/products/{lcsc_id}/components?version=6.4.19.5",
+    "obj": "https://modules.easyeda.com/3dmodel/{uuid}",
+    "step": "https://modules.easyeda.com/qAxj6KHrDKw4blvCG8QJPs7Y/{uuid}",
+}
+HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Referer": "https://easyeda.com/",
+}
+
+MAX_WORKERS = 4  # parts fetched at the same time
+RETRIES = 3  # additional attempts after a failed request
+BACKOFF = 0.5  # seconds before the first retry, doubled for every retry
+RATE_LIMIT = 10.0  # requests per second over all workers, 0: unlimited
+TIMEOUT = 30
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# response cache next to the EasyEDA library, e.g. <DEST_PATH>/.easyeda_cache
+CACHE_DIR = ".easyeda_cache"
+CACHE_TTL = 30 * 24 * 3600  # seconds until an entry is fetched again
+CACHE_MAX_SIZE = 500 * 1000 * 1000  # bytes, least recently used entries are removed
+CACHE_SUFFIX = {"cad": ".json", "obj": ".obj", "step": ".step"}
+
+
+class FetchError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Spaces the requests of all threads at least 1 / rate seconds apart"""
+
+    def __init__(self, rate: float = RATE_LIMIT):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, one per thread and host"""
+
+    def __init__(self, timeout: float = TIMEOUT):
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.ssl_context = None
+
+    def get(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        conn = connections.get((scheme, netloc))
+        if conn is None:
+            if scheme == "https":
+                if self.ssl_context is None:
+                    self.ssl_context = create_ssl_context()
+                conn = http.client.HTTPSConnection(
+                    netloc, timeout=self.timeout, context=self.ssl_context
+                )
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            connections[(scheme, netloc)] = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def drop(self, scheme: str, netloc: str):
+        """Closes the connection of this thread, the next get() reconnects"""
+        conn = getattr(self.local, "connections", {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+
+class ResponseCache:
+    """
+    On-disk cache of the EasyEDA responses: CAD data by LCSC id, OBJ and
+    STEP models by uuid, e.g. <root>/cad/C2040.json, <root>/step/<uuid>.step
+
+    Every entry is a file written through a rename. Its mtime is the time it
+    was stored (TTL), its atime is set with every hit (LRU). Several
+    processes or workstations can share the folder, there is no index.
+    """
+
+    def __init__(self, root, ttl: float = CACHE_TTL, max_size: int = CACHE_MAX_SIZE):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.ttl = ttl
+        self.max_size = max_size
+        self.size = None  # bytes of all entries, counted with the first put()
+        self.lock = threading.Lock()
+
+    def path(self, kind: str, key: str) -> str:
+        safe_key = "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+        return os.path.join(self.root, kind, safe_key + CACHE_SUFFIX[kind])
+
+    def get(self, kind: str, key: str, allow_expired=False) -> Union[bytes, None]:
+        """:return: cached response or None if it is missing or expired"""
+        path = self.path(kind, key)
+        try:
+            st = os.stat(path)
+            if not allow_expired and self.ttl and time.time() - st.st_mtime > self.ttl:
+                return None
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except OSError:
+            return None
+        return data
+
+    def put(self, kind: str, key: str, data: bytes):
+        path = self.path(kind, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}~"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                old_size = os.stat(path).st_size
+            except OSError:
+                old_size = 0
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"EasyEDA cache: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.entries())
+            else:
+                self.size += len(data) - old_size
+            if self.max_size and self.size > self.max_size:
+                self.evict()
+
+    def entries(self):
+        """:yields: path, size, atime of all entries"""
+        for kind in CACHE_SUFFIX:
+            try:
+                with os.scandir(os.path.join(self.root, kind)) as it:
+                    for entry in it:
+                        if entry.name.endswith("~") or not entry.is_file():
+                            continue
+                        st = entry.stat()
+                        yield entry.path, st.st_size, st.st_atime_ns
+            except OSError:
+                continue
+
+    def evict(self):
+        """Removes the least recently used entries until 90% of max_size is reached"""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+
+def create_ssl_context() -> ssl.SSLContext:
+    """Uses the certificates of certifi if it is installed (like easyeda2kicad)"""
+    context = ssl.create_default_context()
+    try:
+        import certifi
+
+        context.load_verify_locations(cafile=certifi.where())
+    except (ImportError, OSError):
+        pass
+    return context
+
+
+def model_uuid(cad_data: dict) -> Union[str, None]:
+    """:return: uuid of the 3D model of the footprint, see Easyeda3dModelImporter"""
+    try:
+        shape = cad_data["packageDetail"]["dataStr"]["shape"]
+    except (KeyError, TypeError):
+        return None
+    for line in shape:
+        fields = line.split("~")
+        if fields[0] == "SVGNODE" and len(fields) > 1:
+            try:
+                return json.loads(fields[1])["attrs"]["uuid"]
+            except (ValueError, KeyError, TypeError):
+                return None
+    return None
+
+
+def parse_cad(body: bytes) -> Union[dict, None]:
+    """:return: "result" of an API response or None if the part was not found"""
+    try:
+        response = json.loads(body.decode("utf-8"))
+    except ValueError:
+        return None
+    if not isinstance(response, dict) or response.get("success") is False:
+        return None
+    return response.get("result") or None
+
+
+class FetchResult:
+    def __init__(self, lcsc_id: str):
+        self.lcsc_id = lcsc_id
+        self.cad_data = None  # "result" of the API response
+        self.uuid = None  # of the 3D model
+        self.raw_obj = None
+        self.step = None
+        self.error = None
+
+
+class EasyedaFetcher:
+    """
+    Downloads the CAD data and 3D models of many LCSC parts at the same time.
+
+    All requests share keep-alive connections (one per worker thread and
+    host), failed requests are retried with exponential backoff and the
+    request rate of all workers together is limited. fetch_many() returns
+    the results in the order of the part numbers, so the caller can write
+    the libraries one part after the other while the next parts download.
+
+    With a ResponseCache the responses are stored and reused until they
+    expire. In offline mode only the cache is used, also expired entries.
+    """
+
+    def __init__(
+        self,
+        endpoints: Union[Dict[str, str], None] = None,
+        max_workers: int = MAX_WORKERS,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        rate_limit: float = RATE_LIMIT,
+        timeout: float = TIMEOUT,
+        cache: Union[ResponseCache, None] = None,
+        offline: bool = False,
+    ):
+        self.endpoints = dict(DEFAULT_ENDPOINTS, **(endpoints or {}))
+        self.cache = cache
+        self.offline = offline
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.pool = ConnectionPool(timeout)
+
+    def request(self, url: str) -> Union[bytes, None]:
+        """
+        GET with retries.
+        :return: body or None if the resource does not exist (404)
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            try:
+                conn = self.pool.get(parts.scheme, parts.netloc)
+                conn.request("GET", path, headers=HEADERS)
+                response = conn.getresponse()
+                body = response.read()
+                if response.getheader("Connection", "").lower() == "close":
+                    self.pool.drop(parts.scheme, parts.netloc)
+                if response.status == 200:
+                    if body[:2] == b"\x1f\x8b":
+                        body = gzip.decompress(body)
+                    return body
+                if response.status == 404:
+                    return None
+                error = FetchError(f"HTTP {response.status} {url}")
+                if response.status not in RETRY_STATUS:
+                    raise error
+                retry_after = response.getheader("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+            except (OSError, http.client.HTTPException) as e:
+                self.pool.drop(parts.scheme, parts.netloc)
+                error = FetchError(f"{e.__class__.__name__} {url}: {e}")
+            if attempt < self.retries:
+                logging.debug(f"{error}, retry in {delay}s")
+                time.sleep(delay)
+                delay *= 2
+        raise error
+
+    def get(self, kind: str, key: str, url: str, valid=None) -> Union[bytes, None]:
+        """
+        :param valid: valid(data) is True if the response may be cached
+        :return: response from the cache or the server, None if not available
+        """
+        if self.cache is not None:
+            data = self.cache.get(kind, key, allow_expired=self.offline)
+            if data is not None:
+                return data
+        if self.offline:
+            return None
+        data = self.request(url)
+        if data and self.cache is not None and (valid is None or valid(data)):
+            self.cache.put(kind, key, data)
+        return data
+
+    def get_cad_data(self, lcsc_id: str) -> Union[dict, None]:
+        """:return: CAD data like EasyedaApi.get_cad_data_of_component() or None"""
+        url = self.endpoints["cad"].format(lcsc_id=lcsc_id)
+        body = self.get("cad", lcsc_id, url, valid=parse_cad)
+        return parse_cad(body) if body else None
+
+    def get_raw_3d_model_obj(self, uuid: str) -> Union[str, None]:
+        body = self.get("obj", uuid, self.endpoints["obj"].format(uuid=uuid))
+        return body.decode("utf-8") if body is not None else None
+
+    def get_step_3d_model(self, uuid: str) -> Union[bytes, None]:
+        return self.get("step", uuid, self.endpoints["step"].format(uuid=uuid))
+
+    def fetch(self, lcsc_id: str) -> FetchResult:
+        """Downloads the CAD data and the 3D model (OBJ and STEP) of a part"""
+        result = FetchResult(lcsc_id)
+        try:
+            result.cad_data = self.get_cad_data(lcsc_id)
+            if not result.cad_data:
+                if self.offline:
+                    result.error = f"Part {lcsc_id} is not in the cache (offline mode)"
+                else:
+                    result.error = (
+                        f"Failed to fetch data from EasyEDA API for part {lcsc_id}"
+                    )
+                return result
+            result.uuid = model_uuid(result.cad_data)
+            if result.uuid:
+                result.raw_obj = self.get_raw_3d_model_obj(result.uuid)
+                result.step = self.get_step_3d_model(result.uuid)
+        except FetchError as e:
+            result.error = str(e)
+        return result
+
+    def fetch_many(self, lcsc_ids: Iterable[str]) -> Iterator[FetchResult]:
+        """
+        Fetches the parts in max_workers threads. At most 2 * max_workers
+        results are held back, so a long list does not fill the memory with
+        3D models.
+        :yields: FetchResult in the order of lcsc_ids
+        """
+        lcsc_ids = iter(lcsc_ids)
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for lcsc_id in lcsc_ids:
+                window.append(executor.submit(self.fetch, lcsc_id))
+                if len(window) >= 2 * self.max_workers:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    with EasyedaFetcher() as fetcher:
+        for result in fetcher.fetch_many(sys.argv[1:] or ["C2040"]):
+            if result.error:
+                print(result.lcsc_id, result.error)
+            else:
+                print(
+                    result.lcsc_id,
+                    result.cad_data.get("title"),
+                    result.uuid,
+                    len(result.raw_obj or ""),
+                    len(result.step or b""),
+                )
@@ -0,0 +1,272 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Set, Tuple, Union
+
+SEEN_VERSION = 2
+# a zip file is imported once it was not modified for SETTLE_TIME seconds
+SETTLE_TIME = 1.0
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_event_header = struct.Struct("iIII")
+
+
+def scan_zips(folder: Union[str, Path]) -> Dict[str, Tuple[int, int]]:
+    """:return: {name: (size, mtime_ns)} of all zip files in folder"""
+    zips = {}
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".zip") and entry.is_file():
+                    st = entry.stat()
+                    zips[entry.name] = (st.st_size, st.st_mtime_ns)
+    except OSError:
+        pass
+    return zips
+
+
+class Inotify:
+    """Minimal inotify binding, reports the zip files written or moved into a folder"""
+
+    def __init__(self, folder: Union[str, Path]):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(folder)), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+        self.overflow = False
+
+    @classmethod
+    def create(cls, folder) -> Union["Inotify", None]:
+        """:return: Inotify or None if inotify is not available"""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            return cls(folder)
+        except (OSError, AttributeError):
+            return None
+
+    def read(self, timeout: float) -> Set[str]:
+        """Waits up to timeout seconds for events, :return: names of the changed files"""
+        names = set()
+        if self.fd < 0:  # closed
+            return names
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return names
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflow = True
+            elif name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class SeenFiles:
+    """
+    Zip files that were already imported, keyed by (name, size, mtime_ns).
+    Stored as JSON so a restart of KiCad does not import the folder again.
+    The files are stored per import folder and library folder, after a change
+    of the library folder the zip files are imported into the new one.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path, None],
+        folder: Union[str, Path],
+        destination: Union[str, Path, None] = None,
+    ):
+        self.path = Path(path) if path else None
+        self.folder = str(Path(folder).resolve())
+        self.destination = str(Path(destination).resolve()) if destination else ""
+        self.files: Set[Tuple[str, int, int]] = set()
+        self.load()
+
+    def _read(self) -> dict:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data["version"] == SEEN_VERSION:
+                return data
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+        return {"version": SEEN_VERSION, "folders": {}}
+
+    def load(self):
+        if self.path is None:
+            return
+        folder = self._read()["folders"].get(self.folder, {})
+        entries = folder.get(self.destination, [])
+        self.files = {(name, size, mtime) for name, size, mtime in entries}
+
+    def save(self):
+        if self.path is None:
+            return
+        data = self._read()  # keeps the entries of the other folders
+        folder = data["folders"].setdefault(self.folder, {})
+        folder[self.destination] = sorted(self.files)
+        tmp_path = self.path.with_name(self.path.name + "~")
+        tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        tmp_path.replace(self.path)
+
+    def __contains__(self, key: Tuple[str, int, int]) -> bool:
+        return key in self.files
+
+    def add(self, key: Tuple[str, int, int]):
+        self.files.add(key)
+
+    def prune(self, zips: Dict[str, Tuple[int, int]]):
+        """Forgets files that are not in the folder anymore"""
+        self.files = {key for key in self.files if zips.get(key[0]) == key[1:]}
+
+
+class FolderWatcher:
+    """
+    Reports new zip files of a folder once they are completely written.
+
+    Uses inotify where available, otherwise the folder is polled with
+    os.scandir. A file is ready if its mtime is at least settle seconds old,
+    so partial downloads are picked up only after they are finished.
+    """
+
+    def __init__(
+        self,
+        folder: Union[str, Path],
+        seen_path: Union[str, Path, None] = None,
+        settle: float = SETTLE_TIME,
+        min_size: int = 0,
+        max_size: Union[int, None] = None,
+        use_inotify: bool = True,
+        destination: Union[str, Path, None] = None,
+    ):
+        self.folder = Path(folder)
+        self.destination = Path(destination) if destination else None
+        self.settle = settle
+        self.min_size = min_size
+        self.max_size = max_size
+        self.seen = SeenFiles(seen_path, folder, destination)
+        # reported by new_files() but not imported, name: (name, size, mtime_ns)
+        self.reported: Dict[str, Tuple[str, int, int]] = {}
+        self.pending: Set[str] = set()  # changed but not settled yet
+        self.changed: Set[str] = set()
+        self.rescan = True
+        self.inotify = Inotify.create(folder) if use_inotify else None
+
+    def _stat(self, names) -> Dict[str, Tuple[int, int]]:
+        zips = {}
+        for name in names:
+            if not name.endswith(".zip"):
+                continue
+            try:
+                st = os.stat(self.folder / name)
+            except OSError:
+                continue
+            zips[name] = (st.st_size, st.st_mtime_ns)
+        return zips
+
+    def new_files(self) -> List[str]:
+        """
+        :return: paths of the new zip files, every file is reported once
+            until it is modified, see done()
+        """
+        if self.rescan or self.inotify is None:
+            zips = scan_zips(self.folder)
+            if self.rescan:
+                self.seen.prune(zips)
+                self.reported = {
+                    name: key for name, key in self.reported.items() if name in zips
+                }
+            self.rescan = False
+        else:
+            zips = self._stat(self.pending | self.changed)
+        self.changed = set()
+        self.pending = set()
+
+        now = time.time_ns()
+        new_files = []
+        for name in sorted(zips):
+            size, mtime = zips[name]
+            key = (name, size, mtime)
+            if key in self.seen or self.reported.get(name) == key:
+                continue
+            if size <= self.min_size or (self.max_size and size >= self.max_size):
+                continue
+            if now - mtime < self.settle * 1e9:
+                self.pending.add(name)
+                continue
+            self.reported[name] = key
+            new_files.append(str(self.folder / name))
+        return new_files
+
+    def done(self, paths):
+        """
+        Marks reported files as imported, they are stored in the seen files.
+        A file that failed is not passed here, so it is reported again after
+        a restart or when it is written again.
+        """
+        keys = [self.reported.pop(Path(path).name, None) for path in paths]
+        keys = [key for key in keys if key]
+        for key in keys:
+            self.seen.add(key)
+        if keys:
+            self.seen.save()
+
+    def wait(self, timeout: float = 1.0):
+        """Blocks until the folder changed or timeout seconds passed"""
+        if self.pending:
+            timeout = min(timeout, self.settle)
+        if self.inotify is None:
+            time.sleep(timeout)
+            return
+        self.changed |= self.inotify.read(timeout)
+        if self.inotify.overflow:
+            self.inotify.overflow = False
+            self.rescan = True
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    watcher = FolderWatcher(folder)
+    print("inotify" if watcher.inotify else "polling", folder)
+    try:
+        while True:
+            paths = watcher.new_files()
+            for path in paths:
+                print(path)
+            watcher.done(paths)
+            watcher.wait(5)
+    except KeyboardInterrupt:
+        watcher.close()
@@ -2,62 +2,119 @@ import pcbnew
 import os.path
 from pathlib import Path
 import wx
-from time import sleep
-from threading import Thread
 import sys
 import traceback
 import subprocess
 import os
+import json
 import venv
+import zipfile
 
 try:
     if __name__ == "__main__":
         from impart_gui import impartGUI
         from KiCadImport import import_lib
-        from impart_helper_func import filehandler, config_handler, KiCad_Settings
+        from impart_helper_func import config_handler, KiCad_Settings
+        from impart_helper_func import MIN_ZIP_SIZE, MAX_ZIP_SIZE, LogChannel
+        from folder_watcher import FolderWatcher
         from impart_migration import find_old_lib_files, convert_lib_list
     else:
         # relative import is required in kicad
         from .impart_gui import impartGUI
         from .KiCadImport import import_lib
-        from .impart_helper_func import filehandler, config_handler, KiCad_Settings
+        from .impart_helper_func import config_handler, KiCad_Settings
+        from .impart_helper_func import MIN_ZIP_SIZE, MAX_ZIP_SIZE, LogChannel
+        from .folder_watcher import FolderWatcher
         from .impart_migration import find_old_lib_files, convert_lib_list
 except Exception as e:
     print(traceback.format_exc())
 
 
+# packages of the EasyEDA import, installed into the venv of the plugin
+EASYEDA_PACKAGES = ("pydantic", "easyeda2kicad")
+# written into the venv once all packages could be imported
+VENV_STAMP = "impart_stamp.json"
+# milliseconds between two checks of the import folder with auto import
+AUTO_IMPORT_INTERVAL = 1000
+
+
+def venv_paths(venv_dir):
+    """:return: python executable and site-packages folder of a virtual environment"""
+    venv_dir = os.path.abspath(venv_dir)
+    if os.name == "nt":  # Windows
+        python_executable = os.path.join(venv_dir, "Scripts", "python.exe")
+        site_packages = os.path.join(venv_dir, "Lib", "site-packages")
+    else:  # Linux / macOS
+        python_executable = os.path.join(venv_dir, "bin", "python")
+        site_packages = os.path.join(
+            venv_dir,
+            "lib",
+            f"python{sys.version_info.major}.{sys.version_info.minor}",
+            "site-packages",
+        )
+    return python_executable, site_packages
+
+
+def load_virtualenv(venv_dir, packages=EASYEDA_PACKAGES):
+    """
+    Activates the virtual environment of the plugin and makes sure that the
+    packages can be imported. The check (venv creation, pip install) is done
+    only once, the stamp file in venv_dir skips it for the following runs.
+    :return: True if the packages are available
+    """
+    stamp_path = os.path.join(os.path.abspath(venv_dir), VENV_STAMP)
+    stamp = {"python": sys.version.split()[0], "packages": list(packages)}
+    try:
+        with open(stamp_path, encoding="utf-8") as file:
+            stamp_valid = json.load(file) == stamp
+    except (OSError, ValueError):
+        stamp_valid = False
+
+    if stamp_valid:
+        _, site_packages = venv_paths(venv_dir)
+        if site_packages not in sys.path:
+            sys.path.insert(0, site_packages)
+        return True
+
+    python_executable = activate_virtualenv(venv_dir)
+    available = True
+    for package in packages:
+        if not ensure_package(package, python_executable):
+            print("Problems with loading", package)
+            available = False
+    if available:
+        try:
+            with open(stamp_path, "w", encoding="utf-8") as file:
+                json.dump(stamp, file)
+        except OSError:
+            pass
+    return available
+
+
 def activate_virtualenv(venv_dir):
     """Activates a virtual environment, but creates it first if it does not exist."""
     venv_dir = os.path.abspath(venv_dir)
+    python_executable, site_packages = venv_paths(venv_dir)
 
     if os.name == "nt":  # Windows
         if not os.path.exists(venv_dir):
             # venv.create(venv_dir, with_pip=True) # dont work
             kicad_executable = sys.executable
             kicad_bin_dir = os.path.dirname(kicad_executable)
-            python_executable = os.path.join(kicad_bin_dir, "python.exe")
+            kicad_python = os.path.join(kicad_bin_dir, "python.exe")
             subprocess.run(
-                [python_executable, "-m", "venv", venv_dir],
+                [kicad_python, "-m", "venv", venv_dir],
                 check=True,
                 creationflags=subprocess.CREATE_NO_WINDOW,
             )
             print(f"Virtual environment not found. Create new in {venv_dir} ...")
-
-        python_executable = os.path.join(venv_dir, "Scripts", "python.exe")
-        site_packages = os.path.join(venv_dir, "Lib", "site-packages")
     else:  # Linux / macOS
         if not os.path.exists(venv_dir):
             venv.create(venv_dir, with_pip=True)
             print(f"Virtual environment not found. Create new in {venv_dir} ...")
-        python_executable = os.path.join(venv_dir, "bin", "python")
-        site_packages = os.path.join(
-            venv_dir,
-            "lib",
-            f"python{sys.version_info.major}.{sys.version_info.minor}",
-            "site-packages",
-        )
 
-    sys.path.insert(0, site_packages)
+    if site_packages not in sys.path:
+        sys.path.insert(0, site_packages)
     return python_executable
 
 
@@ -76,40 +133,6 @@ def ensure_package(package_name, python_executable="python"):
             return False
 
 
-EVT_UPDATE_ID = wx.NewIdRef()
-
-
-def EVT_UPDATE(win, func):
-    win.Connect(-1, -1, EVT_UPDATE_ID, func)
-
-
-class ResultEvent(wx.PyEvent):
-    def __init__(self, data):
-        wx.PyEvent.__init__(self)
-        self.SetEventType(EVT_UPDATE_ID)
-        self.data = data
-
-
-class PluginThread(Thread):
-    def __init__(self, wxObject):
-        Thread.__init__(self)
-        self.wxObject = wxObject
-        self.stopThread = False
-        self.start()
-
-    def run(self):
-        lenStr = 0
-        global backend_h
-        while not self.stopThread:
-            if lenStr != len(backend_h.print_buffer):
-                self.report(backend_h.print_buffer)
-                lenStr = len(backend_h.print_buffer)
-            sleep(0.5)
-
-    def report(self, status):
-        wx.PostEvent(self.wxObject, ResultEvent(status))
-
-
 class impart_backend:
 
     def __init__(self):
@@ -123,10 +146,17 @@ class impart_backend:
         self.import_old_format = False
         self.localLib = False
         self.autoLib = False
-        self.folderhandler = filehandler(".")
-        self.print_buffer = ""
+        self.watcher = None
+        self.easyeda_import = None
+        self.log = LogChannel(
+            retention=self.config.get_LOG_RETENTION(),
+            log_file=os.path.join(os.path.dirname(__file__), "impart.log"),
+        )
         self.importer = import_lib()
         self.importer.print = self.print2buffer
+        self.importer.lib_converter = self.config.get_LIB_CONVERTER()
+        # also finishes or rolls back an import that was interrupted
+        self.importer.set_DEST_PATH(self.config.get_DEST_PATH())
 
         def version_to_tuple(version_str):
             try:
@@ -159,44 +189,172 @@ class impart_backend:
             self.print2buffer(additional_information)
             self.print2buffer("\n##############################\n")
 
+    def set_DEST_PATH(self, path):
+        """Stores the library folder and imports into it from now on"""
+        self.config.set_DEST_PATH(path)
+        if Path(path) != self.importer.DEST_PATH:
+            self.importer.set_DEST_PATH(path)
+
+    @property
+    def print_buffer(self):
+        """retained messages as one string"""
+        return self.log.text()
+
     def print2buffer(self, *args):
         for text in args:
-            self.print_buffer = self.print_buffer + str(text) + "\n"
+            self.log.append(text)
+
+    def get_easyeda(self):
+        """
+        easyeda2kicad_wrapper, easyeda2kicad and its venv are loaded with the
+        first LCSC import only.
+        """
+        if self.easyeda_import is None:
+            venv_dir = os.path.join(os.path.dirname(__file__), "venv")
+            if not load_virtualenv(venv_dir):
+                raise ImportError("easyeda2kicad is not available")
+            try:
+                if __name__ == "__main__":
+                    from impart_easyeda import easyeda2kicad_wrapper
+                else:
+                    from .impart_easyeda import easyeda2kicad_wrapper
+            except ImportError:
+                # the venv was changed, check it again with the next import
+                stamp_path = os.path.join(venv_dir, VENV_STAMP)
+                if os.path.isfile(stamp_path):
+                    os.remove(stamp_path)
+                raise
+            self.easyeda_import = easyeda2kicad_wrapper(
+                cache_dir=self.config.get_EASYEDA_CACHE(),
+                offline=self.config.get_EASYEDA_OFFLINE(),
+                cache_ttl=self.config.get_EASYEDA_CACHE_DAYS() * 24 * 3600,
+                cache_max_size=self.config.get_EASYEDA_CACHE_MB() * 1000 * 1000,
+            )
+            self.easyeda_import.print = self.print2buffer
+        return self.easyeda_import
+
+    def import_parts(self, partnumbers, overwrite_if_exists, import_old_format):
+        """
+        Imports library zipfiles and EasyEDA / LCSC part numbers (e.g. C2040).
+        All LCSC parts are downloaded together, see easyeda2kicad_wrapper.batch_import().
+        :return: {partnumber: "OK" or an error message}
+        """
+        results = {}
+        lcsc_ids = {}  # LCSC id: partnumber
+        for partnumber in partnumbers:
+            if os.path.isfile(partnumber) and zipfile.is_zipfile(partnumber):
+                try:
+                    (results[partnumber],) = self.importer.import_all(
+                        partnumber,
+                        overwrite_if_exists=overwrite_if_exists,
+                        import_old_format=import_old_format,
+                    )
+                except Exception as e:
+                    results[partnumber] = f"Error: {e}"
+                continue
+
+            lcsc_id = partnumber.strip().upper()
+            if lcsc_id.startswith("C") and lcsc_id[1:].isdigit():
+                lcsc_ids[lcsc_id] = partnumber
+            else:
+                results[partnumber] = (
+                    f"{partnumber} is neither a zipfile nor a LCSC part number"
+                )
 
-    def __find_new_file__(self):
-        path = self.config.get_SRC_PATH()
+        if lcsc_ids:
+            easyeda_results = self.get_easyeda().batch_import(
+                list(lcsc_ids),
+                base_folder=self.config.get_DEST_PATH(),
+                overwrite=overwrite_if_exists,
+                lib_var="${KICAD_3RD_PARTY}",
+            )
+            for lcsc_id, partnumber in lcsc_ids.items():
+                res = easyeda_results.get(lcsc_id)
+                results[partnumber] = "OK" if res == 0 else f"Import of {lcsc_id} failed"
+
+        return {partnumber: results[partnumber] for partnumber in partnumbers}
+
+    def get_watcher(self, path):
+        """
+        FolderWatcher of the import folder, the seen files are kept in
+        seen_files.json per import folder and library folder
+        """
+        destination = self.importer.DEST_PATH
+        if (
+            self.watcher is None
+            or self.watcher.folder != Path(path)
+            or self.watcher.destination != destination
+        ):
+            if self.watcher is not None:
+                self.watcher.close()
+            seen_path = os.path.join(os.path.dirname(__file__), "seen_files.json")
+            self.watcher = FolderWatcher(
+                path,
+                seen_path,
+                min_size=MIN_ZIP_SIZE,
+                max_size=MAX_ZIP_SIZE,
+                destination=destination,
+            )
+        return self.watcher
+
+    def __find_new_file__(self, path=None):
+        """
+        Imports the new zip files of the import folder once. Called on the GUI
+        thread, also by the auto import timer, so it never runs at the same
+        time as a manual import with the same importer.
+        :param path: import folder, SRC_PATH of the config by default
+        """
+        path = path or self.config.get_SRC_PATH()
 
         if not os.path.isdir(path):
             return 0
 
-        while True:
-            newfilelist = self.folderhandler.GetNewFiles(path)
-            for lib in newfilelist:
-                try:
-                    (res,) = self.importer.import_all(
-                        lib,
-                        overwrite_if_exists=self.overwriteImport,
-                        import_old_format=self.import_old_format,
-                    )
-                    self.print2buffer(res)
-                except AssertionError as e:
-                    self.print2buffer(e)
-                except Exception as e:
-                    self.print2buffer(e)
-                    backend_h.print2buffer(f"Error: {e}")
-                    backend_h.print2buffer("Python version " + sys.version)
-                    print(traceback.format_exc())
-                self.print2buffer("")
+        watcher = self.get_watcher(path)
+        watcher.wait(0)  # only collects the inotify events, does not block
+        newfilelist = watcher.new_files()
+        if newfilelist:
+            try:
+                results = self.importer.import_many(
+                    newfilelist,
+                    overwrite_if_exists=self.overwriteImport,
+                    import_old_format=self.import_old_format,
+                )
+                for lib, res in results.items():
+                    if res == "OK":
+                        self.print2buffer(f"{os.path.basename(lib)}: {res}")
+                    elif res is not None:
+                        self.print2buffer(f"Error {os.path.basename(lib)}: {res}")
+                # failed files are not stored, they are tried again after a restart
+                watcher.done(lib for lib, res in results.items() if res == "OK")
+            except Exception as e:
+                self.print2buffer(f"Error: {e}")
+                self.print2buffer("Python version " + sys.version)
+                print(traceback.format_exc())
+            self.print2buffer("")
+
 
-            if not self.runThread:
-                break
-            if not pcbnew.GetBoard():
-                # print("pcbnew close")
-                break
-            sleep(1)
+class lazy_backend:
+    """
+    Creates the impart_backend with the first access, so loading the plugin
+    does not read the config or the KiCad settings.
+    """
 
+    def __init__(self):
+        object.__setattr__(self, "_backend", None)
 
-backend_h = impart_backend()
+    def get(self) -> impart_backend:
+        if self._backend is None:
+            object.__setattr__(self, "_backend", impart_backend())
+        return self._backend
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get(), name, value)
+
+
+backend_h = lazy_backend()
 
 
 def checkImport(add_if_possible=True):
@@ -235,6 +393,7 @@ def checkImport(add_if_possible=True):
         libdir = os.path.join(DEST_PATH, name + ".pretty")
         if os.path.isdir(libdir):
             msg += setting.check_footprintlib(name, add_if_possible)
+    setting.save()
     return msg
 
 
@@ -252,31 +411,51 @@ class impart_frontend(impartGUI):
 
         self.SetTitle("Import Libraries")
 
-        self.m_text.SetValue(backend_h.print_buffer)
-        self.thread = None
-
-        EVT_UPDATE(self, self.updateDisplay)
+        self.m_text.SetValue(backend_h.log.subscribe(self.on_log))
+        self.m_text.ShowPosition(self.m_text.GetLastPosition())
+        self.shown_lines = 0
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
 
         if self.test_migrate_possible():
             self.m_button_migrate.Show()
             self.m_staticline11.Show()
             self.Layout()
 
-    def updateDisplay(self, status):
-        self.m_text.SetValue(status.data)
+    def on_log(self, record):
+        # called by the thread that logged the record
+        wx.CallAfter(self.append_log, record.text)
+
+    def append_log(self, text):
+        if not self:  # dialog already destroyed
+            return
+        self.shown_lines += 1
+        if self.shown_lines > 2 * backend_h.log.records.maxlen:
+            # drop the lines that are not retained anymore
+            self.m_text.SetValue(backend_h.log.text())
+            self.shown_lines = 0
+        else:
+            self.m_text.AppendText(text + "\n")
         self.m_text.ShowPosition(self.m_text.GetLastPosition())
 
     def m_checkBoxLocaLibOnCheckBox(self, event):
         backend_h.localLib = self.m_checkBoxLocaLib.GetValue()
         self.m_dirPicker_librarypath.Enable(not backend_h.localLib)
 
+    def on_timer(self, event):
+        if not backend_h.runThread or not pcbnew.GetBoard():
+            self.timer.Stop()
+            backend_h.runThread = False
+            self.m_button.SetLabel("Start")
+            return
+        backend_h.__find_new_file__(self.m_dirPicker_sourcepath.GetPath())
+
     def on_close(self, event):
-        if self.thread is not None:
-            self.thread.stopThread = True
-            self.thread.join()
         backend_h.runThread = False
+        self.timer.Stop()
+        backend_h.log.unsubscribe(self.on_log)
         backend_h.config.set_SRC_PATH(self.m_dirPicker_sourcepath.GetPath())
-        backend_h.config.set_DEST_PATH(self.m_dirPicker_librarypath.GetPath())
+        backend_h.set_DEST_PATH(self.m_dirPicker_librarypath.GetPath())
         self.Destroy()
 
     def BottonClick(self, event):
@@ -289,34 +468,36 @@ class impart_frontend(impartGUI):
             backend_h.autoLib = self.m_check_autoLib.GetValue()
 
             if backend_h.localLib:
-                backend_h.config.set_DEST_PATH(self.KiCad_Project)
+                backend_h.set_DEST_PATH(self.KiCad_Project)
             else:
-                backend_h.config.set_DEST_PATH(self.m_dirPicker_librarypath.GetPath())
+                backend_h.set_DEST_PATH(self.m_dirPicker_librarypath.GetPath())
 
+            backend_h.__find_new_file__(self.m_dirPicker_sourcepath.GetPath())
             if backend_h.autoImport:
-                self.thread = PluginThread(self)
+                self.timer.Start(AUTO_IMPORT_INTERVAL)
                 self.m_button.SetLabel("Stop")
             else:
-                backend_h.__find_new_file__()
                 backend_h.runThread = False
-                self.m_text.SetValue(backend_h.print_buffer)
-                self.m_text.ShowPosition(self.m_text.GetLastPosition())
         else:
             backend_h.runThread = False
+            self.timer.Stop()
             self.m_button.SetLabel("Start")
 
     def DirChange(self, event):
-        backend_h.folderhandler = filehandler(self.m_dirPicker_sourcepath.GetPath())
+        # the watcher is only used on the GUI thread, between two timer events
+        # of the auto import, so it can be replaced here. The next event
+        # imports from the new folder.
+        backend_h.get_watcher(self.m_dirPicker_sourcepath.GetPath())
 
     def ButtonManualImport(self, event):
         partnumber = self.m_textCtrl2.GetValue()
         if partnumber:
             try:
-                (res,) = backend_h.importer.import_all(
-                    partnumber,
+                (res,) = backend_h.import_parts(
+                    [partnumber],
                     overwrite_if_exists=self.m_overwrite.GetValue(),
                     import_old_format=self.m_check_import_all.GetValue(),
-                )
+                ).values()
                 backend_h.print2buffer(res)
             except AssertionError as e:
                 backend_h.print2buffer(e)
@@ -325,34 +506,28 @@ class impart_frontend(impartGUI):
                 backend_h.print2buffer("Python version " + sys.version)
                 print(traceback.format_exc())
             backend_h.print2buffer("")
-            self.m_text.SetValue(backend_h.print_buffer)
-            self.m_text.ShowPosition(self.m_text.GetLastPosition())
 
     def ButtonBatchImport(self, event):
         batch_text = self.m_textCtrlBatch.GetValue()
         if batch_text:
             # Split by commas and clean up whitespace
             partnumbers = [pn.strip() for pn in batch_text.split(',') if pn.strip()]
-            
-            for partnumber in partnumbers:
-                try:
-                    (res,) = backend_h.importer.import_all(
-                        partnumber,
-                        overwrite_if_exists=self.m_overwrite.GetValue(),
-                        import_old_format=self.m_check_import_all.GetValue(),
-                    )
+
+            # the LCSC parts are downloaded concurrently and written one by one
+            try:
+                results = backend_h.import_parts(
+                    partnumbers,
+                    overwrite_if_exists=self.m_overwrite.GetValue(),
+                    import_old_format=self.m_check_import_all.GetValue(),
+                )
+                for partnumber, res in results.items():
                     backend_h.print2buffer(f"Importing {partnumber}:")
                     backend_h.print2buffer(res)
-                except AssertionError as e:
-                    backend_h.print2buffer(f"Error importing {partnumber}: {e}")
-                except Exception as e:
-                    backend_h.print2buffer(f"Error importing {partnumber}: {e}")
-                    backend_h.print2buffer("Python version " + sys.version)
-                    print(traceback.format_exc())
-                backend_h.print2buffer("")
-            
-            self.m_text.SetValue(backend_h.print_buffer)
-            self.m_text.ShowPosition(self.m_text.GetLastPosition())
+            except Exception as e:
+                backend_h.print2buffer(f"Error importing {', '.join(partnumbers)}: {e}")
+                backend_h.print2buffer("Python version " + sys.version)
+                print(traceback.format_exc())
+            backend_h.print2buffer("")
 
     def test_migrate_possible(self):
         libs2migrate = self.get_old_libfiles()
@@ -382,8 +557,7 @@ class impart_frontend(impartGUI):
             print2GUI("Error in migrate_libs()")
             return
 
-        SymbolTable = backend_h.KiCad_Settings.get_sym_table()
-        SymbolLibsUri = {lib["uri"]: lib for lib in SymbolTable}
+        SymbolLibsUri = backend_h.KiCad_Settings.get_table("sym-lib-table").by_uri
         libRename = []
 
         def lib_entry(lib):
@@ -423,7 +597,11 @@ class impart_frontend(impartGUI):
         )
         if dlg.ShowModal() == wx.ID_OK:
             print2GUI("Converted libraries:")
-            conv = convert_lib_list(libs2migrate, drymode=False)
+            conv = convert_lib_list(
+                libs2migrate,
+                drymode=False,
+                converter=backend_h.importer.lib_converter,
+            )
             for line in conv:
                 if line[1].endswith(".blk"):
                     print2GUI(line[0] + " rename to " + line[1])
@@ -445,6 +623,7 @@ class impart_frontend(impartGUI):
                 backend_h.KiCad_Settings.sym_table_change_entry(
                     tmp["oldURI"], tmp["newURI"]
                 )
+            backend_h.KiCad_Settings.save()
             print2GUI("\nA restart of KiCad is then necessary to apply all changes.")
         else:
             print2GUI(msg_lib)
@@ -468,13 +647,8 @@ class ActionImpartPlugin(pcbnew.ActionPlugin):
         self.dark_icon_file_name = self.icon_file_name
 
     def Run(self):
-        # Use virtual env
-        # TODO: Does not work completely reliably
-        python_executable = activate_virtualenv(venv_dir=self.plugin_dir / "venv")
-        if not ensure_package("pydantic", python_executable):
-            print("Problems with loading", "pydantic")
-        if not ensure_package("easyeda2kicad", python_executable):
-            print("Problems with loading", "easyeda2kicad")
+        # the virtual env for easyeda2kicad is loaded with the first LCSC import,
+        # see impart_backend.get_easyeda()
 
         # Start GUI
         board = pcbnew.GetBoard()
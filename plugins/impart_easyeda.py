@@ -6,14 +6,9 @@ import logging
 
 logging.basicConfig(level=logging.ERROR)
 
-from easyeda2kicad.easyeda.easyeda_api import EasyedaApi
 from easyeda2kicad.kicad.parameters_kicad_symbol import KicadVersion
 from easyeda2kicad.easyeda.parameters_easyeda import EeSymbol
 
-from easyeda2kicad.helpers import add_component_in_symbol_lib_file
-from easyeda2kicad.helpers import id_already_in_symbol_lib
-from easyeda2kicad.helpers import update_component_in_symbol_lib_file
-
 from easyeda2kicad.easyeda.easyeda_importer import Easyeda3dModelImporter
 from easyeda2kicad.easyeda.easyeda_importer import EasyedaFootprintImporter
 from easyeda2kicad.easyeda.easyeda_importer import EasyedaSymbolImporter
@@ -22,12 +17,88 @@ from easyeda2kicad.kicad.export_kicad_3d_model import Exporter3dModelKicad
 from easyeda2kicad.kicad.export_kicad_footprint import ExporterFootprintKicad
 from easyeda2kicad.kicad.export_kicad_symbol import ExporterSymbolKicad
 
+try:
+    from .easyeda_fetch import EasyedaFetcher, ResponseCache
+    from .easyeda_fetch import CACHE_DIR, CACHE_TTL, CACHE_MAX_SIZE
+    from .symbol_store import SymbolStore
+    from .import_journal import recover
+    from .s_expression_parse import LazyNode
+except ImportError:  # started as script
+    from easyeda_fetch import EasyedaFetcher, ResponseCache
+    from easyeda_fetch import CACHE_DIR, CACHE_TTL, CACHE_MAX_SIZE
+    from symbol_store import SymbolStore
+    from import_journal import recover
+    from s_expression_parse import LazyNode
+
+
+def symbol_name(symbol_text):
+    """
+    :return: unescaped name of the first (symbol "name" ...) of an exported
+        symbol or library, as in the index of SymbolStore, or None
+    """
+    node = LazyNode.parse(symbol_text)
+    if node is not None and node.name != "symbol":
+        node = node.find("symbol")
+    if node is None or not isinstance(node.key, str):
+        return None
+    return node.key
+
 
 class easyeda2kicad_wrapper:
 
+    def __init__(
+        self,
+        endpoints=None,
+        cache_dir=None,
+        offline=False,
+        cache_ttl=CACHE_TTL,
+        cache_max_size=CACHE_MAX_SIZE,
+    ):
+        """
+        :param endpoints: see easyeda_fetch.DEFAULT_ENDPOINTS
+        :param cache_dir: response cache, default is .easyeda_cache next to
+            the EasyEDA library, "" disables the cache
+        :param offline: only import parts from the cache, no network access
+        """
+        self.endpoints = endpoints
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.cache_ttl = cache_ttl
+        self.cache_max_size = cache_max_size
+        self.fetcher = None
+        self.symbol_stores = {}
+
+    def get_symbol_store(self, lib_path) -> SymbolStore:
+        """indexed EasyEDA.kicad_sym, kept open between the imports"""
+        lib_path = os.path.abspath(lib_path)
+        store = self.symbol_stores.get(lib_path)
+        if store is None:
+            store = self.symbol_stores[lib_path] = SymbolStore(lib_path)
+        else:
+            store.refresh()
+        return store
+
     def print(self, txt):
         print("easyeda:" + txt)
 
+    def get_fetcher(self, base_folder) -> EasyedaFetcher:
+        """the connections are kept open between the imports"""
+        if self.fetcher is None:
+            self.fetcher = EasyedaFetcher(endpoints=self.endpoints, offline=self.offline)
+
+        cache_dir = self.cache_dir
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser(base_folder), CACHE_DIR)
+        if not cache_dir:
+            self.fetcher.cache = None
+        elif self.fetcher.cache is None or self.fetcher.cache.root != os.path.abspath(
+            os.path.expanduser(cache_dir)
+        ):
+            self.fetcher.cache = ResponseCache(
+                cache_dir, ttl=self.cache_ttl, max_size=self.cache_max_size
+            )
+        return self.fetcher
+
     def import_Symbol(
         self,
         cad_data,
@@ -35,40 +106,35 @@ class easyeda2kicad_wrapper:
         overwrite=False,
         kicad_version=KicadVersion.v6,
         sym_lib_ext="kicad_sym",
+        symbol_store=None,
     ):
+        """
+        Adds or replaces the symbol in the library through its index, only
+        the block of the symbol is written.
+        :param symbol_store: SymbolStore of a batch, committed by the caller.
+            Without it the symbol is written immediately.
+        :return: 1 if the symbol exists and overwrite is not set, else None
+        """
         importer = EasyedaSymbolImporter(easyeda_cp_cad_data=cad_data)
         easyeda_symbol: EeSymbol = importer.get_symbol()
 
-        is_id_already_in_symbol_lib = id_already_in_symbol_lib(
-            lib_path=f"{output}.{sym_lib_ext}",
-            component_name=easyeda_symbol.info.name,
-            kicad_version=kicad_version,
-        )
-
-        if not overwrite and is_id_already_in_symbol_lib:
-            self.print("Use overwrite option to update the older symbol")
-            return 1
-
         exporter = ExporterSymbolKicad(
             symbol=easyeda_symbol, kicad_version=kicad_version
         )
         kicad_symbol_lib = exporter.export(
             footprint_lib_name=output.split("/")[-1].split(".")[0],
         )
+        name = symbol_name(kicad_symbol_lib) or easyeda_symbol.info.name
 
-        if is_id_already_in_symbol_lib:
-            update_component_in_symbol_lib_file(
-                lib_path=f"{output}.{sym_lib_ext}",
-                component_name=easyeda_symbol.info.name,
-                component_content=kicad_symbol_lib,
-                kicad_version=kicad_version,
-            )
-        else:
-            add_component_in_symbol_lib_file(
-                lib_path=f"{output}.{sym_lib_ext}",
-                component_content=kicad_symbol_lib,
-                kicad_version=kicad_version,
-            )
+        store = symbol_store or self.get_symbol_store(f"{output}.{sym_lib_ext}")
+        if name in store:  # includes the symbols staged by the batch
+            if not overwrite:
+                self.print("Use overwrite option to update the older symbol")
+                return 1
+
+        store.stage(name, kicad_symbol_lib.strip())
+        if symbol_store is None:
+            store.commit()
 
         self.print(f"Created Kicad symbol {easyeda_symbol.info.name}")
         print(f"Library path : {output}.{sym_lib_ext}")
@@ -102,15 +168,23 @@ class easyeda2kicad_wrapper:
         self.print(f"Created Kicad footprint {easyeda_footprint.info.name}")
         print(f"Footprint path: {os.path.join(footprint_path, footprint_filename)}")
 
-    def import_3D_Model(self, cad_data, output, overwrite=True):
+    def import_3D_Model(self, cad_data, output, overwrite=True, fetched=None):
+        """
+        :param fetched: easyeda_fetch.FetchResult with the downloaded model,
+            otherwise easyeda2kicad downloads it
+        """
         model_3d = Easyeda3dModelImporter(
-            easyeda_cp_cad_data=cad_data, download_raw_3d_model=True
+            easyeda_cp_cad_data=cad_data, download_raw_3d_model=fetched is None
         ).output
 
         if not model_3d:
             self.print(f"No 3D model available for this component.")
             return
 
+        if fetched is not None:
+            model_3d.raw_obj = fetched.raw_obj
+            model_3d.step = fetched.step
+
         exporter = Exporter3dModelKicad(model_3d=model_3d)
 
         if exporter.output or exporter.output_step:
@@ -152,15 +226,104 @@ class easyeda2kicad_wrapper:
         overwrite=False,
         lib_var="${EASYEDA2KICAD}",
     ):
+        return self.batch_import(
+            [component_id], base_folder, overwrite=overwrite, lib_var=lib_var
+        )[component_id]
 
-        base_folder = os.path.expanduser(base_folder)
+    def batch_import(
+        self,
+        component_ids,
+        base_folder=False,
+        overwrite=False,
+        lib_var="${EASYEDA2KICAD}",
+    ):
+        """
+        Imports many LCSC parts. The CAD data and 3D models are downloaded
+        concurrently, the parts are written one after the other.
+        :return: {component_id: 0 if imported, 1 if failed or the symbol
+            exists without overwrite, False if invalid}
+        """
+        results = {}
+        valid_ids = []
+        for component_id in component_ids:
+            if not component_id.startswith("C"):
+                self.print("lcsc_id should start by C.... example: C2040")
+                results[component_id] = False
+            else:
+                valid_ids.append(component_id)
+        if not valid_ids:
+            return results
+
+        output = self.prepare_library(base_folder)
+        # all symbols of the batch are written with one commit
+        symbol_store = self.get_symbol_store(f"{output}.kicad_sym")
+
+        try:
+            self._import_fetched(
+                valid_ids,
+                base_folder,
+                output,
+                overwrite,
+                lib_var,
+                symbol_store,
+                results,
+            )
+        finally:
+            symbol_store.commit()
+        return results
 
-        if not component_id.startswith("C"):
-            self.print("lcsc_id should start by C.... example: C2040")
-            return False
+    def _import_fetched(
+        self,
+        component_ids,
+        base_folder,
+        output,
+        overwrite,
+        lib_var,
+        symbol_store,
+        results,
+    ):
+        for fetched in self.get_fetcher(base_folder).fetch_many(component_ids):
+            # API returned no data
+            if fetched.error:
+                self.print(fetched.error)
+                results[fetched.lcsc_id] = 1
+                continue
+
+            cad_data = fetched.cad_data
+            # a failing part does not stop the rest of the batch
+            try:
+                # ---------------- SYMBOL ----------------
+                skipped = self.import_Symbol(
+                    cad_data, output, overwrite=overwrite, symbol_store=symbol_store
+                )
+                # ---------------- FOOTPRINT -------------
+                self.import_Footprint(
+                    cad_data, output, overwrite=overwrite, lib_name=lib_var
+                )
+                # ---------------- 3D MODEL --------------
+                self.import_3D_Model(
+                    cad_data, output, overwrite=overwrite, fetched=fetched
+                )
+            except Exception as e:
+                self.print(f"Import of {fetched.lcsc_id} failed: {e}")
+                results[fetched.lcsc_id] = 1
+                continue
+            # an existing symbol without overwrite is reported as not imported
+            results[fetched.lcsc_id] = 1 if skipped else 0
+
+    def prepare_library(self, base_folder):
+        """
+        Creates EasyEDA.kicad_sym, EasyEDA.pretty and EasyEDA.3dshapes
+        :return: base_folder/EasyEDA
+        """
+        base_folder = os.path.expanduser(base_folder)
 
         if not os.path.isdir(base_folder):
             os.makedirs(base_folder, exist_ok=True)
+        # finish or roll back a symbol library write that was interrupted
+        result = recover(base_folder)
+        if result:
+            self.print(f"Interrupted import {result}")
 
         lib_name = "EasyEDA"
         output = f"{base_folder}/{lib_name}"
@@ -188,23 +351,7 @@ class easyeda2kicad_wrapper:
                     )"""
                 )
             self.print(f"Create {lib_name}.{lib_extension} symbol lib in {base_folder}")
-
-        # Get CAD data of the component using easyeda API
-        api = EasyedaApi()
-        cad_data = api.get_cad_data_of_component(lcsc_id=component_id)
-
-        # API returned no data
-        if not cad_data:
-            self.print(f"Failed to fetch data from EasyEDA API for part {component_id}")
-            return 1
-
-        # ---------------- SYMBOL ----------------
-        self.import_Symbol(cad_data, output, overwrite=overwrite)
-        # ---------------- FOOTPRINT -------------
-        self.import_Footprint(cad_data, output, overwrite=overwrite, lib_name=lib_var)
-        # ---------------- 3D MODEL --------------
-        self.import_3D_Model(cad_data, output, overwrite=overwrite)
-        return 0
+        return output
 
 
 if __name__ == "__main__":
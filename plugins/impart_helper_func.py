@@ -2,43 +2,103 @@ import os.path
 import json
 import configparser
 from pathlib import Path
-import re
+import time
+import logging
+import logging.handlers
+import threading
+from collections import deque, namedtuple
 
 try:
-    from .s_expression_parse import readFile2var, parse_sexp, convert_list_to_dicts
+    from .s_expression_parse import readFile2var, parse_sexp, select, node_dict
+    from .s_expression_parse import LazyNode, SexpPatch
 except:
-    from s_expression_parse import readFile2var, parse_sexp, convert_list_to_dicts
-
-class filehandler:
-    def __init__(self, path):
-        self.path = ""
-        self.filelist = []
-        self.change_path(path)
-
-    def change_path(self, newpath):
-        if not os.path.isdir(newpath):
-            newpath = "."
-        if newpath != self.path:
-            self.filelist = []
-        self.path = newpath
-
-    def GetNewFiles(self, path):
-        if path != self.path:
-            self.change_path(path)
-
-        filelist = os.listdir(self.path)
-        filelist.sort()
-        newFiles = []
-        for i in filelist:
-            if i not in self.filelist and i.endswith(".zip"):
-                pathtemp = os.path.join(self.path, i)
-                # the file is less than 50 MB and larger 1kB
-                if (os.path.getsize(pathtemp) < 1000 * 1000 * 50) and (
-                    os.path.getsize(pathtemp) > 1000
-                ):
-                    newFiles.append(pathtemp)
-                    self.filelist.append(i)
-        return newFiles
+    from s_expression_parse import readFile2var, parse_sexp, select, node_dict
+    from s_expression_parse import LazyNode, SexpPatch
+
+# models are streamed out of the zip files, large archives are fine
+MAX_ZIP_SIZE = 1000 * 1000 * 500
+MIN_ZIP_SIZE = 1000
+
+# number of log lines kept in memory and shown in the dialog
+LOG_RETENTION = 2000
+LOG_FILE_SIZE = 1000 * 1000
+LOG_FILE_BACKUPS = 3
+
+LogRecord = namedtuple("LogRecord", ["seq", "time", "level", "text"])
+
+
+class LogChannel:
+    """
+    Bounded, thread-safe log of the import messages.
+
+    The last `retention` records are kept in memory, every record is also
+    written to a rotating log file if one is given. Listeners are called
+    with each new record from the thread that logged it.
+    """
+
+    def __init__(self, retention=LOG_RETENTION, log_file=None):
+        self.records = deque(maxlen=retention)
+        self.listeners = []
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.logger = None
+        if log_file:
+            self.logger = logging.getLogger("impart." + str(log_file))
+            self.logger.propagate = False
+            self.logger.setLevel(logging.DEBUG)
+            if not self.logger.handlers:
+                try:
+                    handler = logging.handlers.RotatingFileHandler(
+                        log_file,
+                        maxBytes=LOG_FILE_SIZE,
+                        backupCount=LOG_FILE_BACKUPS,
+                        encoding="utf-8",
+                    )
+                except OSError as e:
+                    print("Log file not available:", e)
+                    self.logger = None
+                else:
+                    handler.setFormatter(
+                        logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+                    )
+                    self.logger.addHandler(handler)
+
+    def append(self, text, level=logging.INFO):
+        with self.lock:
+            self.seq += 1
+            record = LogRecord(self.seq, time.time(), level, str(text))
+            self.records.append(record)
+            listeners = list(self.listeners)
+        if self.logger:
+            self.logger.log(level, record.text)
+        for listener in listeners:
+            listener(record)
+
+    def subscribe(self, listener) -> str:
+        """
+        Registers listener(record) for new records.
+        :return: text of the retained records at the time of subscribing
+        """
+        with self.lock:
+            self.listeners.append(listener)
+            return self._text()
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def since(self, seq):
+        """:return: retained records newer than seq"""
+        with self.lock:
+            return [record for record in self.records if record.seq > seq]
+
+    def _text(self):
+        return "".join(record.text + "\n" for record in self.records)
+
+    def text(self) -> str:
+        with self.lock:
+            return self._text()
 
 
 class config_handler:
@@ -78,6 +138,29 @@ class config_handler:
         self.config["config"]["DEST_PATH"] = var
         self.save_config()
 
+    def get_LOG_RETENTION(self):
+        return self.config["config"].getint("LOG_RETENTION", fallback=LOG_RETENTION)
+
+    def get_LIB_CONVERTER(self):
+        """auto, kicad-cli or native, see legacy_convert.CONVERTERS"""
+        return self.config["config"].get("LIB_CONVERTER", fallback="auto")
+
+    def get_EASYEDA_CACHE(self):
+        """
+        :return: folder of the EasyEDA response cache, None for the default
+            next to the library, "" if the cache is disabled
+        """
+        return self.config["config"].get("EASYEDA_CACHE", fallback=None)
+
+    def get_EASYEDA_OFFLINE(self):
+        return self.config["config"].getboolean("EASYEDA_OFFLINE", fallback=False)
+
+    def get_EASYEDA_CACHE_DAYS(self):
+        return self.config["config"].getfloat("EASYEDA_CACHE_DAYS", fallback=30)
+
+    def get_EASYEDA_CACHE_MB(self):
+        return self.config["config"].getint("EASYEDA_CACHE_MB", fallback=500)
+
     def save_config(self):
         with open(self.config_path, "w") as configfile:
             self.config.write(configfile)
@@ -86,94 +169,159 @@ class config_handler:
         print(text)
 
 
+class LibTable:
+    """
+    sym-lib-table or fp-lib-table, parsed once.
+
+    The entries are indexed by name and URI and reloaded only if the mtime
+    of the file changed. New entries and URI changes are collected and
+    written together with save().
+    """
+
+    entry_keys = ("name", "type", "uri", "options", "descr")
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.by_name = {}
+        self.by_uri = {}
+        self.added = []  # new entries
+        self.changed_uri = {}  # old uri: new uri
+        self.mtime = None
+
+    def load(self):
+        self.mtime = os.stat(self.path).st_mtime_ns
+        parsed = parse_sexp(readFile2var(self.path))
+        (libs,) = select(parsed, "lib")
+        self.entries = [node_dict(lib) for lib in libs]
+        self.by_name = {lib["name"]: lib for lib in self.entries}
+        self.by_uri = {lib["uri"]: lib for lib in self.entries}
+        for entry in self.added:  # not saved yet
+            self._index(entry)
+        for old_uri, new_uri in self.changed_uri.items():
+            if old_uri in self.by_uri:
+                self._set_uri(self.by_uri[old_uri], new_uri)
+
+    def refresh(self):
+        """Loads the table if it was not loaded yet or changed on disk"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is None or mtime != self.mtime:
+            self.load()
+
+    def _index(self, entry):
+        self.entries.append(entry)
+        self.by_name[entry["name"]] = entry
+        self.by_uri[entry["uri"]] = entry
+
+    def _set_uri(self, entry, new_uri):
+        self.by_uri.pop(entry["uri"], None)
+        entry["uri"] = new_uri
+        entry["type"] = "KiCad"
+        self.by_uri[new_uri] = entry
+
+    def add(self, name, uri, type="KiCad", options="", descr=""):
+        self.refresh()
+        if name in self.by_name:
+            raise ValueError(f"Entry with the name '{name}' already exists.")
+        entry = {"name": name, "type": type, "uri": uri}
+        entry.update({"options": options, "descr": descr})
+        self._index(entry)
+        self.added.append(entry)
+
+    def change_uri(self, old_uri, new_uri):
+        self.refresh()
+        if old_uri not in self.by_uri:
+            raise ValueError(f"URI '{old_uri}' not found in the file.")
+        self._set_uri(self.by_uri[old_uri], new_uri)
+        # a changed entry can be changed again before it is written
+        for first_uri, uri in self.changed_uri.items():
+            if uri == old_uri:
+                old_uri = first_uri
+                break
+        self.changed_uri[old_uri] = new_uri
+
+    def save(self):
+        """
+        Writes all collected changes through <name>~ and a rename.
+        :return: True if the table was changed
+        """
+        if not self.added and not self.changed_uri:
+            return False
+
+        with open(self.path, "r") as file:
+            text = file.read()
+
+        # only the changed values and the new entries are written, the rest
+        # of the table is copied unchanged
+        root = LazyNode.parse(text)
+        if root is None:
+            raise ValueError(f"{self.path} is not a library table.")
+        patch = SexpPatch(text)
+        for lib in root.find_all("lib"):
+            new_uri = self.changed_uri.pop(node_dict(lib).get("uri"), None)
+            if new_uri is None:
+                continue
+            for child in lib.children:
+                if child.name == "uri":
+                    patch.replace_atom(child, 1, new_uri)
+                elif child.name == "type":
+                    patch.replace_atom(child, 1, "KiCad")
+
+        for entry in self.added:
+            lib = ["lib"] + [[key, entry[key]] for key in self.entry_keys]
+            patch.append(root, lib, quote_strings=True, inline=True)
+
+        not_found = list(self.changed_uri)
+        self.added = []
+        self.changed_uri = {}
+
+        tmp_path = self.path + "~"
+        with open(tmp_path, "w") as file:
+            patch.write(file)
+        os.replace(tmp_path, self.path)
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+        if not_found:
+            raise ValueError(f"URI '{not_found[0]}' not found in the file.")
+        return True
+
+
 class KiCad_Settings:
     def __init__(self, SettingPath):
         self.SettingPath = SettingPath
+        self.tables = {}  # file name: LibTable
+
+    def get_table(self, name) -> LibTable:
+        """sym-lib-table or fp-lib-table, loaded once and reloaded if changed"""
+        if name not in self.tables:
+            self.tables[name] = LibTable(os.path.join(self.SettingPath, name))
+        table = self.tables[name]
+        table.refresh()
+        return table
 
     def get_sym_table(self):
-        path = os.path.join(self.SettingPath, "sym-lib-table")
-        return self.__parse_table__(path)
+        return self.get_table("sym-lib-table").entries
 
     def set_sym_table(self, libname: str, libpath: str):
-        path = os.path.join(self.SettingPath, "sym-lib-table")
-        self.__add_entry_sexp__(path, name=libname, uri=libpath)
+        self.get_table("sym-lib-table").add(name=libname, uri=libpath)
 
     def sym_table_change_entry(self, old_uri, new_uri):
-        path = os.path.join(self.SettingPath, "sym-lib-table")
-        self.__update_uri_in_sexp__(path, old_uri=old_uri, new_uri=new_uri)
+        self.get_table("sym-lib-table").change_uri(old_uri=old_uri, new_uri=new_uri)
 
     def get_lib_table(self):
-        path = os.path.join(self.SettingPath, "fp-lib-table")
-        return self.__parse_table__(path)
+        return self.get_table("fp-lib-table").entries
 
     def set_lib_table_entry(self, libname: str):
-        path = os.path.join(self.SettingPath, "fp-lib-table")
         uri_lib = "${KICAD_3RD_PARTY}/" + libname + ".pretty"
-        self.__add_entry_sexp__(path, name=libname, uri=uri_lib)
-
-    def __parse_table__(self, path):
-        sexp = readFile2var(path)
-        parsed = parse_sexp(sexp)
-        return convert_list_to_dicts(parsed)
-
-    def __update_uri_in_sexp__(
-        self,
-        path,
-        old_uri,
-        new_uri,
-    ):
-        with open(path, "r") as file:
-            data = file.readlines()
-
-        entry_pattern = re.compile(
-            r'\s*\(lib \(name "(.*?)"\)\(type "(.*?)"\)\(uri "(.*?)"\)\(options "(.*?)"\)\(descr "(.*?)"\)\)\s*'
-        )
-        uri_found = False
-
-        for index, line in enumerate(data):
-            match = entry_pattern.match(line)
-            if match:
-                name, type_, uri, options, descr = match.groups()
-                if uri == old_uri:
-                    # Create a new entry with the new URI
-                    new_entry = f'  (lib (name "{name}")(type "KiCad")(uri "{new_uri}")(options "{options}")(descr "{descr}"))\n'
-                    print("old entry:", data[index], end="")
-                    data[index] = new_entry
-                    print("new entry:", data[index], end="")
-                    uri_found = True
-                    break
-
-        if not uri_found:
-            raise ValueError(f"URI '{old_uri}' not found in the file.")
+        self.get_table("fp-lib-table").add(name=libname, uri=uri_lib)
 
-        with open(path, "w") as file:
-            file.writelines(data)
-
-    def __add_entry_sexp__(
-        self,
-        path,
-        name="Snapeda",
-        uri="${KICAD_3RD_PARTY}/Snapeda.pretty",
-        type="KiCad",
-        options="",
-        descr="",
-    ):
-        table_entry = self.__parse_table__(path)
-        entries = {lib["name"]: lib for lib in table_entry}
-        if name in entries:
-            raise ValueError(f"Entry with the name '{name}' already exists.")
-
-        new_entry = f'  (lib (name "{name}")(type "{type}")(uri "{uri}")(options "{options}")(descr "{descr}"))\n'
-
-        with open(path, "r") as file:
-            data = file.readlines()
-
-        # Insert the new entry before the last bracket character
-        insert_index = len(data) - 1
-        data.insert(insert_index, new_entry)
-
-        with open(path, "w") as file:
-            file.writelines(data)
+    def save(self):
+        """Writes the changed library tables, each with a single write"""
+        for table in self.tables.values():
+            table.save()
 
     def get_kicad_json(self):
         path = os.path.join(self.SettingPath, "kicad.json")
@@ -209,8 +357,7 @@ class KiCad_Settings:
 
     def check_footprintlib(self, SearchLib, add_if_possible=True):
         msg = ""
-        FootprintTable = self.get_lib_table()
-        FootprintLibs = {lib["name"]: lib for lib in FootprintTable}
+        FootprintLibs = self.get_table("fp-lib-table").by_name
 
         temp_path = "${KICAD_3RD_PARTY}/" + SearchLib + ".pretty"
         if SearchLib in FootprintLibs:
@@ -241,9 +388,9 @@ class KiCad_Settings:
         SearchLib_name = SearchLib.split(".")[0]
         SearchLib_name_short = SearchLib_name.split("_")[0]
 
-        SymbolTable = self.get_sym_table()  # TODO: Handle local lib
-        SymbolLibs = {lib["name"]: lib for lib in SymbolTable}
-        SymbolLibsUri = {lib["uri"]: lib for lib in SymbolTable}
+        SymbolTable = self.get_table("sym-lib-table")  # TODO: Handle local lib
+        SymbolLibs = SymbolTable.by_name
+        SymbolLibsUri = SymbolTable.by_uri
 
         temp_path = "${KICAD_3RD_PARTY}/" + SearchLib
 
@@ -311,3 +458,4 @@ if __name__ == "__main__":
     Setting.check_footprintlib(SearchLib)
     Setting.check_symbollib(SearchLib)
     Setting.check_GlobalVar(SearchLib)
+    Setting.save()
@@ -2,6 +2,7 @@ from pathlib import Path
 import logging
 
 from .kicad_cli import kicad_cli
+from .legacy_convert import upgrade_sym_libs
 
 logger = logging.getLogger(__name__)
 cli = kicad_cli()
@@ -79,7 +80,10 @@ def find_old_lib_files(
     return found_files
 
 
-def convert_lib(SRC: Path, DES: Path, drymode=True):
+def convert_lib(SRC: Path, DES: Path, drymode=True, upgrade=True):
+    """
+    :param upgrade: False if DES was already created by upgrade_sym_libs()
+    """
 
     BLK_file = SRC.with_suffix(SRC.suffix + ".blk")  # Backup
 
@@ -96,7 +100,7 @@ def convert_lib(SRC: Path, DES: Path, drymode=True):
         if DES_dcm.exists() and DES_dcm.is_file():
             return []
 
-        if not cli.upgrade_sym_lib(SRC, DES) or not DES.exists():
+        if (upgrade and not cli.upgrade_sym_lib(SRC, DES)) or not DES.exists():
             logger.error(f"converting {SRC.name} to {DES.name} produced an error")
             return []
         msg.append([SRC.stem, DES.stem])
@@ -110,13 +114,16 @@ def convert_lib(SRC: Path, DES: Path, drymode=True):
     return msg
 
 
-def convert_lib_list(libs_dict, drymode=True):
+def convert_lib_list(libs_dict, drymode=True, converter="auto"):
+    """
+    :param converter: conversion of the legacy .lib files, see legacy_convert.CONVERTERS
+    """
 
-    if not cli.exists():
+    if converter == "kicad-cli" and not cli.exists():
         logger.error("kicad_cli not found! Conversion is not possible.")
         drymode = True
 
-    convertlist = []
+    conversions = []
     for lib, paths in libs_dict.items():
 
         # if "V6" in paths:
@@ -129,12 +136,10 @@ def convert_lib_list(libs_dict, drymode=True):
                     logger.error(f"{lib} old_lib_kicad_sym already exists")
                 else:
                     kicad_sym_file = file.with_name(file.stem + "_old_lib.kicad_sym")
-                    res = convert_lib(SRC=file, DES=kicad_sym_file, drymode=drymode)
-                    convertlist.extend(res)
+                    conversions.append((file, kicad_sym_file))
             else:
                 name_V6 = file.with_name(lib + ".kicad_sym")
-                res = convert_lib(SRC=file, DES=name_V6, drymode=drymode)
-                convertlist.extend(res)
+                conversions.append((file, name_V6))
 
         if "oldV6" in paths:
             file = paths["oldV6"]
@@ -142,8 +147,24 @@ def convert_lib_list(libs_dict, drymode=True):
                 logger.error(f"{lib} V6 already exists")
             else:
                 name_V6 = file.with_name(lib + ".kicad_sym")
-                res = convert_lib(SRC=file, DES=name_V6, drymode=drymode)
-                convertlist.extend(res)
+                conversions.append((file, name_V6))
+
+    if not drymode:
+        # all libraries with as few kicad-cli calls as possible
+        upgrade_sym_libs(
+            [
+                (SRC, DES)
+                for SRC, DES in conversions
+                if not DES.with_suffix(".dcm").is_file()
+            ],
+            converter,
+            cli,
+        )
+
+    convertlist = []
+    for SRC, DES in conversions:
+        res = convert_lib(SRC=SRC, DES=DES, drymode=drymode, upgrade=False)
+        convertlist.extend(res)
     return convertlist
 
 
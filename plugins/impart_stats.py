@@ -0,0 +1,137 @@
+import json
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Union
+
+# Instrumentation of import_lib: every stage of an import is reported as a
+# "span" event with its duration and the bytes read and written, counters
+# (e.g. rewritten libraries) as "count" events. Observers get every event,
+# the optional trace file stores one JSON object per line.
+#
+# {"event": "span", "stage": "parse_symbol", "start": 1700000000.1,
+#  "duration": 0.002, "bytes_read": 4711, "bytes_written": 0, "zip": "..."}
+# {"event": "count", "name": "rewrite .dcm", "value": 1}
+
+
+class StageTotals:
+    __slots__ = ("calls", "duration", "bytes_read", "bytes_written")
+
+    def __init__(self):
+        self.calls = 0
+        self.duration = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+class ImportStats:
+    """Per-stage timing and counters of the imports"""
+
+    def __init__(self, trace_file=None):
+        self.stages: Dict[str, StageTotals] = {}
+        self.counters: Dict[str, int] = {}
+        self.observers: List[Callable[[dict], None]] = []
+        self.trace = None
+        if trace_file:
+            self.open_trace(trace_file)
+
+    def add_observer(self, observer: Callable[[dict], None]):
+        """observer(event) is called for every span and count event"""
+        self.observers.append(observer)
+
+    def remove_observer(self, observer: Callable[[dict], None]):
+        if observer in self.observers:
+            self.observers.remove(observer)
+
+    def open_trace(self, trace_file):
+        """Appends all following events as JSON lines to trace_file"""
+        self.close()
+        self.trace = open(trace_file, "a", encoding="utf-8")
+
+    def close(self):
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def span(self, stage: str, **info):
+        """
+        Measures the duration of a stage. The yielded dict can be updated with
+        bytes_read, bytes_written and other information.
+
+        with stats.span("write_footprint", file=str(path)) as span:
+            span["bytes_written"] = path.write_bytes(data)
+        """
+        event = {"event": "span", "stage": stage, "start": time.time()}
+        event["bytes_read"] = 0
+        event["bytes_written"] = 0
+        event.update(info)
+        start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event["duration"] = time.perf_counter() - start
+            self.record(event)
+
+    def count(self, name: str, value: int = 1, **info):
+        """Increases the counter name by value"""
+        event = {"event": "count", "name": name, "value": value}
+        event.update(info)
+        self.record(event)
+
+    def record(self, event: dict):
+        """Adds an event to the totals, also used for events of worker processes"""
+        if event["event"] == "span":
+            totals = self.stages.get(event["stage"])
+            if totals is None:
+                totals = self.stages[event["stage"]] = StageTotals()
+            totals.calls += 1
+            totals.duration += event["duration"]
+            totals.bytes_read += event["bytes_read"]
+            totals.bytes_written += event["bytes_written"]
+        elif event["event"] == "count":
+            self.counters[event["name"]] = (
+                self.counters.get(event["name"], 0) + event["value"]
+            )
+
+        for observer in self.observers:
+            observer(event)
+        if self.trace:
+            self.trace.write(json.dumps(event) + "\n")
+
+    def summary(self) -> str:
+        """:return: table of the stages sorted by duration and the counters"""
+        lines = [
+            f"{'stage':<18}{'calls':>7}{'time [s]':>10}{'share':>7}"
+            f"{'read [kB]':>11}{'written [kB]':>14}"
+        ]
+        total = sum(totals.duration for totals in self.stages.values()) or 1.0
+        for stage, totals in sorted(
+            self.stages.items(), key=lambda item: -item[1].duration
+        ):
+            lines.append(
+                f"{stage:<18}{totals.calls:>7}{totals.duration:>10.3f}"
+                f"{totals.duration / total:>7.0%}"
+                f"{totals.bytes_read / 1e3:>11.1f}{totals.bytes_written / 1e3:>14.1f}"
+            )
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<18}{value:>7}")
+        return "\n".join(lines)
+
+
+def text_size(text: Union[str, None]) -> int:
+    """:return: size of text in bytes as it is stored with utf-8"""
+    return len(text.encode("utf-8")) if text else 0
+
+
+if __name__ == "__main__":
+    stats = ImportStats()
+    stats.add_observer(print)
+    with stats.span("demo", zip="demo.zip") as span:
+        span["bytes_read"] = 4096
+        time.sleep(0.01)
+    stats.count("rewrite .dcm")
+    print(stats.summary())
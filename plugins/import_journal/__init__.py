@@ -0,0 +1,371 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Write-ahead journal of the library writes, e.g. <DEST_PATH>/.impart_journal
+#
+# Every new content is first written to <name>~ and fsynced, the journal
+# lists the temporary file before it is created. The commit record with all
+# operations is appended and fsynced before the first library is touched:
+#
+# {"tmp": "/libs/Samacsys.kicad_sym~"}
+# {"tmp": "/libs/Samacsys.pretty/SOT23.kicad_mod~"}
+# {"commit": [["splice", "/libs/Samacsys.kicad_sym~", "/libs/Samacsys.kicad_sym", 4711],
+#             ["replace", "/libs/Samacsys.pretty/SOT23.kicad_mod~", "/libs/Samacsys.pretty/SOT23.kicad_mod"]]}
+#
+# recover() rolls a journal with a commit record forward and removes the
+# temporary files of a journal without one. Both operations are idempotent,
+# a pending operation is recognized by its temporary file.
+#
+# A journal holds <DEST_PATH>/.impart_lock from its first temporary file until
+# the commit or abort is finished. recover() only runs if it gets the lock, so
+# it never touches the files of an import that is still running.
+JOURNAL_NAME = ".impart_journal"
+LOCK_NAME = ".impart_lock"
+TMP_SUFFIX = "~"
+# temporary files that are removed by recover(), other files ending with ~
+# (e.g. backups of editors) are kept
+STRAY_SUFFIXES = (
+    ".kicad_sym",
+    ".kicad_mod",
+    ".lib",
+    ".dcm",
+    ".idx",
+    ".step",
+    ".stp",
+    ".wrl",
+)
+# left behind by older versions
+STRAY_NAMES = ("temp.lib",)
+
+
+def fsync_dir(path: Path):
+    """Makes renames in the directory durable, not possible on Windows"""
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class FolderLock:
+    """Advisory lock of an import folder, shared by all processes"""
+
+    def __init__(self, root: Union[str, Path]):
+        self.path = Path(root) / LOCK_NAME
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """:return: False if blocking is False and the lock is held elsewhere"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        file = self.path.open("a+b")
+        while True:
+            try:
+                if fcntl is not None:
+                    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                    fcntl.flock(file.fileno(), flags)
+                else:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if not blocking or fcntl is not None:
+                    file.close()
+                    return False
+                time.sleep(0.1)  # msvcrt has no blocking lock without timeout
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()  # closing the file releases the lock
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def tmp_path(path: Path) -> Path:
+    return path.with_name(path.name + TMP_SUFFIX)
+
+
+def apply_operation(operation: list):
+    """Executes one operation of a commit record, nothing if it is already done"""
+    kind, tmp, path = operation[:3]
+    tmp, path = Path(tmp), Path(path)
+    if not tmp.is_file():
+        return
+    if kind == "replace":
+        tmp.replace(path)
+        fsync_dir(path.parent)
+    elif kind == "splice":
+        # new end of the file starting at offset, e.g. appended symbols + footer
+        offset = operation[3]
+        with tmp.open("rb") as src, path.open("r+b") as dst:
+            dst.seek(offset)
+            dst.write(src.read())
+            dst.truncate()
+            dst.flush()
+            os.fsync(dst.fileno())
+        tmp.unlink()
+    else:
+        raise ValueError(f"Unknown journal operation {kind}")
+
+
+class ImportJournal:
+    """
+    Crash-safe commit of several files at once.
+
+    journal = ImportJournal(DEST_PATH)
+    journal.write(path, data)
+    journal.commit()
+    """
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.path = self.root / JOURNAL_NAME
+        self.operations: List[list] = []
+        self.tmp_files: List[Path] = []
+        self.callbacks: List[Callable[[bool], None]] = []
+        self.lock = FolderLock(self.root)
+        self._file = None
+
+    def _log(self, record: dict):
+        if self._file is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            if self.lock._file is None:
+                self.lock.acquire()  # released by _done()
+            self._file = self.path.open("a", encoding="utf-8")
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def reserve(self, path: Path) -> Path:
+        """
+        Logs <path>~ before the caller creates it, e.g. as hard link.
+        :return: <path>~
+        """
+        tmp = tmp_path(Path(path))
+        if tmp not in self.tmp_files:
+            self._log({"tmp": str(tmp)})
+            self.tmp_files.append(tmp)
+        return tmp
+
+    @contextmanager
+    def open_tmp(self, path: Path):
+        """
+        Opens <path>~ for writing, the file is fsynced when it is closed.
+        :yields: binary file object
+        """
+        with self.reserve(path).open("wb") as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+
+    def replace(self, path: Path):
+        """Replaces path with <path>~ on commit()"""
+        path = Path(path)
+        self.operations.append(["replace", str(tmp_path(path)), str(path)])
+
+    def write(self, path: Path, data: bytes) -> int:
+        """
+        Replaces the content of path on commit().
+        :return: bytes written
+        """
+        with self.open_tmp(path) as file:
+            size = file.write(data)
+        self.replace(path)
+        return size
+
+    def splice(self, path: Path, offset: int, data: bytes) -> int:
+        """
+        Replaces everything behind offset of an existing file with data on
+        commit(), only the tail of the file is written.
+        :return: bytes written
+        """
+        path = Path(path)
+        with self.open_tmp(path) as file:
+            size = file.write(data)
+        self.operations.append(["splice", str(tmp_path(path)), str(path), offset])
+        return size
+
+    def after(self, callback: Callable[[bool], None]):
+        """callback(committed) is called after commit() or abort()"""
+        self.callbacks.append(callback)
+
+    def _done(self, committed: bool):
+        callbacks = self.callbacks
+        self.operations = []
+        self.tmp_files = []
+        self.callbacks = []
+        try:
+            for callback in callbacks:
+                callback(committed)
+        finally:
+            self.lock.release()
+
+    def commit(self):
+        """Writes the commit record and executes all operations"""
+        if not self.operations:
+            self.abort()
+            return
+        try:
+            self._log({"commit": self.operations})
+        except BaseException:
+            self.abort()
+            raise
+        self._close()
+        fsync_dir(self.root)
+
+        try:
+            for operation in self.operations:
+                apply_operation(operation)
+            self.path.unlink()
+        except BaseException:
+            self.lock.release()  # the journal is left for recover()
+            raise
+        self._done(True)
+
+    def abort(self):
+        """Removes all temporary files, the files are not changed"""
+        self._close()
+        for tmp in self.tmp_files:
+            tmp.unlink(missing_ok=True)
+        self.path.unlink(missing_ok=True)
+        self._done(False)
+
+
+def read_journal(path: Path):
+    """:return: list of temporary files, operations of the commit record or None"""
+    tmp_files = []
+    operations = None
+    with path.open(encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:  # interrupted while writing this line
+                break
+            if "tmp" in record:
+                tmp_files.append(Path(record["tmp"]))
+            elif "commit" in record:
+                operations = record["commit"]
+    return tmp_files, operations
+
+
+def is_stray(name: str) -> bool:
+    if name in STRAY_NAMES:
+        return True
+    return name.endswith(TMP_SUFFIX) and name[:-1].lower().endswith(STRAY_SUFFIXES)
+
+
+def remove_stray_files(root: Path) -> List[Path]:
+    """
+    Removes temporary files of interrupted imports in root and in the library
+    folders (.pretty, .3dshapes) next to the libraries.
+    :return: removed files
+    """
+    removed = []
+    folders = [(root, True)]
+    while folders:
+        folder, top = folders.pop()
+        try:
+            with os.scandir(folder) as entries:
+                entries = list(entries)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if top and not entry.name.startswith("."):
+                    folders.append((entry.path, False))
+            elif is_stray(entry.name):
+                try:
+                    os.unlink(entry.path)
+                    removed.append(Path(entry.path))
+                except OSError:
+                    pass
+    return removed
+
+
+def recover(root: Union[str, Path]) -> Union[str, None]:
+    """
+    Finishes or rolls back an import that was interrupted and removes stray
+    temporary files. To be called before the first import into root. Nothing
+    is done while another import into root holds the lock.
+    :return: "rolled forward", "rolled back" or None if there was no journal
+    """
+    root = Path(root)
+    if not root.is_dir():
+        return None
+    lock = FolderLock(root)
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        return _recover(root)
+    finally:
+        lock.release()
+
+
+def _recover(root: Path) -> Union[str, None]:
+    path = root / JOURNAL_NAME
+    result = None
+    if path.is_file():
+        tmp_files, operations = read_journal(path)
+        if operations is not None:
+            for operation in operations:
+                apply_operation(operation)
+            result = "rolled forward"
+        else:
+            for tmp in tmp_files:
+                tmp.unlink(missing_ok=True)
+            result = "rolled back"
+        path.unlink()
+        fsync_dir(root)
+    remove_stray_files(root)
+    return result
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        lib = root / "demo.kicad_sym"
+        lib.write_text("(kicad_symbol_lib\n)\n")
+
+        (root / "demo.pretty").mkdir()
+
+        journal = ImportJournal(root)
+        journal.splice(lib, len("(kicad_symbol_lib\n"), b'(symbol "A")\n)\n')
+        journal.write(root / "demo.pretty" / "A.kicad_mod", b"(footprint A)\n")
+        journal._log({"commit": journal.operations})  # crash before the renames
+        journal._close()
+        journal.lock.release()
+
+        print(recover(root))
+        print(lib.read_text())
+        print(sorted(path.name for path in root.rglob("*")))
@@ -1,11 +1,19 @@
+import os
+import shutil
 import subprocess
 
+# result of "kicad-cli --version" for (executable, mtime_ns)
+_probe_cache = {}
+
 
 class kicad_cli:
+    def executable(self):
+        return shutil.which("kicad-cli")
+
     def run_kicad_cli(self, command):
         try:
             result = subprocess.run(
-                ["kicad-cli"] + command,
+                [self.executable() or "kicad-cli"] + command,
                 check=True,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
@@ -13,12 +21,32 @@ class kicad_cli:
             )
             # print(result.stdout.strip())
             return True
-        except subprocess.CalledProcessError as e:
-            print(" ".join(["kicad-cli"] + command))
-            print(f"Error: {e.stderr}")
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(" ".join(["kicad-cli"] + [str(arg) for arg in command]))
+            print(f"Error: {getattr(e, 'stderr', e)}")
             return None
 
     def exists(self):
+        """
+        Checks the version of kicad-cli. The result is cached as long as the
+        executable is not replaced.
+        """
+        path = self.executable()
+        if not path:
+            key = None
+        else:
+            try:
+                key = (path, os.stat(path).st_mtime_ns)
+            except OSError:
+                key = None
+        if key not in _probe_cache:
+            if key is None:
+                print("kicad-cli does not exist")
+            _probe_cache[key] = self._probe(path) if key else False
+        return _probe_cache[key]
+
+    def _probe(self, path):
+        """Runs kicad-cli --version"""
 
         def version_to_tuple(version_str):
             try:
@@ -29,7 +57,7 @@ class kicad_cli:
 
         try:
             result = subprocess.run(
-                ["kicad-cli", "--version"],
+                [path, "--version"],
                 check=True,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
@@ -0,0 +1,642 @@
+"""
+Converts legacy KiCad symbol libraries (.lib with .dcm) to .kicad_sym
+without kicad-cli. The output follows what "kicad-cli sym upgrade" of
+KiCad 8 writes, so both can be compared with diff.
+"""
+
+import math
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Union
+
+try:
+    from ..kicad_cli import kicad_cli
+    from ..legacy_library import LegacyLibrary
+    from ..s_expression_parse import Quoted, format_sexp
+    from ..symbol_store import scan_symbols
+except ImportError:  # legacy_convert is a top-level package
+    from kicad_cli import kicad_cli
+    from legacy_library import LegacyLibrary
+    from s_expression_parse import Quoted, format_sexp
+    from symbol_store import scan_symbols
+
+KICAD_SYM_VERSION = 20231120
+
+# how legacy .lib files are converted: kicad-cli, native or auto (native
+# only if kicad-cli is not available)
+CONVERTERS = ("auto", "kicad-cli", "native")
+
+# kicad-cli processes running at the same time
+MAX_JOBS = max(1, min(4, os.cpu_count() or 1))
+
+IU_PER_MIL = 254  # eeschema works in 100 nm
+DEFAULT_PIN_NAME_OFFSET = 20  # mils
+DEFAULT_TEXT_SIZE = 50  # mils
+
+PIN_ORIENTATION = {"R": 0, "U": 90, "L": 180, "D": 270}
+PIN_TYPE = {
+    "I": "input",
+    "O": "output",
+    "B": "bidirectional",
+    "T": "tri_state",
+    "P": "passive",
+    "U": "unspecified",
+    "W": "power_in",
+    "w": "power_out",
+    "C": "open_collector",
+    "E": "open_emitter",
+    "N": "no_connect",
+}
+# legacy shape flags (without N for invisible) -> graphic style
+PIN_SHAPE = {
+    "": "line",
+    "I": "inverted",
+    "C": "clock",
+    "CI": "inverted_clock",
+    "L": "input_low",
+    "CL": "clock_low",
+    "V": "output_low",
+    "F": "edge_clock_high",
+    "X": "non_logic",
+}
+FILL = {"F": "outline", "f": "background", "N": "none"}
+H_JUSTIFY = {"L": "left", "R": "right"}
+V_JUSTIFY = {"T": "top", "B": "bottom"}
+FIELD_NAMES = ["Reference", "Value", "Footprint", "Datasheet"]
+# (xy ...) of a (pts ...) are written next to each other up to this column
+XY_WRAP = 99
+
+_token_pattern = re.compile(r'"(?:[^"\\]|\\.)*"|\S+')
+
+
+def quote(text: str) -> Quoted:
+    return Quoted(text)
+
+
+def _number(text: str) -> Union[int, float]:
+    """atom of a rounded decimal, whole numbers are written without .0"""
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def _mm(iu: int) -> Union[int, float]:
+    return _number(f"{iu / 10000:.4f}")
+
+
+def _degrees(tenths: str) -> Union[int, float]:
+    """angles of the legacy format are in tenths of a degree"""
+    return _number(f"{int(tenths) / 10:.1f}")
+
+
+def _iu(mils: str) -> int:
+    return round(float(mils)) * IU_PER_MIL
+
+
+def _unquote(token: str) -> str:
+    if len(token) >= 2 and token[0] == '"' and token[-1] == '"':
+        return token[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return token
+
+
+def _kiround(value: float) -> int:
+    return int(math.floor(value + 0.5)) if value >= 0 else -int(math.floor(-value + 0.5))
+
+
+def overbar_notation(text: str) -> str:
+    """~TEXT of the legacy format becomes ~{TEXT}, like KiCad does on import"""
+    if text == "~":
+        return text
+    out = []
+    in_overbar = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "~":
+            lookahead = text[i + 1 : i + 2]
+            if lookahead == "~":
+                if text[i + 2 : i + 3] == "{":
+                    out.append("~~{}")
+                    i += 3
+                    continue
+                out.append("~")  # two tildes are a tilde
+                i += 2
+                continue
+            if lookahead == "{":
+                return text  # already converted
+            out.append("}" if in_overbar else "~{")
+            in_overbar = not in_overbar
+            i += 1
+            continue
+        if char in " })" and in_overbar:
+            out.append("}")
+            in_overbar = False
+        out.append(char)
+        i += 1
+    if in_overbar:
+        out.append("}")
+    return "".join(out)
+
+
+def escape_name(name: str) -> str:
+    """symbol names are LIB_IDs, KiCad escapes these characters"""
+    return name.replace("/", "{slash}").replace(":", "{colon}")
+
+
+def parse_dcm(text: Union[str, None]) -> Dict[str, dict]:
+    """:return: {name: {"D": description, "K": keywords, "F": datasheet}}"""
+    docs = {}
+    entry = None
+    for line in (text or "").splitlines():
+        if line.startswith("$CMP "):
+            entry = docs.setdefault(line[5:].strip(), {})
+        elif line.startswith("$ENDCMP"):
+            entry = None
+        elif entry is not None and line[:2] in ("D ", "K ", "F "):
+            entry[line[0]] = line[2:].strip()
+    return docs
+
+
+def parse_lib(text: str) -> List[dict]:
+    """:return: the DEF ... ENDDEF records of a legacy library"""
+    symbols = []
+    symbol = None
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        tokens = _token_pattern.findall(line)
+        key = tokens[0]
+        if key == "DEF":
+            tokens += [""] * (10 - len(tokens))
+            symbol = {
+                "name": tokens[1][1:] if tokens[1].startswith("~") else tokens[1],
+                "offset": int(tokens[4] or DEFAULT_PIN_NAME_OFFSET),
+                "pin_numbers": tokens[5] != "N",
+                "pin_names": tokens[6] != "N",
+                "power": tokens[9] == "P",
+                "fields": {},
+                "aliases": [],
+                "fp_filters": [],
+                "draw": [],
+            }
+            section = None
+        elif symbol is None:
+            continue
+        elif key == "ENDDEF":
+            symbols.append(symbol)
+            symbol = None
+        elif section == "$FPLIST":
+            if key == "$ENDFPLIST":
+                section = None
+            else:
+                symbol["fp_filters"].extend(tokens)
+        elif section == "DRAW":
+            if key == "ENDDRAW":
+                section = None
+            else:
+                symbol["draw"].append(tokens)
+        elif key in ("$FPLIST", "DRAW"):
+            section = key
+        elif key == "ALIAS":
+            symbol["aliases"].extend(tokens[1:])
+        elif key[0] == "F" and key[1:].isdigit():
+            symbol["fields"][int(key[1:])] = tokens
+    return symbols
+
+
+def _effects(size, hide=False, hjustify="", vjustify="", italic=False, bold=False):
+    font = ["font", ["size", _mm(size), _mm(size)]]
+    if bold:
+        font.append("bold")
+    if italic:
+        font.append("italic")
+    effects = ["effects", font]
+    justify = [j for j in (H_JUSTIFY.get(hjustify), V_JUSTIFY.get(vjustify)) if j]
+    if justify:
+        effects.append(["justify"] + justify)
+    if hide:
+        effects.append("hide")
+    return effects
+
+
+def _property(name, value, x=0, y=0, angle=0, effects=None):
+    return [
+        "property",
+        quote(name),
+        quote(value),
+        ["at", _mm(x), _mm(y), angle],
+        effects or _effects(DEFAULT_TEXT_SIZE * IU_PER_MIL, hide=True),
+    ]
+
+
+def _field(tokens, name):
+    """F0..Fn line -> property"""
+    tokens = tokens + [""] * (9 - len(tokens))
+    text = _unquote(tokens[1])
+    text = "" if text == "~" else overbar_notation(text)
+    style = (tokens[8] or "CNN") + "NN"
+    effects = _effects(
+        _iu(tokens[4] or DEFAULT_TEXT_SIZE),
+        hide=tokens[6] == "I",
+        hjustify=tokens[7],
+        vjustify=style[0],
+        italic=style[1] == "I",
+        bold=style[2] == "B",
+    )
+    angle = 90 if tokens[5] == "V" else 0
+    return _property(
+        name, text, _iu(tokens[2] or 0), _iu(tokens[3] or 0), angle, effects
+    )
+
+
+def _stroke_fill(width, fill):
+    return [
+        ["stroke", ["width", _mm(_iu(width))], ["type", "default"]],
+        ["fill", ["type", FILL.get(fill, "none")]],
+    ]
+
+
+def _swap_arc_ends(angle1: float, angle2: float) -> bool:
+    """TRANSFORM::MapAngles() of KiCad, the ends are swapped if it does not swap"""
+    delta = angle2 - angle1
+    if delta >= 180:
+        angle1 -= 0.1
+        angle2 += 0.1
+    mapped1 = -angle1 % 360
+    mapped2 = -angle2 % 360
+    if mapped2 < mapped1:
+        mapped2 += 360
+    return not mapped2 - mapped1 > 180
+
+
+def _arc(tokens):
+    """A cx cy r angle1 angle2 unit convert width fill startx starty endx endy"""
+    cx, cy, radius = _iu(tokens[1]), _iu(tokens[2]), _iu(tokens[3])
+    angle1 = int(tokens[4]) % 3600 / 10
+    angle2 = int(tokens[5]) % 3600 / 10
+    if len(tokens) >= 14:
+        start = (_iu(tokens[10]), _iu(tokens[11]))
+        end = (_iu(tokens[12]), _iu(tokens[13]))
+    else:
+        start, end = [
+            (
+                _kiround(cx + radius * math.cos(math.radians(angle))),
+                _kiround(cy + radius * math.sin(math.radians(angle))),
+            )
+            for angle in (angle1, angle2)
+        ]
+    if _swap_arc_ends(angle1, angle2):
+        start, end = end, start
+
+    # counterclockwise from start to end, the mid point halves the angle
+    start_angle = math.degrees(math.atan2(start[1] - cy, start[0] - cx))
+    end_angle = math.degrees(math.atan2(end[1] - cy, end[0] - cx))
+    if end_angle == start_angle:
+        end_angle += 360
+    while end_angle < start_angle:
+        end_angle += 360
+    half = math.radians((end_angle - start_angle) / 2)
+    dx, dy = start[0] - cx, start[1] - cy
+    mid = (
+        _kiround(cx + dx * math.cos(half) - dy * math.sin(half)),
+        _kiround(cy + dy * math.cos(half) + dx * math.sin(half)),
+    )
+    shape = ["arc"]
+    for key, (x, y) in (("start", start), ("mid", mid), ("end", end)):
+        shape.append([key, _mm(x), _mm(y)])
+    return shape + _stroke_fill(tokens[8], tokens[9] if len(tokens) > 9 else "N")
+
+
+def _points(coordinates):
+    pts = ["pts"]
+    for i in range(0, len(coordinates) - 1, 2):
+        pts.append(["xy", _mm(_iu(coordinates[i])), _mm(_iu(coordinates[i + 1]))])
+    return pts
+
+
+def _draw_item(tokens):
+    """:return: (unit, convert, kind, s-expression) of a DRAW line or None"""
+    key = tokens[0]
+    if key == "A" and len(tokens) >= 9:
+        return int(tokens[6]), int(tokens[7]), 0, _arc(tokens)
+    if key == "C" and len(tokens) >= 7:
+        shape = [
+            "circle",
+            ["center", _mm(_iu(tokens[1])), _mm(_iu(tokens[2]))],
+            ["radius", _mm(_iu(tokens[3]))],
+        ]
+        fill = tokens[7] if len(tokens) > 7 else "N"
+        return int(tokens[4]), int(tokens[5]), 0, shape + _stroke_fill(tokens[6], fill)
+    if key == "S" and len(tokens) >= 8:
+        shape = [
+            "rectangle",
+            ["start", _mm(_iu(tokens[1])), _mm(_iu(tokens[2]))],
+            ["end", _mm(_iu(tokens[3])), _mm(_iu(tokens[4]))],
+        ]
+        fill = tokens[8] if len(tokens) > 8 else "N"
+        return int(tokens[5]), int(tokens[6]), 0, shape + _stroke_fill(tokens[7], fill)
+    if key in ("P", "B") and len(tokens) >= 5:
+        count = int(tokens[1])
+        coordinates = tokens[5 : 5 + 2 * count]
+        fill = tokens[5 + 2 * count] if len(tokens) > 5 + 2 * count else "N"
+        kind = "polyline" if key == "P" else "bezier"
+        shape = [kind, _points(coordinates)] + _stroke_fill(tokens[4], fill)
+        return int(tokens[2]), int(tokens[3]), 0, shape
+    if key == "T" and len(tokens) >= 9:
+        text = tokens[8]
+        if text.startswith('"'):
+            text = _unquote(text)
+        else:
+            text = text.replace("~", " ")  # spaces of unquoted texts
+        text = text.replace("''", '"')
+        tokens = tokens + [""] * (13 - len(tokens))
+        effects = _effects(
+            _iu(tokens[4]),
+            hide=tokens[5] != "0",
+            hjustify=tokens[11],
+            vjustify=tokens[12],
+            italic=tokens[9] == "Italic",
+            bold=tokens[10] == "1",
+        )
+        item = [
+            "text",
+            quote(text),
+            ["at", _mm(_iu(tokens[2])), _mm(_iu(tokens[3])), _degrees(tokens[1])],
+            effects,
+        ]
+        return int(tokens[6]), int(tokens[7]), 1, item
+    if key == "X" and len(tokens) >= 12:
+        # KiCad keeps "~" as the name of unnamed pins, but not as the number
+        name = "~" if tokens[1] == "~" else overbar_notation(tokens[1])
+        number = "" if tokens[2] == "~" else tokens[2]
+        shape = tokens[12] if len(tokens) > 12 else ""
+        flags = "".join(sorted(set(shape) - {"N"}))
+        pin = [
+            "pin",
+            PIN_TYPE.get(tokens[11], "unspecified"),
+            PIN_SHAPE.get(flags, "line"),
+            [
+                "at",
+                _mm(_iu(tokens[3])),
+                _mm(_iu(tokens[4])),
+                PIN_ORIENTATION.get(tokens[6], 0),
+            ],
+            ["length", _mm(_iu(tokens[5]))],
+        ]
+        if "N" in shape:
+            pin.append("hide")
+        pin.append(["name", quote(name), _effects(_iu(tokens[8]))])
+        pin.append(["number", quote(number), _effects(_iu(tokens[7]))])
+        return int(tokens[9]), int(tokens[10]), 2, pin
+    return None
+
+
+def _fields(symbol, docs, value=None):
+    """properties of a symbol, value is set for the aliases"""
+    properties = []
+    for index, field_name in enumerate(FIELD_NAMES):
+        if index in symbol["fields"]:
+            prop = _field(symbol["fields"][index], field_name)
+        else:
+            prop = _property(field_name, "")
+        properties.append(prop)
+    if value is not None:
+        properties[1][2] = quote(value)
+    if docs.get("F"):
+        properties[3][2] = quote(docs["F"])
+
+    properties.append(_property("Description", docs.get("D", "")))
+    if value is None:
+        for index in sorted(symbol["fields"]):
+            tokens = symbol["fields"][index]
+            if index >= len(FIELD_NAMES) and len(tokens) > 9:
+                properties.append(_field(tokens, _unquote(tokens[9])))
+    if docs.get("K"):
+        properties.append(_property("ki_keywords", docs["K"]))
+    if symbol["fp_filters"] and value is None:
+        properties.append(_property("ki_fp_filters", " ".join(symbol["fp_filters"])))
+    return properties
+
+
+def convert_symbol(symbol: dict, docs: Dict[str, dict]) -> List[list]:
+    """:return: s-expressions of the symbol and of its aliases"""
+    name = escape_name(symbol["name"])
+    node = ["symbol", quote(name)]
+    if symbol["power"]:
+        node.append(["power"])
+    if not symbol["pin_numbers"]:
+        node.append(["pin_numbers", "hide"])
+    if symbol["offset"] != DEFAULT_PIN_NAME_OFFSET or not symbol["pin_names"]:
+        pin_names = ["pin_names"]
+        if symbol["offset"] != DEFAULT_PIN_NAME_OFFSET:
+            pin_names.append(["offset", _mm(symbol["offset"] * IU_PER_MIL)])
+        if not symbol["pin_names"]:
+            pin_names.append("hide")
+        node.append(pin_names)
+    node += [["exclude_from_sim", "no"], ["in_bom", "yes"], ["on_board", "yes"]]
+    node += _fields(symbol, docs.get(symbol["name"], {}))
+
+    units = {}
+    for tokens in symbol["draw"]:
+        try:
+            item = _draw_item(tokens)
+        except (ValueError, IndexError):
+            item = None
+        if item:
+            unit, convert, kind, sexp = item
+            units.setdefault((unit, convert), []).append((kind, sexp))
+    for unit, convert in sorted(units):
+        items = sorted(units[(unit, convert)], key=lambda item: item[0])
+        sub = ["symbol", quote(f"{name}_{unit}_{convert}")]
+        node.append(sub + [sexp for _, sexp in items])
+
+    symbols = [node]
+    for alias in symbol["aliases"]:
+        derived = ["symbol", quote(escape_name(alias)), ["extends", quote(name)]]
+        derived += _fields(symbol, docs.get(alias, {}), value=alias)
+        symbols.append(derived)
+    return symbols
+
+
+def convert(lib_text: str, dcm_text: Union[str, None] = None) -> str:
+    """:return: .kicad_sym content of a legacy .lib (and .dcm) content"""
+    docs = parse_dcm(dcm_text)
+    library = [
+        "kicad_symbol_lib",
+        ["version", KICAD_SYM_VERSION],
+        ["generator", quote("kicad_symbol_editor")],
+        ["generator_version", quote("8.0")],
+    ]
+    for symbol in parse_lib(lib_text):
+        library += convert_symbol(symbol, docs)
+    return format_sexp(library, xy_wrap=XY_WRAP) + "\n"
+
+
+def convert_file(lib_path: Union[str, Path], out_path: Union[str, Path]) -> bool:
+    """Converts a .lib file, descriptions are taken from the .dcm next to it"""
+    lib_path = Path(lib_path)
+    dcm_path = lib_path.with_suffix(".dcm")
+    dcm_text = dcm_path.read_text(encoding="utf-8") if dcm_path.is_file() else None
+    text = convert(lib_path.read_text(encoding="utf-8"), dcm_text)
+    Path(out_path).write_text(text, encoding="utf-8")
+    return True
+
+
+def uses_native(converter="auto", cli=None) -> bool:
+    """:return: True if legacy .lib files are converted without kicad-cli"""
+    if converter not in CONVERTERS:
+        raise ValueError(f"Unknown converter '{converter}'")
+    if converter == "auto":
+        return not (cli or kicad_cli()).exists()
+    return converter == "native"
+
+
+def upgrade_batched(conversions, cli, jobs=MAX_JOBS):
+    """
+    Converts many symbol libraries with as few kicad-cli calls as possible.
+
+    Legacy .lib files (with their .dcm) are merged into one library per
+    batch, converted once and split into the output files again. A batch
+    never contains a symbol name twice. Independent batches and other
+    libraries run in up to jobs processes at the same time.
+    :param conversions: [(input_file, output_file), ...]
+    :return: {output_file: True or None}
+    """
+    batches = []  # [[(input_file, output_file, names), ...], ...]
+    batch_names = []
+    for input_file, output_file in conversions:
+        names = set()
+        if Path(input_file).suffix == ".lib":
+            names = library_symbols(input_file)
+        for batch, used in zip(batches, batch_names):
+            if names and not names & used:
+                batch.append((input_file, output_file, names))
+                used |= names
+                break
+        else:
+            batches.append([(input_file, output_file, names)])
+            batch_names.append(set(names))
+
+    results = {}
+    if not batches:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(batches)))) as pool:
+        for result in pool.map(lambda batch: _upgrade_batch(batch, cli), batches):
+            results.update(result)
+    return results
+
+
+def _upgrade_batch(batch, cli):
+    """Converts [(input_file, output_file, names), ...] with one kicad-cli call"""
+    if len(batch) == 1:
+        input_file, output_file, _ = batch[0]
+        return {output_file: cli.upgrade_sym_lib(input_file, output_file)}
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_lib = Path(temp_dir) / "batch.lib"
+        temp_out = Path(temp_dir) / "batch.kicad_sym"
+        for suffix in (".lib", ".dcm"):
+            merged = LegacyLibrary(temp_lib.with_suffix(suffix))
+            for input_file, _, _ in batch:
+                source = LegacyLibrary(Path(input_file).with_suffix(suffix))
+                for name in source.names():
+                    merged.add(name, source.get(name))
+            merged.save()
+
+        if cli.upgrade_sym_lib(temp_lib, temp_out) and temp_out.is_file():
+            results = split_library(temp_out.read_bytes(), batch)
+
+    # kicad-cli renamed symbols, convert these libraries one by one
+    for input_file, output_file, _ in batch:
+        if output_file not in results:
+            results[output_file] = cli.upgrade_sym_lib(input_file, output_file)
+    return results
+
+
+def library_symbols(lib_file):
+    """:return: names of all symbols (including aliases) of a legacy .lib"""
+    library = LegacyLibrary(lib_file)
+    names = set(library.names())
+    for name in library.names():
+        for line in library.get(name):
+            if line.startswith("ALIAS "):
+                names.update(line.split()[1:])
+    return names
+
+
+def split_library(data: bytes, batch):
+    """
+    Writes the symbols of a converted batch library into the output files.
+    Every file is written to a temporary file first and then replaced.
+    :return: {output_file: True} or {} if a symbol can not be assigned
+    """
+    symbols, tail = scan_symbols(data)
+    if not symbols or tail is None:
+        return {}
+    header = data[: symbols[0][1]]
+    last_end = symbols[-1][1] + symbols[-1][2]
+    if len(symbols) > 1:
+        separator = data[symbols[-2][1] + symbols[-2][2] : symbols[-1][1]]
+    else:
+        separator = b"\n"
+
+    owner = {}
+    for index, (_, _, names) in enumerate(batch):
+        owner.update(dict.fromkeys(names, index))
+    parts = [[] for _ in batch]
+    for name, offset, length in symbols:
+        if name not in owner:
+            return {}
+        parts[owner[name]].append(data[offset : offset + length])
+
+    results = {}
+    for (_, output_file, _), blocks in zip(batch, parts):
+        tmp_path = str(output_file) + "~"
+        with open(tmp_path, "wb") as file:
+            file.write(header + separator.join(blocks) + data[last_end:])
+        os.replace(tmp_path, output_file)
+        results[output_file] = True
+    return results
+
+
+def upgrade_sym_libs(conversions, converter="auto", cli=None):
+    """
+    Converts symbol libraries with the selected converter. Only legacy .lib
+    files can be converted natively, the rest always needs kicad-cli.
+    :param conversions: [(input_file, output_file), ...]
+    :return: {output_file: True or None}
+    """
+    cli = cli or kicad_cli()
+    native = uses_native(converter, cli)
+
+    results = {}
+    remaining = []
+    for input_file, output_file in conversions:
+        if native and Path(input_file).suffix == ".lib":
+            try:
+                results[output_file] = convert_file(input_file, output_file)
+            except (OSError, ValueError, IndexError) as e:
+                print(f"Error converting {Path(input_file).name}: {e}")
+                results[output_file] = None
+        else:
+            remaining.append((input_file, output_file))
+    if remaining:
+        if cli.exists():
+            results.update(upgrade_batched(remaining, cli))
+        else:
+            results.update({output_file: None for _, output_file in remaining})
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("usage: legacy_convert <input.lib> <output.kicad_sym>")
+    else:
+        convert_file(sys.argv[1], sys.argv[2])
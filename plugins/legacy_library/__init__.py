@@ -0,0 +1,281 @@
+import mmap
+import re
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+# start of a component, end of a component, template of an empty file
+FORMATS = {
+    ".dcm": (
+        "$CMP ",
+        "$ENDCMP",
+        ["EESchema-DOCLIB  Version 2.0"],
+        ["#End Doc Library"],
+    ),
+    ".lib": (
+        "DEF ",
+        "ENDDEF",
+        ["EESchema-LIBRARY Version 2.4", "#encoding utf-8"],
+        ["# End Library"],
+    ),
+}
+
+_end_pattern = re.compile(rb"^# *end ", re.IGNORECASE | re.MULTILINE)
+
+
+def component_name(line: str, suffix: str) -> str:
+    if suffix == ".dcm":
+        return line[5:].strip()
+    return line.split()[1]
+
+
+def find_footer(data, start: bytes, end: bytes) -> int:
+    """
+    Walks back from the end of the file to the end line ("#End Library")
+    behind the last component.
+    :param data: bytes or mmap of the library
+    :return: offset of the end line or len(data) if there is none
+    """
+    footer = line_end = len(data)
+    while line_end > 0:
+        line_start = data.rfind(b"\n", 0, line_end - 1) + 1
+        line = data[line_start:line_end]
+        if line.startswith(end) or line.startswith(start):
+            break
+        if _end_pattern.match(line):
+            footer = line_start
+        line_end = line_start
+    return footer
+
+
+def scan_components(
+    data, start: bytes, end: bytes, suffix: str, footer: int
+) -> Dict[str, Tuple[int, int]]:
+    """
+    Finds the components in front of the footer with find(), the lines in
+    between are not looked at.
+    :param data: bytes or mmap of the library
+    :return: {name: (offset, end offset)}
+    """
+    components = {}
+    marker = b"\n" + start
+    end_marker = b"\n" + end
+    offset = 0 if data[: len(start)] == start else data.find(marker, 0, footer)
+    if offset > 0:
+        offset += 1
+    while offset >= 0:
+        line_end = data.find(b"\n", offset, footer)
+        if line_end < 0:
+            line_end = footer
+        name = component_name(data[offset:line_end].decode("utf-8", "replace"), suffix)
+        next_start = data.find(marker, line_end, footer)
+        limit = footer if next_start < 0 else next_start + 1
+        stop = data.find(end_marker, line_end, limit)
+        if stop < 0:  # no end line, ends with the next component
+            stop = limit
+        else:
+            stop = data.find(b"\n", stop + 1, limit)
+            stop = limit if stop < 0 else stop + 1
+        components[name] = (offset, stop)
+        offset = -1 if next_start < 0 else next_start + 1
+    return components
+
+
+class LegacyLibrary:
+    """
+    Memory-mapped legacy .lib or .dcm library.
+
+    Nothing is parsed when the library is opened: a component is looked up
+    with one mmap.find() of its first line, the end line is found from the
+    end of the file. The offsets of all components are only scanned if they
+    are needed, e.g. to replace a component. Added and replaced components
+    are kept in memory until save(): new components are written in front of
+    the end line, only a replaced component rewrites the library.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.start, self.end, self.header, self.footer = FORMATS[self.path.suffix]
+        self.added: Dict[str, List[str]] = {}
+        self.replaced: Dict[str, List[str]] = {}
+        self.last_commit = None  # ("create", "append" or "rewrite", bytes written)
+        self._components = None
+        self._map = None
+        self._footer = 0
+        self.load()
+
+    @property
+    def modified(self) -> bool:
+        return bool(self.added or self.replaced)
+
+    def load(self):
+        """Maps the library file, pending changes are dropped"""
+        self.close()
+        self._components = None
+        self.added = {}
+        self.replaced = {}
+        data = self._data()
+        self._footer = 0
+        if data is not None:
+            self._footer = find_footer(
+                data, self.start.encode("utf-8"), self.end.encode("utf-8")
+            )
+
+    @property
+    def components(self) -> Dict[str, Tuple[int, int]]:
+        """{name: (offset, end offset)} of the components in the file"""
+        if self._components is None:
+            data = self._data()
+            self._components = {}
+            if data is not None:
+                self._components = scan_components(
+                    data,
+                    self.start.encode("utf-8"),
+                    self.end.encode("utf-8"),
+                    self.path.suffix,
+                    self._footer,
+                )
+        return self._components
+
+    def _find(self, name: str) -> bool:
+        """:return: True if the file contains name, without scanning all components"""
+        data = self._data()
+        if data is None:
+            return False
+        head = (self.start + name).encode("utf-8")
+        offset = 0 if data[: len(head)] == head else data.find(b"\n" + head)
+        while 0 <= offset < self._footer:
+            if offset:
+                offset += 1
+            line_end = data.find(b"\n", offset)
+            if line_end < 0:
+                line_end = len(data)
+            line = data[offset:line_end].decode("utf-8", "replace")
+            if component_name(line, self.path.suffix) == name:
+                return True
+            offset = data.find(b"\n" + head, line_end)
+        return False
+
+    def _data(self) -> Union[mmap.mmap, None]:
+        """:return: read-only mmap of the library or None if it is empty"""
+        if self._map is None:
+            try:
+                with self.path.open("rb") as file:
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):  # missing or empty file
+                return None
+        return self._map
+
+    def close(self):
+        """Unmaps the file, required before it can be replaced on Windows"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __contains__(self, name: str) -> bool:
+        if name in self.added:
+            return True
+        if self._components is not None:
+            return name in self._components
+        return self._find(name)
+
+    def __len__(self):
+        return len(self.components) + len(self.added)
+
+    def names(self) -> List[str]:
+        return list(self.components) + list(self.added)
+
+    def get(self, name: str) -> List[str]:
+        if name in self.replaced:
+            return self.replaced[name]
+        if name in self.added:
+            return self.added[name]
+        offset, stop = self.components[name]
+        return self._data()[offset:stop].decode("utf-8").splitlines()
+
+    def add(self, name: str, lines: List[str]):
+        """Appends a new component in front of the end of the library"""
+        if name in self:
+            self.replace(name, lines)
+        else:
+            self.added[name] = list(lines)
+
+    def replace(self, name: str, lines: List[str]):
+        if name in self.added:
+            self.added[name] = list(lines)
+        else:
+            self.replaced[name] = list(lines)
+
+    def _default_footer(self) -> bytes:
+        return ("\n".join(self.footer) + "\n").encode("utf-8")
+
+    def _tail(self) -> Tuple[str, int, bytes]:
+        """
+        :return: mode, offset and new content of the file from offset on
+        """
+        added = b"".join(
+            ("\n".join(lines) + "\n").encode("utf-8") for lines in self.added.values()
+        )
+        data = self._data()
+        if data is None:
+            head = ("\n".join(self.header) + "\n").encode("utf-8")
+            return "create", 0, head + added + self._default_footer()
+
+        if not self.replaced:
+            footer = data[self._footer :] or self._default_footer()
+            if self._footer and data[self._footer - 1 : self._footer] != b"\n":
+                added = b"\n" + added
+            return "append", self._footer, added + footer
+
+        parts = []
+        position = 0
+        for (offset, stop), name in sorted(
+            (self.components[name], name) for name in self.replaced
+        ):
+            parts.append(data[position:offset])
+            parts.append(("\n".join(self.replaced[name]) + "\n").encode("utf-8"))
+            position = stop
+        parts.append(data[position : self._footer])
+        if self._footer and data[self._footer - 1 : self._footer] != b"\n":
+            parts.append(b"\n")
+        parts.append(added)
+        parts.append(data[self._footer :] or self._default_footer())
+        return "rewrite", 0, b"".join(parts)
+
+    def text(self) -> str:
+        mode, offset, tail = self._tail()
+        data = self._data()
+        head = data[:offset] if data is not None else b""
+        return (head + tail).decode("utf-8")
+
+    def save(self, journal=None) -> bool:
+        """
+        Writes the changes, new components only rewrite the end of the file.
+        :param journal: ImportJournal, the file is changed by its commit()
+        :return: True if the library was changed
+        """
+        if not self.modified:
+            return False
+        mode, offset, tail = self._tail()
+        self.close()  # a mapped file can not be truncated or replaced on Windows
+        if mode == "append":
+            if journal is not None:
+                journal.splice(self.path, offset, tail)
+            else:
+                with self.path.open("r+b") as file:
+                    file.seek(offset)
+                    file.write(tail)
+                    file.truncate()
+        else:
+            if journal is not None:
+                journal.write(self.path, tail)
+            else:
+                tmp_path = self.path.with_name(self.path.name + "~")
+                tmp_path.write_bytes(tail)
+                tmp_path.replace(self.path)
+        self.last_commit = (mode, len(tail))
+
+        if journal is not None:
+            journal.after(lambda committed: self.load())
+        else:
+            self.load()
+        return True
@@ -0,0 +1,278 @@
+import json
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Union
+
+try:
+    from ..s_expression_parse import LazyNode, atom_value
+except ImportError:  # library_check is a top-level package
+    from s_expression_parse import LazyNode, atom_value
+
+# Cache of the facts of every library file, e.g. <DEST_PATH>/.impart_verify.json
+# {"version": 1, "files": {"Samacsys.pretty/SOT23.kicad_mod": [size, mtime_ns, facts]}}
+CACHE_NAME = ".impart_verify.json"
+CACHE_VERSION = 2  # to be increased when scan_file() changes
+# fewer changed files are parsed without starting a process pool
+POOL_MIN_FILES = 64
+
+Problem = namedtuple("Problem", ["kind", "path", "name", "detail"])
+
+# values are found with a regex inside the blocks, like symbol_info() of
+# symbol_store, parsing every property and pad costs more than the whole scan
+_quoted = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_footprint_pattern = re.compile(rb'\(property\s+"Footprint"\s+(' + _quoted + rb")", re.S)
+_model_pattern = re.compile(rb"\(\s*model\s+(" + _quoted + rb'|[^\s()"]+)', re.S)
+_lib_pattern = re.compile(rb'^(?:DEF +(\S+)|F2 +"([^"]*)")', re.MULTILINE)
+_dcm_pattern = re.compile(rb"^\$CMP +(.*?)\s*$", re.MULTILINE)
+_variable_pattern = re.compile(r"\$\{([^}]+)\}")
+
+
+def scan_file(path: str) -> dict:
+    """
+    Reads the facts of one library file that are cross-referenced later,
+    runs in the worker processes.
+    :return: {"symbols": [[name, footprint], ...]} for .kicad_sym and .lib,
+        {"entries": [name, ...]} for .dcm, {"models": [path, ...]} for
+        .kicad_mod or {"error": message}, read errors are not cached
+        and carry "retry": True
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+        if suffix == ".kicad_sym":
+            root = LazyNode.parse(data)
+            if root is None or root.end is None:
+                return {"error": "no complete s-expression found"}
+            symbols = []
+            for node in root:
+                if node.name == "symbol":
+                    match = _footprint_pattern.search(data, node.start, node.end)
+                    footprint = atom_value(match.group(1)) if match else None
+                    symbols.append([node.key, footprint])
+            return {"symbols": symbols}
+        if suffix == ".lib":
+            symbols = []
+            for name, footprint in _lib_pattern.findall(data):
+                if name:
+                    symbols.append([name.decode("utf-8", "replace"), None])
+                elif symbols and symbols[-1][1] is None:
+                    symbols[-1][1] = footprint.decode("utf-8", "replace")
+            return {"symbols": symbols}
+        if suffix == ".dcm":
+            entries = _dcm_pattern.findall(data)
+            return {"entries": [name.decode("utf-8", "replace") for name in entries]}
+        data.decode("utf-8")  # only checked, the pattern works on the bytes
+        if data.count(b"(") != data.count(b")"):  # or brackets in strings
+            root = LazyNode.parse(data)
+            if root is None or root.end is None:
+                return {"error": "no complete s-expression found"}
+        return {"models": [atom_value(path) for path in _model_pattern.findall(data)]}
+    except (ValueError, AssertionError, UnicodeDecodeError) as e:
+        return {"error": str(e) or type(e).__name__}
+    except OSError as e:  # removed or not readable since the folder listing
+        return {"error": e.strerror or type(e).__name__, "retry": True}
+
+
+class LibraryCheck:
+    """
+    Health scan of the libraries of an import folder.
+
+    Every .kicad_sym, .lib, .dcm and .kicad_mod is parsed once, in a
+    process pool with jobs > 1, and files that did not change since the
+    last scan are taken from the cache. The facts are cross-referenced
+    through in-memory indexes:
+
+    dangling footprint    Footprint "<lib>:<name>" of a symbol, <lib> is a
+                          library of the folder but <lib>.pretty has no
+                          <name>.kicad_mod
+    missing model         (model ...) of a footprint whose file does not
+                          exist, relative paths and paths with unknown
+                          variables are skipped
+    duplicate symbol      symbol name used twice in a .kicad_sym or .lib
+    orphaned dcm entry    .dcm entry without a symbol in the .lib or
+                          .kicad_sym of the same name
+    unreadable            file that could not be parsed
+
+    check = LibraryCheck(DEST_PATH, jobs=4)
+    for problem in check.run(): ...
+    """
+
+    def __init__(
+        self,
+        lib_folder: Union[str, Path],
+        path_variable: str = "${KICAD_3RD_PARTY}",
+        jobs: int = 1,
+    ):
+        self.lib_folder = Path(lib_folder)
+        self.cache_path = self.lib_folder / CACHE_NAME
+        self.path_variable = path_variable
+        self.jobs = jobs
+        self.facts: Dict[str, dict] = {}  # relative path: facts
+        self.scanned = 0
+        self.cached = 0
+        self._listings: Dict[str, set] = {}  # folder: file names
+
+    def library_files(self) -> Dict[str, os.stat_result]:
+        """:return: {relative path: stat} of the libraries and footprints"""
+        files = {}
+        with os.scandir(self.lib_folder) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        for entry in entries:
+            name = entry.name
+            if entry.is_dir() and name.endswith(".pretty"):
+                with os.scandir(entry.path) as footprints:
+                    for footprint in footprints:
+                        if footprint.name.endswith(".kicad_mod") and footprint.is_file():
+                            files[name + "/" + footprint.name] = footprint.stat()
+            elif name.endswith((".kicad_sym", ".lib", ".dcm")) and entry.is_file():
+                files[name] = entry.stat()
+        return files
+
+    def load_cache(self) -> dict:
+        try:
+            cache = json.loads(self.cache_path.read_text(encoding="utf-8"))
+            if cache["version"] == CACHE_VERSION:
+                return cache["files"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return {}
+
+    def save_cache(self, files: dict):
+        tmp_path = self.cache_path.with_name(CACHE_NAME + "~")
+        data = json.dumps({"version": CACHE_VERSION, "files": files})
+        tmp_path.write_text(data, encoding="utf-8")
+        tmp_path.replace(self.cache_path)
+
+    def scan(self):
+        """Reads the facts of all files, only changed files are parsed"""
+        cache = self.load_cache()
+        files = {}
+        changed = []
+        for name, st in self.library_files().items():
+            entry = cache.get(name)
+            if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                files[name] = entry
+            else:
+                files[name] = [st.st_size, st.st_mtime_ns, None]
+                changed.append(name)
+
+        paths = [str(self.lib_folder / name) for name in changed]
+        if self.jobs > 1 and len(paths) >= POOL_MIN_FILES:
+            chunksize = max(1, len(paths) // (self.jobs * 8))
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                results = list(executor.map(scan_file, paths, chunksize=chunksize))
+        else:
+            results = [scan_file(path) for path in paths]
+        for name, facts in zip(changed, results):
+            files[name][2] = facts
+
+        self.facts = {name: entry[2] for name, entry in files.items()}
+        self.scanned = len(changed)
+        self.cached = len(files) - len(changed)
+        # a file that could not be read is scanned again next time
+        retry = [name for name in changed if files[name][2].get("retry")]
+        for name in retry:
+            del files[name]
+        if len(retry) < len(changed) or len(files) != len(cache):
+            self.save_cache(files)
+
+    def resolve_model(self, path: str) -> Union[Path, None]:
+        """
+        :return: file of a model path, None if it is relative or contains
+            a variable that is neither the path variable of the import nor set
+        """
+
+        def variable(match):
+            if "${" + match.group(1) + "}" == self.path_variable:
+                return str(self.lib_folder)
+            value = os.environ.get(match.group(1))
+            if value is None:
+                raise KeyError(match.group(1))
+            return value
+
+        try:
+            path = Path(_variable_pattern.sub(variable, path))
+        except KeyError:
+            return None
+        return path if path.is_absolute() else None
+
+    def exists(self, path: Path) -> bool:
+        """File test with one directory listing per folder"""
+        folder = str(path.parent)
+        names = self._listings.get(folder)
+        if names is None:
+            try:
+                names = self._listings[folder] = set(os.listdir(folder))
+            except OSError:
+                names = self._listings[folder] = set()
+        return path.name in names
+
+    def check(self) -> List[Problem]:
+        """Cross-references the facts of scan()"""
+        problems = []
+        footprints: Dict[str, set] = {}  # library: footprint names
+        libraries = set()
+        for name in self.facts:
+            if "/" in name:
+                folder, file_name = name.split("/", 1)
+                footprints.setdefault(folder[: -len(".pretty")], set()).add(
+                    file_name[: -len(".kicad_mod")]
+                )
+            else:
+                libraries.add(os.path.splitext(name)[0])
+        libraries.update(footprints)
+
+        for name, facts in self.facts.items():
+            if "error" in facts:
+                problems.append(Problem("unreadable", name, "", facts["error"]))
+                continue
+
+            seen = set()
+            for symbol, footprint in facts.get("symbols", ()):
+                if symbol in seen:
+                    problems.append(Problem("duplicate symbol", name, symbol, ""))
+                seen.add(symbol)
+                if not footprint or ":" not in footprint:
+                    continue
+                library, footprint_name = footprint.split(":", 1)
+                if library in libraries and footprint_name not in footprints.get(
+                    library, ()
+                ):
+                    problems.append(
+                        Problem("dangling footprint", name, symbol, footprint)
+                    )
+
+            if "entries" in facts:
+                # the import writes <remote>.dcm for .lib and .kicad_sym symbols
+                symbols = set()
+                for suffix in (".lib", ".kicad_sym"):
+                    lib_facts = self.facts.get(name[: -len(".dcm")] + suffix) or {}
+                    symbols.update(symbol for symbol, _ in lib_facts.get("symbols", ()))
+                for entry in facts["entries"]:
+                    if entry not in symbols:
+                        problems.append(Problem("orphaned dcm entry", name, entry, ""))
+
+            for model in facts.get("models", ()):
+                if not model:
+                    continue
+                path = self.resolve_model(model)
+                if path is not None and not self.exists(path):
+                    problems.append(Problem("missing model", name, model, str(path)))
+        return problems
+
+    def run(self) -> List[Problem]:
+        self.scan()
+        return self.check()
+
+
+if __name__ == "__main__":
+    import sys
+
+    check = LibraryCheck(sys.argv[1] if len(sys.argv) > 1 else ".", jobs=os.cpu_count() or 1)
+    for problem in check.run():
+        print(problem)
+    print(f"{check.scanned} files parsed, {check.cached} from the cache")
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Union
+
+# Content-addressed copy of all 3D models, the .3dshapes folders only
+# contain hard links to the blobs, e.g. <DEST_PATH>/.model_store/3f/3fa4...
+STORE_DIR = ".model_store"
+INDEX_NAME = "index.json"
+INDEX_VERSION = 1
+COPY_BUFSIZE = 1024 * 1024
+
+
+def _key(size: int, crc: int) -> str:
+    return f"{size}:{crc}"
+
+
+def member_sha256(zf: zipfile.ZipFile, member: str) -> str:
+    digest = hashlib.sha256()
+    with zf.open(member) as src:
+        for chunk in iter(lambda: src.read(COPY_BUFSIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """
+    Deduplicating store for the 3D models.
+
+    Every model is stored once under its sha256. A known model is found by
+    the (size, CRC-32) of the zip directory and verified by the sha256, so
+    importing it again is a hash lookup and a hard link instead of a copy.
+    """
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.index_path = self.root / INDEX_NAME
+        self.blobs: Dict[str, list] = {}  # sha256: [size, crc]
+        self.by_key: Dict[str, List[str]] = {}  # "size:crc": [sha256, ...]
+        self.modified = False
+        self.load()
+
+    def load(self):
+        self.blobs = {}
+        try:
+            index = json.loads(self.index_path.read_text(encoding="utf-8"))
+            if index["version"] == INDEX_VERSION:
+                self.blobs = index["blobs"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self.by_key = {}
+        for digest, (size, crc) in list(self.blobs.items()):
+            if not self.blob_path(digest).is_file():  # removed by hand
+                del self.blobs[digest]
+                continue
+            self.by_key.setdefault(_key(size, crc), []).append(digest)
+
+    def save(self):
+        if not self.modified:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        index = {"version": INDEX_VERSION, "blobs": self.blobs}
+        tmp_path = self.index_path.with_name(INDEX_NAME + "~")
+        tmp_path.write_text(json.dumps(index), encoding="utf-8")
+        tmp_path.replace(self.index_path)
+        self.modified = False
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def __len__(self):
+        return len(self.blobs)
+
+    def find(self, zf: zipfile.ZipFile, member: str) -> Union[str, None]:
+        """:return: sha256 of the stored copy of a zip member or None"""
+        info = zf.getinfo(member)
+        candidates = self.by_key.get(_key(info.file_size, info.CRC))
+        if not candidates:
+            return None
+        digest = member_sha256(zf, member)
+        return digest if digest in candidates else None
+
+    def add(self, zf: zipfile.ZipFile, member: str) -> str:
+        """
+        Streams a zip member into the store.
+        :return: sha256 of the blob
+        """
+        info = zf.getinfo(member)
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / (f"{os.getpid()}.tmp")
+        digest = hashlib.sha256()
+        try:
+            with zf.open(member) as src, open(tmp_path, "wb") as dst:
+                for chunk in iter(lambda: src.read(COPY_BUFSIZE), b""):
+                    digest.update(chunk)
+                    dst.write(chunk)
+            digest = digest.hexdigest()
+            blob_path = self.blob_path(digest)
+            if blob_path.is_file():
+                tmp_path.unlink()
+            else:
+                blob_path.parent.mkdir(exist_ok=True)
+                tmp_path.replace(blob_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        if digest not in self.blobs:
+            self.blobs[digest] = [info.file_size, info.CRC]
+            self.by_key.setdefault(_key(info.file_size, info.CRC), []).append(digest)
+            self.modified = True
+        return digest
+
+    def link(self, digest: str, path: Path, journal=None):
+        """
+        Places the blob at path as hard link, falls back to a copy if the
+        file system does not support hard links.
+        :param journal: ImportJournal, the rename is done by its commit()
+        """
+        blob_path = self.blob_path(digest)
+        try:
+            if path.samefile(blob_path):
+                return
+        except OSError:
+            pass
+        if journal is not None:
+            tmp_path = journal.reserve(path)
+        else:
+            tmp_path = path.with_name(path.name + "~")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            shutil.copyfile(blob_path, tmp_path)
+        if journal is not None:
+            journal.replace(path)
+        else:
+            tmp_path.replace(path)
+
+    def extract(
+        self, zf: zipfile.ZipFile, member: str, path: Path, journal=None
+    ) -> bool:
+        """
+        Places a zip member at path, through the store.
+        :return: True if the model was new to the store
+        """
+        digest = self.find(zf, member)
+        new = digest is None
+        if new:
+            digest = self.add(zf, member)
+        self.link(digest, path, journal)
+        return new
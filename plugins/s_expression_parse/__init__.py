@@ -1,27 +1,89 @@
+import io
 import re
+from array import array
 from os.path import exists, expanduser
+from typing import List, Union
 
 
-term_regex = r"""(?mx)
+term_regex = r"""(?msx)
     \s*(?:
         (?P<brackl>\()|
         (?P<brackr>\))|
         (?P<num>\-?\d+\.\d+|\-?\d+)|
-        (?P<sq>"[^"]*")|
+        (?P<sq>"[^"\\]*(?:\\.[^"\\]*)*")|
         (?P<s>[^(^)\s]+)
        )"""
 
 
-# taken from https://rosettacode.org/wiki/S-Expressions#Python
-def parse_sexp(sexp, dbg=False):
+_term_pattern = re.compile(term_regex)
+
+# Same token classes as term_regex, but as a single capture group so that
+# re.findall hands back plain strings; the term type is recovered from the
+# first character of the token instead of from groupdict().
+_token_pattern = re.compile(
+    r'''\s*([()]|-?\d+\.\d+|-?\d+|"[^"\\]*(?:\\.[^"\\]*)*"|[^(^)\s]+)''', re.S
+)
+
+_digits = frozenset("0123456789")
+
+# escapes in quoted strings as written by KiCad, e.g. "C:\\libs" or "6\" rack"
+_escape_pattern = re.compile(r"\\(.)", re.S)
+_unescaped = {"n": "\n", "r": "\r", "t": "\t"}
+_escaped = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_escape_chars = re.compile(r'[\\"\n\r\t]')
+
+
+def _unescape(match):
+    char = match.group(1)
+    return _unescaped.get(char, char)
+
+
+def _atom_value(token):
+    """Convert a single non-bracket token into its parsed value"""
+    c = token[0]
+    if c == '"':
+        if len(token) > 1 and token[-1] == '"':
+            if "\\" in token:
+                return _escape_pattern.sub(_unescape, token[1:-1])
+            return token[1:-1]
+        return token  # unterminated quote, matched by the "s" term
+    if c in _digits or (c == "-" and len(token) > 1 and token[1] in _digits):
+        if "." in token:
+            v = float(token)
+            if v.is_integer():
+                v = int(v)
+            return v
+        return int(token)
+    return token
+
+
+def atom_value(token):
+    """
+    :param token: single atom as str or bytes, e.g. found with a regex
+    :return: value as in parse_sexp(), e.g. 6" rack of "6\\" rack"
+    """
+    if not isinstance(token, str):
+        token = bytes(token).decode("utf-8")
+    return _atom_value(token)
+
+
+def tokenize_sexp(sexp):
+    """
+    Yields (term, value) tuples with the term names of term_regex
+    (brackl, brackr, num, sq, s). Mainly useful for debugging.
+    """
+    for match in _term_pattern.finditer(sexp):
+        term = match.lastgroup
+        yield term, match.group(term)
+
+
+def _parse_sexp_dbg(sexp):
+    # taken from https://rosettacode.org/wiki/S-Expressions#Python
     stack = []
     out = []
-    if dbg:
-        print("%-6s %-14s %-44s %-s" % tuple("term value out stack".split()))
-    for termtypes in re.finditer(term_regex, sexp):
-        term, value = [(t, v) for t, v in termtypes.groupdict().items() if v][0]
-        if dbg:
-            print("%-7s %-14s %-44r %-r" % (term, value, out, stack))
+    print("%-6s %-14s %-44s %-s" % tuple("term value out stack".split()))
+    for term, value in tokenize_sexp(sexp):
+        print("%-7s %-14s %-44r %-r" % (term, value, out, stack))
         if term == "brackl":
             stack.append(out)
             out = []
@@ -29,30 +91,1099 @@ def parse_sexp(sexp, dbg=False):
             assert stack, "Trouble with nesting of brackets"
             tmpout, out = out, stack.pop(-1)
             out.append(tmpout)
-        elif term == "num":
-            v = float(value)
-            if v.is_integer():
-                v = int(v)
-            out.append(v)
-        elif term == "sq":
-            out.append(value[1:-1])
-        elif term == "s":
-            out.append(value)
         else:
-            raise NotImplementedError("Error: %r" % (term, value))
+            out.append(_atom_value(value))
     assert not stack, "Trouble with nesting of brackets"
     return out[0]
 
 
+def parse_sexp(sexp, dbg=False, compact=False):
+    """
+    Parses a s-expression string into nested lists of str, int and float.
+
+    Single pass over re.findall tokens. Atom values are memoized per call,
+    so repeated coordinates and keywords are converted only once and share
+    one object in the resulting tree.
+    :param compact: return a CompactSexp instead of nested lists
+    """
+    if dbg:
+        return _parse_sexp_dbg(sexp)
+    if compact:
+        return CompactSexp.parse(sexp)
+
+    stack = []
+    out = []
+    push = stack.append
+    pop = stack.pop
+    atoms = {}
+    atoms_get = atoms.get
+    for token in _token_pattern.findall(sexp):
+        if token == "(":
+            push(out)
+            out = []
+        elif token == ")":
+            assert stack, "Trouble with nesting of brackets"
+            tmpout = out
+            out = pop()
+            out.append(tmpout)
+        else:
+            v = atoms_get(token)
+            if v is None:
+                v = atoms[token] = _atom_value(token)
+            out.append(v)
+    assert not stack, "Trouble with nesting of brackets"
+    return out[0]
+
+
+def iter_sexp(sexp, depth=0):
+    """
+    Incremental variant of parse_sexp. Yields every list at the given nesting
+    depth as soon as its closing bracket has been read.
+
+    depth=0 yields the top-level forms, depth=1 the entries of a library
+    (e.g. every "(symbol ...)" of a .kicad_sym or "(lib ...)" of a
+    sym-lib-table). Yielded lists are not attached to their parents, so the
+    complete tree is never held in memory. Atoms at the given depth are skipped.
+
+    :param sexp: s-expression string
+    :param depth: nesting depth of the lists to be yielded
+    """
+    stack = []
+    out = []
+    atoms = {}
+    for match in _token_pattern.finditer(sexp):
+        token = match.group(1)
+        if token == "(":
+            stack.append(out)
+            out = []
+        elif token == ")":
+            assert stack, "Trouble with nesting of brackets"
+            tmpout = out
+            out = stack.pop()
+            level = len(stack)
+            if level == depth:
+                yield tmpout
+            elif level > depth:
+                out.append(tmpout)
+            if level <= depth:
+                atoms.clear()  # keep the memo from outliving the yielded form
+        elif len(stack) > depth:
+            v = atoms.get(token)
+            if v is None:
+                v = atoms[token] = _atom_value(token)
+            out.append(v)
+    assert not stack, "Trouble with nesting of brackets"
+
+
+# everything up to the next bracket outside of a quoted string, quoted
+# strings as in _token_pattern
+_bracket_patterns = {
+    str: re.compile(r'[^()"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^()"]*)*[()]', re.S),
+    bytes: re.compile(rb'[^()"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^()"]*)*[()]', re.S),
+}
+# name and first atom of a list, e.g. symbol and "R1" of (symbol "R1" ...)
+_head_patterns = {
+    str: re.compile(
+        r'\(\s*("[^"\\]*(?:\\.[^"\\]*)*"|[^\s()"]+)(?:\s*("[^"\\]*(?:\\.[^"\\]*)*"|[^\s()"]+))?',
+        re.S,
+    ),
+    bytes: re.compile(
+        rb'\(\s*("[^"\\]*(?:\\.[^"\\]*)*"|[^\s()"]+)(?:\s*("[^"\\]*(?:\\.[^"\\]*)*"|[^\s()"]+))?',
+        re.S,
+    ),
+}
+_bytes_token_pattern = re.compile(
+    rb'''\s*([()]|-?\d+\.\d+|-?\d+|"[^"\\]*(?:\\.[^"\\]*)*"|[^(^)\s]+)''', re.S
+)
+
+
+def _text_kind(text):
+    return str if isinstance(text, str) else bytes
+
+
+def _scan_lists(text, start: int, end: int):
+    """
+    Finds the lists directly inside text[start:end] and the lists inside
+    them, deeper brackets are only counted.
+    :return: [(start, end, [(start, end), ...]), ...], end is -1 if the
+        closing bracket is missing
+    """
+    kind = _text_kind(text)
+    open_bracket = ord("(") if kind is bytes else "("
+    lists = []
+    children = []
+    depth = 0
+    list_start = child_start = 0
+    for match in _bracket_patterns[kind].finditer(text, start, end):
+        position = match.end() - 1
+        if text[position] == open_bracket:
+            depth += 1
+            if depth == 1:
+                list_start = position
+                children = []
+            elif depth == 2:
+                child_start = position
+        elif depth:
+            if depth == 1:
+                lists.append((list_start, position + 1, children))
+            elif depth == 2:
+                children.append((child_start, position + 1))
+            depth -= 1
+    if depth:  # unbalanced text, the open lists end with the text
+        if depth >= 2:
+            children.append((child_start, -1))
+        lists.append((list_start, -1, children))
+    return lists
+
+
+class LazyNode:
+    """
+    List of a s-expression that is parsed on demand.
+
+    LazyNode.parse() only finds the brackets of the top-level list and of
+    its children, the lists further down are found when their parent is
+    accessed. Atoms and values are built when they are accessed and source
+    is the exact text of the node, e.g. to copy a symbol out of a library
+    without printing it again.
+
+    root = LazyNode.parse(text)
+    symbol = root.find("symbol")
+    symbol.key, symbol.source
+    """
+
+    __slots__ = ("text", "start", "_end", "_spans", "_children")
+
+    def __init__(self, text, start: int, end: int, spans=None):
+        self.text = text
+        self.start = start
+        self._end = end
+        self._spans = spans  # (start, end) of the children if already known
+        self._children = None
+
+    @classmethod
+    def parse(cls, text):
+        """
+        :param text: s-expression as str or bytes
+        :return: node of the first top-level list or None if there is none
+        """
+        for start, end, spans in _scan_lists(text, 0, len(text)):
+            return cls(text, start, end, spans)
+        return None
+
+    @property
+    def end(self) -> Union[int, None]:
+        """offset behind the closing bracket, None if it is missing"""
+        return None if self._end < 0 else self._end
+
+    @property
+    def source(self):
+        """exact text of the node, same type as the parsed text"""
+        return self.text[self.start : self.end]
+
+    def _head(self):
+        match = _head_patterns[_text_kind(self.text)].match(self.text, self.start)
+        return match.groups() if match else (None, None)
+
+    @property
+    def name(self) -> Union[str, None]:
+        """first atom of the node, e.g. "symbol" """
+        token = self._head()[0]
+        return None if token is None else self._value(token)
+
+    @property
+    def key(self):
+        """
+        atom behind the name, e.g. the name of (symbol "R1" ...) or "Footprint"
+        of (property "Footprint" ...), None if a list follows the name
+        """
+        token = self._head()[1]
+        return None if token is None else self._value(token)
+
+    def _value(self, token):
+        return atom_value(token)
+
+    def _inner_end(self) -> int:
+        return len(self.text) if self._end < 0 else self._end - 1
+
+    @property
+    def children(self) -> List["LazyNode"]:
+        """child lists, built on the first access"""
+        if self._children is None:
+            if self._spans is not None:
+                self._children = [
+                    LazyNode(self.text, start, end) for start, end in self._spans
+                ]
+            else:
+                self._children = [
+                    LazyNode(self.text, start, end, spans)
+                    for start, end, spans in _scan_lists(
+                        self.text, self.start + 1, self._inner_end()
+                    )
+                ]
+            self._spans = None
+        return self._children
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def find(self, name: str) -> Union["LazyNode", None]:
+        """:return: first child list with the given name"""
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+
+    def find_all(self, name: str) -> List["LazyNode"]:
+        """:return: all child lists with the given name"""
+        return [child for child in self.children if child.name == name]
+
+    def iter(self, name: Union[str, None] = None):
+        """Yields all nested lists in document order, optionally only the named ones"""
+        for child in self.children:
+            if name is None or child.name == name:
+                yield child
+            yield from child.iter(name)
+
+    def items(self) -> list:
+        """values of this node in order: atoms parsed, child lists as LazyNode"""
+        kind = _text_kind(self.text)
+        pattern = _token_pattern if kind is str else _bytes_token_pattern
+        out = []
+        position = self.start + 1
+        for child in self.children:
+            gap = self.text[position : child.start]
+            out.extend(self._value(token) for token in pattern.findall(gap))
+            out.append(child)
+            if child._end < 0:
+                return out
+            position = child._end
+        gap = self.text[position : self._inner_end()]
+        out.extend(self._value(token) for token in pattern.findall(gap))
+        return out
+
+    def atom_spans(self) -> list:
+        """
+        (start, end) of the atoms of this node in text, the name included,
+        e.g. to replace a single value with SexpPatch
+        """
+        kind = _text_kind(self.text)
+        pattern = _token_pattern if kind is str else _bytes_token_pattern
+        spans = []
+        position = self.start + 1
+        for child in self.children + [None]:
+            end = self._inner_end() if child is None else child.start
+            spans.extend(
+                match.span(1) for match in pattern.finditer(self.text, position, end)
+            )
+            if child is None or child._end < 0:
+                break
+            position = child._end
+        return spans
+
+    def atoms(self) -> list:
+        """atoms of this node without the name, e.g. ["R1", 0] of (name "R1" 0)"""
+        return [item for item in self.items() if not isinstance(item, LazyNode)][1:]
+
+    def to_list(self) -> list:
+        """:return: node as nested lists, same as parse_sexp(node.source)"""
+        source = self.source
+        if not isinstance(source, str):
+            source = bytes(source).decode("utf-8")
+        return parse_sexp(source)
+
+    def __repr__(self):
+        return f"LazyNode({self.name!r}, {self.start}:{self.end})"
+
+
+# one step of a query: name and optional predicate, e.g. lib[name=Samacsys]
+_step_pattern = re.compile(r'([^/\[\]]+)(?:\[([^\]=]+)(?:=("[^"]*"|[^\]]*))?\])?(?=/|$)')
+_query_cache = {}
+
+
+class _Stop(Exception):
+    pass
+
+
+def _node_name(node):
+    if isinstance(node, LazyNode):
+        return node.name
+    return node[0] if node and isinstance(node[0], str) else None
+
+
+def _node_children(node):
+    if isinstance(node, LazyNode):
+        return node.children
+    return [item for item in node if type(item) is list]
+
+
+def _node_key(node):
+    if isinstance(node, LazyNode):
+        return node.key
+    if len(node) > 1 and type(node[1]) is not list:
+        return node[1]
+    return None
+
+
+def node_values(node) -> list:
+    """:return: atoms of a list without its name, e.g. ["R1", 0] of (name "R1" 0)"""
+    if isinstance(node, LazyNode):
+        return node.atoms()
+    return [item for item in node[1:] if type(item) is not list]
+
+
+def node_dict(node) -> dict:
+    """:return: {name: value} of the children with one value, e.g. of (lib (name "x")(uri "y"))"""
+    out = {}
+    for child in _node_children(node):
+        values = node_values(child)
+        if len(values) == 1:
+            out[_node_name(child)] = values[0]
+    return out
+
+
+class Query:
+    """
+    Compiled path query over s-expression trees (nested lists or LazyNode).
+
+    Steps are separated by "/", "//" also matches deeper lists. A step is a
+    name or "*" with an optional predicate:
+    symbol/property[Footprint]   properties of the symbols with the key Footprint
+    lib[name=Samacsys]/uri       (uri ...) of the library Samacsys
+    //pin                        all pins at any depth
+    The steps start at the children of the tree the query is evaluated on.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.steps = []  # (descendant, name or "*", key, value)
+        position = 0
+        while position < len(path):
+            descendant = path.startswith("//", position)
+            if descendant:
+                position += 2
+            elif path.startswith("/", position):
+                position += 1
+            match = _step_pattern.match(path, position)
+            if match is None:
+                raise ValueError(f"Invalid query '{path}' at {position}")
+            name, key, value = match.groups()
+            if value is not None and value.startswith('"'):
+                value = value[1:-1]
+            self.steps.append((descendant, name, key, value))
+            position = match.end()
+        if not self.steps:
+            raise ValueError(f"Empty query '{path}'")
+
+    def __repr__(self):
+        return f"Query({self.path!r})"
+
+    def match(self, step: int, node) -> bool:
+        _, name, key, value = self.steps[step]
+        if name != "*" and _node_name(node) != name:
+            return False
+        if key is None:
+            return True
+        if value is None:  # [Footprint]: first atom of the list
+            return str(_node_key(node)) == key
+        # [name=value]: child list (name value)
+        for child in _node_children(node):
+            if _node_name(child) == key and str(_node_key(child)) == value:
+                return True
+        return False
+
+
+def compile_query(path: Union[str, Query]) -> Query:
+    """:return: compiled query, every path is compiled only once"""
+    if isinstance(path, Query):
+        return path
+    query = _query_cache.get(path)
+    if query is None:
+        query = _query_cache[path] = Query(path)
+    return query
+
+
+def select(tree, *paths, first=False) -> List[list]:
+    """
+    Evaluates several queries in one depth-first traversal, lists that no
+    query can match anymore are not visited.
+
+    :param tree: nested lists of parse_sexp() or LazyNode
+    :param paths: queries as str or Query
+    :param first: stop each query at its first match, the traversal ends
+        as soon as every query has a match
+    :return: list of the matching lists for every query, in document order
+    """
+    queries = [compile_query(path) for path in paths]
+    results = [[] for _ in queries]
+    pending = [len(queries)]
+
+    def visit(node, states):
+        for child in _node_children(node):
+            next_states = {}
+            for index, step in states:
+                if first and results[index]:
+                    continue
+                query = queries[index]
+                if query.steps[step][0]:  # descendant step, also try deeper
+                    next_states[(index, step)] = None
+                if not query.match(step, child):
+                    continue
+                if step + 1 < len(query.steps):
+                    next_states[(index, step + 1)] = None
+                elif not results[index] or results[index][-1] is not child:
+                    results[index].append(child)
+                    if first:
+                        pending[0] -= 1
+                        if not pending[0]:
+                            raise _Stop
+            if next_states:
+                visit(child, list(next_states))
+
+    if queries and tree is not None:
+        try:
+            visit(tree, [(index, 0) for index in range(len(queries))])
+        except _Stop:
+            pass
+    return results
+
+
+def select_one(tree, path: Union[str, Query]):
+    """:return: first list matching path or None"""
+    (result,) = select(tree, path, first=True)
+    return result[0] if result else None
+
+
+def select_value(tree, path: Union[str, Query], index: int = 0, default=None):
+    """
+    :return: atom of the first list matching path, index 0 is the atom
+        behind the name, e.g. select_value(table, "lib[name=x]/uri")
+    """
+    node = select_one(tree, path)
+    if node is None:
+        return default
+    values = node_values(node)
+    return values[index] if len(values) > index else default
+
+
+def _chunked_tokens(sexp: str, size: int = 1 << 20):
+    """
+    Yields the tokens of _token_pattern.findall() for pieces of about size
+    characters, so that a large library never exists as one token list. The
+    pieces end at a newline outside of quoted strings.
+    """
+    start = 0
+    length = len(sexp)
+    while start < length:
+        end = sexp.find("\n", start + size)
+        while end >= 0 and sexp.count('"', start, end) % 2:
+            end = sexp.find("\n", end + 1)
+        end = length if end < 0 else end + 1
+        yield from _token_pattern.findall(sexp, start, end)
+        start = end
+
+
+class CompactSexp:
+    """
+    Memory-saving form of a parsed s-expression for large libraries.
+
+    Every node is one entry of flat arrays: its kind, a value index and the
+    parent, first child and next sibling as node indexes (-1 for none).
+    Strings and symbols are interned in atoms, numbers are stored once in
+    an array("d"). Node 0 is the first top-level list, like parse_sexp().
+
+    tree = parse_sexp(text, compact=True)
+    tree.to_list() == parse_sexp(text), print_sexp(tree)
+    """
+
+    LIST, SYMBOL, STRING, INT, FLOAT = range(5)
+
+    def __init__(self):
+        self.kinds = array("b")
+        self.values = array("i")  # index in atoms or numbers, -1 for lists
+        self.parent = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.atoms: List[str] = []
+        self.numbers = array("d")
+
+    @classmethod
+    def parse(cls, sexp: str) -> "CompactSexp":
+        tree = cls()
+        kinds = tree.kinds.append
+        values = tree.values.append
+        parents = tree.parent.append
+        first_children = tree.first_child.append
+        next_siblings = tree.next_sibling.append
+        first_child = tree.first_child
+        next_sibling = tree.next_sibling
+        atoms = tree.atoms
+        numbers = tree.numbers
+        interned = {}  # token: (kind, value index)
+        atom_index = {}  # string: index in atoms
+        stack = []
+        parent = previous = -1
+        index = 0
+        for token in _chunked_tokens(sexp):
+            if token == ")":
+                assert stack, "Trouble with nesting of brackets"
+                parent, previous = stack.pop()
+                continue
+            parents(parent)
+            first_children(-1)
+            next_siblings(-1)
+            if previous >= 0:
+                next_sibling[previous] = index
+            elif parent >= 0:
+                first_child[parent] = index
+
+            if token == "(":
+                kinds(cls.LIST)
+                values(-1)
+                stack.append((parent, index))
+                parent, previous = index, -1
+            else:
+                atom = interned.get(token)
+                if atom is None:
+                    value = _atom_value(token)
+                    if isinstance(value, str):
+                        kind = cls.SYMBOL if value is token else cls.STRING
+                        position = atom_index.get(value)
+                        if position is None:
+                            position = atom_index[value] = len(atoms)
+                            atoms.append(value)
+                        atom = interned[token] = (kind, position)
+                    else:
+                        kind = cls.INT if isinstance(value, int) else cls.FLOAT
+                        numbers.append(value)
+                        atom = interned[token] = (kind, len(numbers) - 1)
+                kinds(atom[0])
+                values(atom[1])
+                previous = index
+            index += 1
+        assert not stack, "Trouble with nesting of brackets"
+        assert index, "No s-expression found"
+        return tree
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def value(self, node: int):
+        """:return: atom of a node as in parse_sexp(), None for lists"""
+        kind = self.kinds[node]
+        if kind == self.LIST:
+            return None
+        if kind == self.INT:
+            return int(self.numbers[self.values[node]])
+        if kind == self.FLOAT:
+            return self.numbers[self.values[node]]
+        return self.atoms[self.values[node]]
+
+    def children(self, node: int = 0):
+        """Yields the node indexes of all entries of a list"""
+        child = self.first_child[node]
+        next_sibling = self.next_sibling
+        while child >= 0:
+            yield child
+            child = next_sibling[child]
+
+    def name(self, node: int = 0):
+        """:return: first atom of a list, e.g. "symbol" """
+        child = self.first_child[node]
+        if child < 0 or self.kinds[child] == self.LIST:
+            return None
+        return self.value(child)
+
+    def to_list(self, node: int = 0) -> list:
+        """:return: the node as nested lists, same as parse_sexp()"""
+        if self.kinds[node] != self.LIST:
+            return self.value(node)
+        out = []
+        stack = []
+        child = self.first_child[node]
+        kinds = self.kinds
+        while True:
+            while child < 0:
+                if not stack:
+                    return out
+                done = out
+                out, child = stack.pop()
+                out.append(done)
+            if kinds[child] == self.LIST:
+                stack.append((out, self.next_sibling[child]))
+                out = []
+                child = self.first_child[child]
+            else:
+                out.append(self.value(child))
+                child = self.next_sibling[child]
+
+    def _texts(self) -> list:
+        """:return: text of every atom by kind and value index"""
+        return [
+            None,
+            self.atoms,
+            [quote_atom(atom) for atom in self.atoms],
+            [str(int(number)) for number in self.numbers],
+            [format_atom(number) for number in self.numbers],
+        ]
+
+    def tokens(self, node: int = 0):
+        """Yields the texts of the brackets and atoms of a node, e.g. for SexpWriter"""
+        texts = self._texts()
+        kinds = self.kinds
+        values = self.values
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        LIST = self.LIST
+        if kinds[node] != LIST:
+            yield texts[kinds[node]][values[node]]
+            return
+
+        yield "("
+        stack = []
+        child = first_child[node]
+        while True:
+            while child < 0:
+                yield ")"
+                if not stack:
+                    return
+                child = stack.pop()
+            kind = kinds[child]
+            if kind == LIST:
+                yield "("
+                stack.append(next_sibling[child])
+                child = first_child[child]
+            else:
+                yield texts[kind][values[child]]
+                child = next_sibling[child]
+
+    def to_text(self, node: int = 0) -> str:
+        """:return: single-line text of a node, strings quoted as in the source"""
+        texts = self._texts()
+        kinds = self.kinds
+        values = self.values
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        LIST = self.LIST
+        if kinds[node] != LIST:
+            return texts[kinds[node]][values[node]]
+
+        parts = ["("]
+        out = parts.append
+        stack = []
+        child = first_child[node]
+        separator = ""
+        while True:
+            while child < 0:
+                out(")")
+                if not stack:
+                    return "".join(parts)
+                child = stack.pop()
+                separator = " "
+            kind = kinds[child]
+            if kind == LIST:
+                out(separator + "(")
+                stack.append(next_sibling[child])
+                child = first_child[child]
+                separator = ""
+            else:
+                out(separator + texts[kind][values[child]])
+                child = next_sibling[child]
+                separator = " "
+
+
+_needs_quotes = re.compile(r"[\s()]").search
+
+
 def print_sexp(exp):
-    out = ""
-    if type(exp) == type([]):
-        out += "(" + " ".join(print_sexp(x) for x in exp) + ")"
-    elif type(exp) == type("") and re.search(r"[\s()]", exp):
-        out += '"%s"' % repr(exp)[1:-1].replace('"', '"')
+    """
+    :param exp: nested lists of parse_sexp() or CompactSexp
+    :return: single-line s-expression
+    """
+    if isinstance(exp, CompactSexp):
+        return exp.to_text()
+    parts = []
+    _print_parts(exp, parts.append)
+    return "".join(parts)
+
+
+def _print_parts(exp, out):
+    if type(exp) is list:
+        out("(")
+        first = True
+        for item in exp:
+            if not first:
+                out(" ")
+            first = False
+            _print_parts(item, out)
+        out(")")
+    elif type(exp) is str and _needs_quotes(exp):
+        out('"%s"' % repr(exp)[1:-1])
     else:
-        out += "%s" % exp
-    return out
+        out("%s" % exp)
+
+
+# strings that can be written without quotes, except numbers
+_bare_pattern = re.compile(r'[^\s()"\\]+')
+_number_pattern = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _escape(match):
+    return _escaped[match.group()]
+
+
+class Quoted(str):
+    """String atom that is always written in double quotes, e.g. a name like "1" """
+
+
+def quote_atom(value: str) -> str:
+    """:return: value as quoted string with the escapes of KiCad, e.g. "6\\" rack" """
+    return '"' + _escape_chars.sub(_escape, value) + '"'
+
+
+def format_atom(value, quote: bool = False) -> str:
+    """
+    :param quote: quote strings even if they do not need it
+    :return: text of an atom that parse_sexp() reads back to the same value
+    """
+    if isinstance(value, Quoted):
+        return quote_atom(value)
+    if type(value) is str:
+        if (
+            quote
+            or not _bare_pattern.fullmatch(value)
+            or _number_pattern.fullmatch(value)
+        ):
+            return quote_atom(value)
+        return value
+    if type(value) is float:
+        text = repr(value)
+        if "e" in text:  # no exponent, e.g. 1e-05
+            text = ("%.10f" % value).rstrip("0")
+            if text.endswith("."):
+                text += "0"
+        return text
+    return str(value)
+
+
+class SexpWriter:
+    """
+    Streaming s-expression writer with the formatting of KiCad.
+
+    Lists without child lists are written in one line. In the other lists
+    every entry behind the leading atoms starts a new line, indented by one
+    indent (a tab) per level, and the closing bracket gets its own line:
+
+    (footprint "R_0603"
+        (layer "F.Cu")
+        (model "${KICAD_3RD_PARTY}/Samacsys.3dshapes/R_0603.step"
+            (offset
+                (xyz 0 0 0)
+            )
+        )
+    )
+
+    The text is collected in a list and passed to file.write() in blocks,
+    indent=None writes a tree in a single line. Trees are nested lists,
+    LazyNode (atoms are copied as in the source) or CompactSexp.
+    """
+
+    def __init__(
+        self,
+        file,
+        indent: Union[str, None] = "\t",
+        quote_strings: bool = False,
+        buffer_size: int = 4096,
+        xy_wrap: Union[int, None] = None,
+    ):
+        """
+        :param file: file-like object with write(str), e.g. io.StringIO
+        :param quote_strings: quote all strings of nested lists except the
+            names of the lists, e.g. for (lib (name "Samacsys"))
+        :param buffer_size: number of text parts collected before a write
+        :param xy_wrap: (xy ...) lists that follow each other share a line,
+            the next one starts a new line if the line would get longer than
+            xy_wrap characters (an indent counts as one), like the (pts ...)
+            of KiCad. None writes every (xy ...) in its own line.
+        """
+        self.file = file
+        self.indent = indent
+        self.quote_strings = quote_strings
+        self.xy_wrap = xy_wrap
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._texts = {}  # str atom: text, e.g. F.Cu: "F.Cu" with quote_strings
+
+    def write(self, exp, prefix: str = ""):
+        """
+        Writes a tree without a trailing newline.
+        :param prefix: indentation of the line the tree starts in
+        """
+        if type(exp) is list:
+            self._list(exp, prefix)
+        elif isinstance(exp, CompactSexp):
+            self._tokens(exp.tokens(), prefix)
+        elif isinstance(exp, LazyNode):
+            source = exp.source
+            if not isinstance(source, str):
+                source = bytes(source).decode("utf-8")
+            self._tokens(_chunked_tokens(source), prefix)
+        else:
+            self._parts.append(format_atom(exp))
+        if len(self._parts) >= self.buffer_size:
+            self.flush()
+
+    def write_text(self, text: str):
+        """Writes text unchanged, e.g. a newline between two trees"""
+        self._parts.append(text)
+
+    def flush(self):
+        if self._parts:
+            self.file.write("".join(self._parts))
+            self._parts.clear()  # the writers hold its append
+
+    def _atom_texts(self, node: list) -> list:
+        """:return: text of every atom of a list, None for the child lists"""
+        texts = self._texts
+        out = []
+        for item in node:
+            if type(item) is str:
+                text = texts.get(item)
+                if text is None:
+                    text = texts[item] = format_atom(item, self.quote_strings)
+                out.append(text)
+            elif type(item) is list:
+                out.append(None)
+            else:
+                out.append(format_atom(item))
+        if out and self.quote_strings and type(node[0]) is str:
+            out[0] = format_atom(node[0])  # names of lists are not quoted
+        return out
+
+    def _list(self, node: list, prefix: str):
+        """Nested lists without the (text, child) entries of the other trees"""
+        out = self._parts.append
+        texts = self._atom_texts(node)
+        if None not in texts:
+            out("(" + " ".join(texts) + ")")
+            return
+        if self.indent is None:
+            out("(")
+            for index, text in enumerate(texts):
+                if index:
+                    out(" ")
+                if text is None:
+                    self._list(node[index], prefix)
+                else:
+                    out(text)
+            out(")")
+            return
+
+        child_prefix = prefix + self.indent
+        line = "\n" + child_prefix
+        index = texts.index(None)
+        out("(" + " ".join(texts[:index]))
+        xy_column = None  # length of the line behind the last (xy ...)
+        for index in range(index, len(texts)):
+            text = texts[index]
+            if text is None and self.xy_wrap and node[index] and node[index][0] == "xy":
+                xy_texts = self._atom_texts(node[index])
+                if None not in xy_texts:
+                    text = "(" + " ".join(xy_texts) + ")"
+                    if xy_column is not None and xy_column + len(text) <= self.xy_wrap:
+                        out(" " + text)
+                        xy_column += 1 + len(text)
+                    else:
+                        out(line + text)
+                        xy_column = len(child_prefix) + len(text)
+                    continue
+            xy_column = None
+            out(line)
+            if text is None:
+                self._list(node[index], child_prefix)
+            else:
+                out(text)
+        out("\n" + prefix + ")")
+        if len(self._parts) >= self.buffer_size:
+            self.flush()
+
+    def _tokens(self, tokens, prefix: str):
+        """
+        Formats a stream of token texts in one pass. The atoms of a list are
+        held back until its first child list or its closing bracket shows
+        whether it fits in one line.
+        """
+        parts = self._parts
+        out = parts.append
+        indent = self.indent
+        buffer_size = self.buffer_size
+        if indent is None:
+            separator = ""
+            for token in tokens:
+                if token == ")":
+                    out(")")
+                    separator = " "
+                else:
+                    out(separator + token)
+                    separator = "" if token == "(" else " "
+            return
+
+        xy_wrap = self.xy_wrap
+        prefixes = []  # indentation of the open lists
+        pending = None  # atoms of the innermost list while it fits in one line
+        line = ""  # line break in front of the innermost list, written with it
+        xy_column = None  # length of the line behind the last (xy ...)
+        for token in tokens:
+            if token == "(":
+                if prefixes:
+                    if pending is not None:  # the parent gets a line per entry
+                        out(line + "(" + " ".join(pending))
+                        xy_column = None
+                    child_prefix = prefixes[-1] + indent
+                    line = "\n" + child_prefix
+                else:
+                    child_prefix = prefix
+                    line = ""
+                prefixes.append(child_prefix)
+                pending = []
+            elif token == ")":
+                if pending is not None:
+                    text = "(" + " ".join(pending) + ")"
+                    if not (xy_wrap and line and pending and pending[0] == "xy"):
+                        out(line + text)
+                        xy_column = None
+                    elif xy_column is not None and xy_column + len(text) <= xy_wrap:
+                        out(" " + text)
+                        xy_column += 1 + len(text)
+                    else:
+                        out(line + text)
+                        xy_column = len(prefixes[-1]) + len(text)
+                    pending = None
+                else:
+                    out("\n" + prefixes[-1] + ")")
+                    xy_column = None
+                prefixes.pop()
+                if len(parts) >= buffer_size:
+                    self.flush()
+            elif pending is not None:
+                pending.append(token)
+            else:
+                out("\n" + prefixes[-1] + indent + token)
+                xy_column = None
+
+
+def write_sexp(
+    exp, file, indent: Union[str, None] = "\t", prefix: str = "", quote_strings=False, xy_wrap=None
+):
+    """Writes a tree with SexpWriter to a file-like object"""
+    writer = SexpWriter(file, indent, quote_strings, xy_wrap=xy_wrap)
+    writer.write(exp, prefix)
+    writer.flush()
+
+
+def format_sexp(
+    exp, indent: Union[str, None] = "\t", prefix: str = "", quote_strings=False, xy_wrap=None
+) -> str:
+    """:return: text of a tree with the formatting of KiCad, see SexpWriter"""
+    file = io.StringIO()
+    write_sexp(exp, file, indent, prefix, quote_strings, xy_wrap)
+    return file.getvalue()
+
+
+class SexpPatch:
+    """
+    Changes single nodes of a s-expression text, everything else is copied
+    unchanged, so the formatting of the file is kept.
+
+    root = LazyNode.parse(text)
+    patch = SexpPatch(text)
+    patch.replace_atom(select_one(root, "property[Footprint]"), 2, "Samacsys:R_0603")
+    patch.append(root, ["model", "R_0603.step"])
+    patch.text_of()
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.changes = []  # (start, end, new text)
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    def replace(self, start: int, end: int, new_text: str):
+        """Replaces text[start:end], start == end inserts new_text"""
+        self.changes.append((start, end, new_text))
+
+    def replace_atom(self, node: LazyNode, index: int, value, quote: bool = True):
+        """
+        Replaces one atom of a node, index 0 is the name of the node.
+        :param quote: quote strings, as KiCad does for all values
+        """
+        start, end = node.atom_spans()[index]
+        self.replace(start, end, format_atom(value, quote))
+
+    def replace_node(self, node: LazyNode, exp, quote_strings=False):
+        """Replaces a node with a tree, indented like the node"""
+        prefix = self._line_prefix(node.start)
+        indent = self._child_prefix(node)[len(prefix) :] or "\t"
+        self.replace(node.start, node.end, format_sexp(exp, indent, prefix, quote_strings))
+
+    def append(self, node: LazyNode, exp, quote_strings=False, inline=False):
+        """
+        Adds a tree as last entry of a node, in a new line like its children.
+        :param inline: write the tree in a single line, e.g. a (lib ...) entry
+        """
+        child_prefix = self._child_prefix(node)
+        indent = child_prefix[len(self._line_prefix(node.start)) :] or "\t"
+        # behind the last entry, the whitespace before the bracket is kept
+        position = node._inner_end()
+        while position > node.start + 1 and self.text[position - 1].isspace():
+            position -= 1
+        if inline:
+            indent = None
+        new_text = "\n" + child_prefix + format_sexp(exp, indent, child_prefix, quote_strings)
+        if "\n" not in self.text[position : node._inner_end()]:
+            new_text += "\n" + self._line_prefix(node.start)  # the bracket gets its own line
+        self.replace(position, position, new_text)
+
+    def _line_prefix(self, position: int) -> str:
+        """:return: indentation of the line that contains position"""
+        line_start = self.text.rfind("\n", 0, position) + 1
+        line = self.text[line_start:position]
+        return line[: len(line) - len(line.lstrip())]
+
+    def _child_prefix(self, node: LazyNode) -> str:
+        """:return: indentation of the child lists that start a line"""
+        prefix = self._line_prefix(node.start)
+        for child in reversed(node.children):
+            line_start = self.text.rfind("\n", 0, child.start) + 1
+            child_prefix = self.text[line_start : child.start]
+            if not child_prefix.strip() and len(child_prefix) > len(prefix):
+                return child_prefix
+        return prefix + "\t"
+
+    def write(self, file, start: int = 0, end: Union[int, None] = None):
+        """
+        Writes text[start:end] with the changes that lie inside of it, the
+        untouched parts are copied unchanged.
+        """
+        end = len(self.text) if end is None else end
+        position = start
+        for change_start, change_end, new_text in sorted(
+            self.changes, key=lambda change: change[0]
+        ):
+            if change_start < start or change_end > end:
+                continue
+            if change_start < position:
+                raise ValueError("Overlapping changes of a s-expression")
+            file.write(self.text[position:change_start])
+            file.write(new_text)
+            position = change_end
+        file.write(self.text[position:end])
+
+    def text_of(self, start: int = 0, end: Union[int, None] = None) -> str:
+        """:return: text[start:end] with the changes, e.g. the source of one node"""
+        file = io.StringIO()
+        self.write(file, start, end)
+        return file.getvalue()
 
 
 def readFile2var(path):
@@ -67,33 +1198,25 @@ def readFile2var(path):
 
 
 def convert_list_to_dicts(data):
+    """:return: node_dict() of every list in data that has single-value children"""
     dict_list = []
     for entry in data:
-        if not type(entry) == list:
-            continue
-        entry_dict = {}
-        for item in entry:
-            if type(item) == list and len(item) == 2:
-                key, value = item
-                entry_dict[key] = value
-        if len(entry_dict):
-            dict_list.append(entry_dict)
+        if type(entry) is list:
+            entry_dict = node_dict(entry)
+            if entry_dict:
+                dict_list.append(entry_dict)
     return dict_list
 
 
 def search_recursive(line: list, entry: str, all=False):
-    if type(line[0]) == str and line[0] == entry:
-        if all:
-            return line
-        else:
-            return line[1]
-
-    for e in line:
-        if type(e) == list:
-            res = search_recursive(line=e, entry=entry, all=all)
-            if not res == None:
-                return res
-    return None
+    """:return: first list named entry (all=True) or its first value, depth-first"""
+    if _node_name(line) == entry:
+        node = line
+    else:
+        node = select_one(line, "//" + entry)
+        if node is None:
+            return None
+    return node if all else node[1]
 
 
 def extract_properties(sexp_list: list):
@@ -103,19 +1226,13 @@ def extract_properties(sexp_list: list):
     :param sexp_list: The nested list
     :return: A dictionary with “property” keys and their values
     """
+    (nodes,) = select(sexp_list, "//property")
+    if _node_name(sexp_list) == "property":
+        nodes.insert(0, sexp_list)
     properties = {}
-
-    def traverse_list(lst):
-        """Recursive function to run through the list and extract 'property' entries."""
-        if isinstance(lst, list):
-            if len(lst) > 1 and lst[0] == "property":
-                key = lst[1]
-                value = lst[2] if len(lst) > 2 else None
-                properties[key] = value
-            for item in lst:
-                traverse_list(item)
-
-    traverse_list(sexp_list)
+    for node in nodes:
+        if len(node) > 1:
+            properties[node[1]] = node[2] if len(node) > 2 else None
     return properties
 
 
@@ -137,5 +1254,6 @@ if __name__ == "__main__":
 
     parsed = parse_sexp(sexp)
     # pprint(parsed)
-    parsed_dict = convert_list_to_dicts(parsed[0:10])
-    pprint(parsed_dict)
+    (libs,) = select(parsed, "lib")
+    pprint([node_dict(lib) for lib in libs[0:10]])
+    pprint(select_value(parsed, "lib[name=Samacsys]/uri"))
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+try:
+    from ..import_journal import ImportJournal
+    from ..s_expression_parse import LazyNode
+except ImportError:  # symbol_store is a top-level package
+    from import_journal import ImportJournal
+    from s_expression_parse import LazyNode
+
+# Sidecar index next to every library, e.g. Samacsys.kicad_sym.idx
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+_footprint_pattern = re.compile(rb'\(property\s+"Footprint"\s+"([^"]*)"')
+
+
+def scan_symbols(data: bytes) -> Tuple[List[Tuple[str, int, int]], Union[int, None]]:
+    """
+    Finds all top-level "(symbol ...)" blocks of a .kicad_sym file.
+
+    :param data: content of the library
+    :return: [(name, offset, length), ...], offset of the closing bracket of the library
+    """
+    root = LazyNode.parse(data)
+    if root is None:
+        return [], None
+    symbols = []
+    for node in root:
+        end = node.end
+        if end is not None and node.name == "symbol" and isinstance(node.key, str):
+            symbols.append((node.key, node.start, end - node.start))
+    tail = root.end - 1 if root.end is not None else None
+    return symbols, tail
+
+
+def symbol_info(block: bytes) -> Tuple[Union[str, None], str]:
+    """:return: footprint property and content hash of a symbol block"""
+    match = _footprint_pattern.search(block)
+    footprint = match.group(1).decode("utf-8") if match else None
+    return footprint, hashlib.sha1(block).hexdigest()
+
+
+class SymbolStore:
+    """
+    Indexed access to a .kicad_sym library.
+
+    The index (symbol name -> offset, length, footprint, hash) is stored next
+    to the library and rebuilt automatically if the size or mtime of the
+    library does not match anymore. New symbols are appended in place, only
+    replacing existing symbols rewrites the library.
+    """
+
+    def __init__(self, lib_path: Union[str, Path]):
+        self.lib_path = Path(lib_path)
+        self.index_path = self.lib_path.with_name(self.lib_path.name + INDEX_SUFFIX)
+        self.symbols: Dict[str, list] = {}
+        self.tail = None
+        self.header = None
+        self.pending: Dict[str, str] = {}
+        self.last_commit = None  # ("create", "append" or "rewrite", bytes written)
+        # index entries of the written symbols and new tail, applied once the
+        # journal is committed: ({name: entry}, tail, replaces all symbols)
+        self._staged = None
+        self._stat = None
+        self.load()
+
+    def _lib_stat(self):
+        try:
+            st = self.lib_path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def load(self):
+        """Loads the sidecar index or rebuilds it if it is outdated"""
+        self.symbols = {}
+        self.tail = None
+        self._stat = self._lib_stat()
+        if self._stat is None:
+            return
+
+        try:
+            index = json.loads(self.index_path.read_text(encoding="utf-8"))
+            if (
+                index["version"] == INDEX_VERSION
+                and index["size"] == self._stat[0]
+                and index["mtime_ns"] == self._stat[1]
+            ):
+                self.symbols = index["symbols"]
+                self.tail = index["tail"]
+                return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self.rebuild()
+
+    def refresh(self):
+        """Reloads the index if the library was changed behind our back"""
+        if self._lib_stat() != self._stat:
+            self.load()
+
+    def rebuild(self):
+        data = self.lib_path.read_bytes()
+        symbols, self.tail = scan_symbols(data)
+        self.symbols = {}
+        for name, offset, length in symbols:
+            footprint, digest = symbol_info(data[offset : offset + length])
+            self.symbols[name] = [offset, length, footprint, digest]
+        self.save_index()
+
+    def save_index(self):
+        self._stat = self._lib_stat()
+        if self._stat is None:
+            return
+        index = {
+            "version": INDEX_VERSION,
+            "size": self._stat[0],
+            "mtime_ns": self._stat[1],
+            "tail": self.tail,
+            "symbols": self.symbols,
+        }
+        tmp_path = self.index_path.with_name(self.index_path.name + "~")
+        tmp_path.write_text(json.dumps(index), encoding="utf-8")
+        tmp_path.replace(self.index_path)
+
+    def exists(self) -> bool:
+        return self._stat is not None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.symbols or name in self.pending
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def names(self) -> List[str]:
+        return list(self.symbols)
+
+    def footprint(self, name: str) -> Union[str, None]:
+        return self.symbols[name][2]
+
+    def read(self, name: str) -> str:
+        """:return: the "(symbol ...)" block of an existing symbol"""
+        offset, length = self.symbols[name][:2]
+        with self.lib_path.open("rb") as file:
+            file.seek(offset)
+            return file.read(length).decode("utf-8")
+
+    def stage(self, name: str, symbol_section: str):
+        """Adds or replaces a symbol with the next commit()"""
+        self.pending[name] = symbol_section
+
+    def discard(self):
+        self.pending = {}
+
+    def set_header(self, header: str, footer: str = ")\n"):
+        """Text around the symbols if the library has to be created"""
+        self.header = (header, footer)
+
+    def commit(self, journal: Union[ImportJournal, None] = None) -> bool:
+        """
+        Writes all staged symbols to the library.
+        :param journal: the changes are only staged in the journal and
+            written with its commit(), without one they are written at once
+        :return: True if the library was changed
+        """
+        if not self.pending:
+            return False
+
+        self.refresh()
+        pending = self.pending
+        self.pending = {}
+
+        own_journal = journal is None
+        if own_journal:
+            journal = ImportJournal(self.lib_path.parent)
+        try:
+            if not self.exists():
+                self._create(pending, journal)
+            else:
+                replace = {
+                    name: text for name, text in pending.items() if name in self.symbols
+                }
+                append = [
+                    (name, text) for name, text in pending.items() if name not in replace
+                ]
+                if replace or self.tail is None:
+                    self._rewrite(replace, append, journal)
+                else:
+                    self._append(append, journal)
+        except BaseException:
+            self._staged = None
+            if own_journal:
+                journal.abort()
+            self.load()
+            raise
+
+        journal.after(self._committed)
+        if own_journal:
+            try:
+                journal.commit()
+            except BaseException:
+                self._staged = None
+                self.load()  # the library may be changed partly
+                raise
+        return True
+
+    def _committed(self, committed: bool):
+        staged, self._staged = self._staged, None
+        if not committed:
+            self.load()
+        elif self.last_commit[0] == "rewrite":
+            self.rebuild()  # offsets behind the replaced symbols have moved
+        else:
+            symbols, self.tail, replace_all = staged
+            if replace_all:
+                self.symbols = {}
+            self.symbols.update(symbols)
+            self.save_index()
+
+    def _create(self, pending, journal: ImportJournal):
+        header, footer = self.header or ("(kicad_symbol_lib\n", ")\n")
+        symbols = {}
+        with journal.open_tmp(self.lib_path) as file:
+            offset = file.write(header.encode("utf-8"))
+            for name, text in pending.items():
+                block = text.encode("utf-8")
+                symbols[name] = [offset, len(block), *symbol_info(block)]
+                offset += file.write(block + b"\n")
+            tail = offset
+            offset += file.write(footer.encode("utf-8"))
+        journal.replace(self.lib_path)
+        self._staged = (symbols, tail, True)
+        self.last_commit = ("create", offset)
+
+    def _append(self, append, journal: ImportJournal):
+        start = self.tail
+        with self.lib_path.open("rb") as file:
+            file.seek(self.tail)
+            end = file.read()
+        blocks = []
+        symbols = {}
+        offset = self.tail
+        for name, text in append:
+            block = text.encode("utf-8") + b"\n"
+            symbols[name] = [offset, len(block) - 1, *symbol_info(block[:-1])]
+            blocks.append(block)
+            offset += len(block)
+        blocks.append(end)
+        size = journal.splice(self.lib_path, start, b"".join(blocks))
+        self._staged = (symbols, offset, False)
+        self.last_commit = ("append", size)
+
+    def _rewrite(self, replace, append, journal: ImportJournal):
+        data = self.lib_path.read_bytes()
+        if self.tail is None:  # not a valid library, rebuild the index first
+            self.rebuild()
+            if self.tail is None:
+                raise ValueError(f"{self.lib_path.name} is not a valid symbol library")
+
+        spans = sorted((self.symbols[name][:2], name) for name in replace)
+        size = 0
+        with journal.open_tmp(self.lib_path) as file:
+            position = 0
+            for (offset, length), name in spans:
+                size += file.write(data[position:offset])
+                size += file.write(replace[name].encode("utf-8"))
+                position = offset + length
+            size += file.write(data[position : self.tail])
+            for name, text in append:
+                size += file.write(text.encode("utf-8") + b"\n")
+            size += file.write(data[self.tail :])
+        journal.replace(self.lib_path)
+        self.last_commit = ("rewrite", size)
@@ -0,0 +1,41 @@
+import sys
+import unittest
+from pathlib import Path
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent / "plugins"
+if str(PLUGIN_DIR) not in sys.path:
+    sys.path.insert(0, str(PLUGIN_DIR))
+
+from legacy_convert import convert
+from s_expression_parse import parse_sexp, select_one
+
+LIB = """EESchema-LIBRARY Version 2.4
+#encoding utf-8
+DEF TEST U 0 40 Y Y 1 F N
+F0 "U" 0 100 50 H V C CNN
+F1 "TEST" 0 -100 50 H V C CNN
+DRAW
+T 900 100 0 50 0 1 1 Vertical Normal 0 C C
+T 0 0 200 50 0 1 1 Horizontal Normal 0 C C
+ENDDRAW
+ENDDEF
+#End Library
+"""
+
+
+class TextAngleTest(unittest.TestCase):
+    def test_tenths_of_a_degree(self):
+        library = parse_sexp(convert(LIB))
+        texts = {}
+        for unit in select_one(library, "symbol")[1:]:
+            if isinstance(unit, list) and unit[0] == "symbol":
+                for item in unit:
+                    if isinstance(item, list) and item[0] == "text":
+                        at = next(node for node in item if node[0] == "at")
+                        texts[item[1]] = at[3]
+        self.assertEqual(texts["Vertical"], 90)
+        self.assertEqual(texts["Horizontal"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()